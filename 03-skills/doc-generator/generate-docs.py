@@ -1,5 +1,29 @@
 #!/usr/bin/env python3
+"""
+Generate markdown API documentation from Python source code.
+
+Usage:
+    python3 generate-docs.py api.py          # one module
+    python3 generate-docs.py src/mypackage   # every module in a package tree
+    python3 generate-docs.py src/mypackage --cache .docs-cache.json
+                                             # re-parse only changed modules
+    python3 generate-docs.py src/mypackage -o API.md
+                                             # replace a file instead of stdout
+"""
+
+import argparse
 import ast
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import TextIO
+
+OUTPUT_BUFFER = 1 << 16  # Bytes buffered before each write to --output
+SKIP_DIRS = {"__pycache__", "build", "dist", "node_modules", "site-packages", "venv"}
 
 
 class APIDocExtractor(ast.NodeVisitor):
@@ -28,28 +52,299 @@ class APIDocExtractor(ast.NodeVisitor):
         return "Any"
 
 
+def extract_endpoints(path: str) -> list[dict]:
+    """Parse one source file and extract its endpoints."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    extractor = APIDocExtractor()
+    extractor.visit(tree)
+    return extractor.endpoints
+
+
+def extract_module(path: str) -> tuple:
+    """Extract endpoints in a worker process: (endpoints, error message)."""
+    try:
+        return extract_endpoints(path), None
+    except (OSError, SyntaxError, UnicodeDecodeError, ValueError) as e:
+        return [], f"{type(e).__name__}: {e}"
+
+
+def find_modules(root: str) -> list[tuple[str, str]]:
+    """Find every Python module under root as (module name, path), sorted by name."""
+    root = os.path.abspath(root)
+    # A package directory contributes its own name to module names
+    is_package = os.path.isfile(os.path.join(root, "__init__.py"))
+    base = os.path.dirname(root) if is_package else root
+
+    modules = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [
+            d for d in dirnames if not d.startswith(".") and d not in SKIP_DIRS
+        ]
+        for filename in filenames:
+            if not filename.endswith(".py"):
+                continue
+            path = os.path.join(dirpath, filename)
+            parts = os.path.relpath(path, base)[: -len(".py")].split(os.sep)
+            if parts[-1] == "__init__" and len(parts) > 1:
+                parts.pop()
+            modules.append((".".join(parts), path))
+    return sorted(modules)
+
+
+class DocCache:
+    """
+    Endpoints and rendered sections of modules, keyed by path and content hash.
+
+    Stored as compact JSON. Only entries for modules seen in the current run
+    are saved, so deleted modules drop out. Bump VERSION whenever extraction
+    or rendering changes, to invalidate existing caches. Sections are looked
+    up by module name; a name shared by two files (pkg/a.py and
+    pkg/a/__init__.py) is rendered afresh for each.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self.files = data["files"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass  # Missing or unreadable: start empty
+        self.seen = {}
+        self.by_name = {}
+        self.ambiguous = set()
+
+    def get(self, key: str, digest: str, name: str):
+        """Return the cached endpoints of an unchanged module, or None."""
+        entry = self.files.get(key)
+        if not entry or entry.get("hash") != digest or entry.get("name") != name:
+            return None
+        self._add(key, name, entry)
+        return entry["endpoints"]
+
+    def put(self, key: str, digest: str, name: str, endpoints: list[dict]) -> None:
+        """Store freshly extracted endpoints; their section is rendered later."""
+        self._add(key, name, {"hash": digest, "name": name, "endpoints": endpoints})
+
+    def _add(self, key: str, name: str, entry: dict) -> None:
+        self.seen[key] = entry
+        if self.by_name.setdefault(name, entry) is not entry:
+            self.ambiguous.add(name)
+
+    def section(self, name: str, endpoints: list[dict]) -> str:
+        """Return the module's rendered section, rendering it only if needed."""
+        entry = self.by_name.get(name)
+        if entry is None or name in self.ambiguous:
+            return render_module(name, endpoints)
+        if "section" not in entry:
+            entry["section"] = render_module(name, endpoints)
+        return entry["section"]
+
+    def save(self) -> None:
+        """Write the entries seen in this run atomically."""
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": self.VERSION, "files": self.seen}, f, separators=(",", ":")
+            )
+        os.replace(tmp, self.path)
+
+
+def file_digest(path: str) -> str:
+    """Hash a file's content."""
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def iter_package(root: str, jobs: int, cache: DocCache = None):
+    """
+    Extract the endpoints of every module under root in a process pool.
+
+    Yields (module name, endpoints) for modules that have endpoints, in
+    module name order whatever order the workers finish in, as soon as each
+    is ready, so the caller can write while later modules are parsed.
+    Modules that cannot be parsed are reported on stderr and skipped. With a
+    cache, only modules whose content changed since the cached run are
+    parsed.
+    """
+    modules = find_modules(root)
+    endpoints_by_path, digests = {}, {}
+    if cache is not None:
+        for name, path in modules:
+            key = os.path.relpath(path, root)
+            try:
+                digests[path] = file_digest(path)
+            except OSError:
+                continue  # Parsing reports the error
+            cached = cache.get(key, digests[path], name)
+            if cached is not None:
+                endpoints_by_path[path] = cached
+
+    paths = [path for _, path in modules if path not in endpoints_by_path]
+    pool = None
+    if jobs > 1 and len(paths) > 1:
+        chunksize = max(1, len(paths) // (jobs * 4))
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        results = pool.map(extract_module, paths, chunksize=chunksize)
+    else:
+        results = map(extract_module, paths)
+
+    try:
+        for name, path in modules:
+            if path in endpoints_by_path:
+                endpoints = endpoints_by_path[path]
+            else:
+                endpoints, error = next(results)
+                if error:
+                    print(f"Skipping {path}: {error}", file=sys.stderr)
+                    continue
+                if cache is not None and path in digests:
+                    key = os.path.relpath(path, root)
+                    cache.put(key, digests[path], name, endpoints)
+            if endpoints:
+                yield name, endpoints
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def extract_package(
+    root: str, jobs: int, cache: DocCache = None
+) -> list[tuple[str, list[dict]]]:
+    """Extract the endpoints of every module under root; see iter_package."""
+    return list(iter_package(root, jobs, cache))
+
+
+def render_endpoint(endpoint: dict, heading: str = "##") -> str:
+    """Render one endpoint as a markdown section."""
+    return (
+        f"{heading} {endpoint['name']}\n\n"
+        f"{endpoint['docstring']}\n\n"
+        f"**Parameters**: {', '.join(endpoint['params'])}\n\n"
+        f"**Returns**: {endpoint['returns']}\n\n"
+        "---\n\n"
+    )
+
+
+def render_module(name: str, endpoints: list[dict]) -> str:
+    """Render a module's endpoints as a markdown section."""
+    return f"## `{name}`\n\n" + "".join(
+        render_endpoint(endpoint, heading="###") for endpoint in endpoints
+    )
+
+
+def write_markdown_docs(endpoints, out: TextIO) -> None:
+    """Write markdown documentation for endpoints to ``out``, one at a time."""
+    out.write("# API Documentation\n\n")
+    for endpoint in endpoints:
+        out.write(render_endpoint(endpoint))
+
+
+def write_package_docs(modules, out: TextIO, cache: DocCache = None) -> None:
+    """
+    Write markdown documentation with one section per module to ``out``.
+
+    ``modules`` may be a generator such as iter_package(): each section is
+    written as soon as its module is ready and then dropped.
+    """
+    out.write("# API Documentation\n\n")
+    for name, endpoints in modules:
+        if cache is not None:
+            out.write(cache.section(name, endpoints))
+        else:
+            out.write(render_module(name, endpoints))
+
+
 def generate_markdown_docs(endpoints: list[dict]) -> str:
     """Generate markdown documentation from endpoints."""
-    docs = "# API Documentation\n\n"
+    docs = io.StringIO()
+    write_markdown_docs(endpoints, docs)
+    return docs.getvalue()
 
-    for endpoint in endpoints:
-        docs += f"## {endpoint['name']}\n\n"
-        docs += f"{endpoint['docstring']}\n\n"
-        docs += f"**Parameters**: {', '.join(endpoint['params'])}\n\n"
-        docs += f"**Returns**: {endpoint['returns']}\n\n"
-        docs += "---\n\n"
 
-    return docs
+def generate_package_docs(
+    modules: list[tuple[str, list[dict]]], cache: DocCache = None
+) -> str:
+    """Generate markdown documentation with one section per module."""
+    docs = io.StringIO()
+    write_package_docs(modules, docs, cache)
+    return docs.getvalue()
 
 
-if __name__ == "__main__":
-    import sys
+@contextlib.contextmanager
+def open_output(path: str):
+    """
+    Open ``path`` for writing through a temp file next to it.
 
-    with open(sys.argv[1]) as f:
-        tree = ast.parse(f.read())
+    The temp file replaces ``path`` only once everything was written, so a
+    failed or interrupted run leaves the previous document in place.
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8", buffering=OUTPUT_BUFFER) as out:
+            yield out
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
 
-    extractor = APIDocExtractor()
-    extractor.visit(tree)
 
-    markdown = generate_markdown_docs(extractor.endpoints)
-    print(markdown)
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path", help="Python file, or package directory to walk")
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="FILE",
+        help="Write the documentation to FILE, replaced once complete",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes for a directory (default: CPU count)",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="FILE",
+        help="Reuse endpoints and sections of unchanged modules from FILE "
+        "(package directories only)",
+    )
+    args = parser.parse_args()
+    if args.cache and not os.path.isdir(args.path):
+        parser.error("--cache only applies to a package directory")
+
+    if args.output:
+        output = open_output(args.output)
+    else:
+        output = contextlib.nullcontext(sys.stdout)
+    with output as out:
+        try:
+            if os.path.isdir(args.path):
+                cache = DocCache(args.cache) if args.cache else None
+                write_package_docs(
+                    iter_package(args.path, args.jobs, cache), out, cache
+                )
+                if cache is not None:
+                    cache.save()
+            else:
+                write_markdown_docs(extract_endpoints(args.path), out)
+            out.write("\n")
+            out.flush()
+        except BrokenPipeError:
+            # The reader (e.g. head) stopped early; exit without a traceback
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
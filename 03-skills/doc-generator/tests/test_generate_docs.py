@@ -0,0 +1,179 @@
+"""Tests for generate-docs.py: output must not depend on --jobs or --cache."""
+
+from __future__ import annotations
+
+import importlib.util
+import json
+import subprocess
+import sys
+from pathlib import Path
+from types import ModuleType
+
+import pytest
+
+SCRIPT = Path(__file__).resolve().parent.parent / "generate-docs.py"
+
+MODULES = {
+    "__init__.py": 'def get_version() -> str:\n    """Package version."""\n',
+    "users.py": (
+        'def get_user(user_id: int) -> dict:\n    """Fetch a user."""\n\n\n'
+        'def post_user(name, email) -> dict:\n    """Create a user."""\n'
+    ),
+    "orders.py": 'def get_order(order_id):\n    """Fetch an order."""\n',
+    "helpers.py": "def slugify(text):\n    return text.lower()\n",
+    "broken.py": "def get_broken(:\n",
+    "api/__init__.py": "",
+    "api/items.py": (
+        'def get_items(page: int = 1) -> list[dict]:\n    """List items."""\n'
+    ),
+    "api/legacy.py": 'def get_legacy():\n    """Old endpoint."""\n',
+}
+
+
+def generate(root: Path, output: Path, *options: str) -> str:
+    """Run generate-docs.py on root and return the document it wrote."""
+    subprocess.run(
+        [sys.executable, str(SCRIPT), str(root), "-o", str(output), *options],
+        check=True,
+        capture_output=True,
+    )
+    return output.read_text(encoding="utf-8")
+
+
+@pytest.fixture
+def docgen() -> ModuleType:
+    """Load generate-docs.py to call its functions in this process."""
+    spec = importlib.util.spec_from_file_location("generate_docs", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def package(tmp_path: Path) -> Path:
+    """A package tree with endpoints, helpers and a module that fails to parse."""
+    root = tmp_path / "shop"
+    for name, source in MODULES.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(source, encoding="utf-8")
+    return root
+
+
+def test_output_is_independent_of_jobs_and_cache(package: Path, tmp_path: Path) -> None:
+    cache = tmp_path / "docs-cache.json"
+    output = tmp_path / "API.md"
+
+    expected = generate(package, output, "-j1")
+    assert "## `shop.api.items`" in expected
+    assert "get_broken" not in expected
+    assert generate(package, output, "-j2") == expected
+    assert generate(package, output, "-j2", "--cache", str(cache)) == expected
+    assert generate(package, output, "-j1", "--cache", str(cache)) == expected
+
+    # Edit one module and delete another, then reuse the warm cache
+    (package / "orders.py").write_text(
+        'def get_order(order_id, expand=False):\n    """Fetch an order, expanded."""\n'
+    )
+    (package / "api" / "legacy.py").unlink()
+
+    expected = generate(package, output, "-j1")
+    assert "expanded" in expected
+    assert "get_legacy" not in expected
+    assert generate(package, output, "-j2") == expected
+    assert generate(package, output, "-j2", "--cache", str(cache)) == expected
+    assert generate(package, output, "-j1", "--cache", str(cache)) == expected
+
+    cached = json.loads(cache.read_text(encoding="utf-8"))["files"]
+    assert str(Path("api", "legacy.py")) not in cached
+
+
+def test_warm_cache_parses_only_changed_modules(
+    docgen: ModuleType, package: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    parsed = []
+    extract_module = docgen.extract_module
+    monkeypatch.setattr(
+        docgen,
+        "extract_module",
+        lambda path: parsed.append(path) or extract_module(path),
+    )
+
+    def run() -> str:
+        cache = docgen.DocCache(str(tmp_path / "docs-cache.json"))
+        docs = docgen.generate_package_docs(
+            docgen.iter_package(str(package), 1, cache), cache
+        )
+        cache.save()
+        return docs
+
+    cold = run()
+    assert len(parsed) == len(MODULES)
+    parsed.clear()
+    assert run() == cold
+    assert parsed == [str(package / "broken.py")]  # Failures are never cached
+
+    parsed.clear()
+    (package / "orders.py").write_text('def get_order():\n    """Changed."""\n')
+    assert "Changed." in run()
+    assert sorted(parsed) == [str(package / "broken.py"), str(package / "orders.py")]
+
+
+def test_cache_keeps_modules_with_the_same_name_apart(
+    package: Path, tmp_path: Path
+) -> None:
+    # shop/api.py and shop/api/__init__.py are both the module shop.api
+    (package / "api.py").write_text('def get_flat():\n    """Flat module."""\n')
+    (package / "api" / "__init__.py").write_text(
+        'def get_nested():\n    """Package init."""\n'
+    )
+    cache = tmp_path / "docs-cache.json"
+    output = tmp_path / "API.md"
+
+    expected = generate(package, output, "-j1")
+    assert "Flat module." in expected
+    assert "Package init." in expected
+    assert generate(package, output, "-j1", "--cache", str(cache)) == expected
+    assert generate(package, output, "-j1", "--cache", str(cache)) == expected
+
+
+def test_cache_is_rejected_for_a_single_file(package: Path, tmp_path: Path) -> None:
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), str(package / "users.py")]
+        + ["--cache", str(tmp_path / "docs-cache.json")],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 2
+    assert "--cache only applies to a package directory" in result.stderr
+    assert not (tmp_path / "docs-cache.json").exists()
+
+
+def test_interrupted_output_keeps_the_previous_document(
+    docgen: ModuleType,
+    package: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    output = tmp_path / "API.md"
+    previous = generate(package, output, "-j1")
+    (package / "users.py").write_text('def get_user():\n    """Changed."""\n')
+
+    render_module = docgen.render_module
+    rendered = []
+
+    def interrupt_after_one(name: str, endpoints: list) -> str:
+        rendered.append(name)
+        if len(rendered) > 1:
+            raise KeyboardInterrupt
+        return render_module(name, endpoints)
+
+    monkeypatch.setattr(docgen, "render_module", interrupt_after_one)
+    monkeypatch.setattr(
+        sys, "argv", ["generate-docs.py", str(package), "-j1", "-o", str(output)]
+    )
+    with pytest.raises(KeyboardInterrupt):
+        docgen.main()
+
+    assert output.read_text(encoding="utf-8") == previous
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["API.md", "shop"]
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Tokenizer Benchmark - Measures speed and accuracy of the context tracker backends.
+
+Counts the text of sample transcripts with every backend in
+context-tracker.py and reports throughput and error against reference
+counts from tiktoken (p50k_base, in-process).
+
+With --save, the measured speeds and the calibration ratios refitted on the
+samples are written to the profile that context-tracker.py reads, so auto
+backend selection forecasts with this machine's numbers.
+
+Usage:
+    python3 benchmark-tokenizers.py                    # recent ~/.claude transcripts
+    python3 benchmark-tokenizers.py session.jsonl ...  # specific transcripts
+    python3 benchmark-tokenizers.py --save             # also update the profile
+"""
+
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+
+TRACKER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "context-tracker.py"
+)
+
+
+def load_tracker():
+    """Import context-tracker.py, whose file name is not a module name."""
+    spec = importlib.util.spec_from_file_location("context_tracker", TRACKER_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def find_samples(limit: int) -> list:
+    """Most recently modified Claude Code transcripts."""
+    pattern = os.path.expanduser("~/.claude/projects/*/*.jsonl")
+    return sorted(glob.glob(pattern), key=os.path.getmtime, reverse=True)[:limit]
+
+
+def time_count(count, blocks: list, repeat: int) -> tuple:
+    """Best of ``repeat`` runs: (tokens, seconds)."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = count(blocks)
+        best = min(best, time.perf_counter() - start)
+    return tokens, best
+
+
+def measure_startup_ms() -> float:
+    """Milliseconds a new process spends importing tiktoken and loading ranks."""
+    code = f"import tiktoken; tiktoken.get_encoding({load_tracker().ENCODING!r})"
+
+    def run(source: str) -> float:
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", source], check=True)
+        return time.perf_counter() - start
+
+    return max(0.0, (min(run(code) for _ in range(3)) - run("pass")) * 1000)
+
+
+def fit_ratios(tracker, samples: list, reference) -> dict:
+    """Characters per token for each content type, measured with tiktoken."""
+    chars, tokens = {}, {}
+    for blocks in samples:
+        for segment in (s for block in blocks for s in tracker.split_segments(block)):
+            kind = tracker.classify_segment(segment)
+            non_ascii = len(segment) - len(segment.encode("ascii", "ignore"))
+            chars[kind] = chars.get(kind, 0) + len(segment) - non_ascii
+            tokens[kind] = (
+                tokens.get(kind, 0)
+                + reference([segment])
+                - non_ascii * tracker.NON_ASCII_TOKENS
+            )
+    return {
+        kind: round(chars[kind] / tokens[kind], 3)
+        for kind in chars
+        if chars[kind] and tokens[kind] > 0
+    }
+
+
+def save_profile(path: str, profile: dict) -> None:
+    """Write the profile atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp, path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("transcripts", nargs="*", help="JSONL transcripts to count")
+    parser.add_argument(
+        "--limit", type=int, default=5, help="Recent transcripts to use"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement")
+    parser.add_argument(
+        "--save", action="store_true", help="Update the tracker profile"
+    )
+    args = parser.parse_args()
+
+    tracker = load_tracker()
+    paths = args.transcripts or find_samples(args.limit)
+    # Text blocks of each transcript, counted as the hook counts them
+    samples = [tracker.read_transcript(path)[0] for path in paths]
+    samples = [blocks for blocks in samples if any(blocks)]
+    if not samples:
+        print("No transcript text found", file=sys.stderr)
+        return 1
+
+    tiktoken_backend = tracker.TiktokenBackend()
+    has_tiktoken = tiktoken_backend.available()
+
+    def reference(blocks: list) -> int:
+        return sum(tiktoken_backend.count_local(blocks))
+
+    ref_counts = [reference(blocks) for blocks in samples] if has_tiktoken else None
+
+    profile = tracker.load_profile()
+    total_chars = sum(len(block) for blocks in samples for block in blocks)
+    print(f"{len(samples)} transcripts, {total_chars:,} characters")
+    if not has_tiktoken:
+        print("tiktoken not installed: no reference counts, errors not shown")
+    print(f"{'backend':<12}{'tokens':>14}{'tokens/s':>20}{'Mchars/s':>12}{'error':>9}")
+
+    speeds = {}
+    for backend in tracker.get_backends(profile):
+        if not backend.available():
+            continue
+        count = reference if backend.name == "tiktoken" else backend.count_blocks
+        tokens = seconds = 0
+        errors = []
+        for i, blocks in enumerate(samples):
+            n, elapsed = time_count(count, blocks, args.repeat)
+            tokens += n
+            seconds += elapsed
+            if ref_counts and ref_counts[i]:
+                errors.append(abs(n - ref_counts[i]) / ref_counts[i])
+        seconds = max(seconds, 1e-9)
+        speeds[backend.name] = {"chars_per_second": round(total_chars / seconds)}
+        error = f"{sum(errors) / len(errors):.1%}" if errors else "-"
+        print(
+            f"{backend.name:<12}{tokens:>14,}{tokens / seconds:>20,.0f}"
+            f"{total_chars / seconds / 1e6:>12.1f}{error:>9}"
+        )
+
+    if has_tiktoken:
+        speeds["tiktoken"]["startup_ms"] = round(measure_startup_ms(), 1)
+        print(
+            f"tiktoken startup in a new process: {speeds['tiktoken']['startup_ms']} ms"
+        )
+        ratios = fit_ratios(tracker, samples, reference)
+        print(f"Fitted characters per token: {ratios}")
+        profile["ratios"] = ratios
+
+    if args.save:
+        profile["backends"] = speeds
+        profile["samples"] = len(samples)
+        profile["measured_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        save_profile(tracker.get_profile_file(), profile)
+        print(f"Saved {tracker.get_profile_file()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
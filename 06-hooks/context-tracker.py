@@ -5,28 +5,450 @@ Context Usage Tracker - Tracks token consumption per request.
 Uses UserPromptSubmit as "pre-message" hook and Stop as "post-response" hook
 to calculate the delta in token usage for each request.
 
-This version uses character-based estimation (no dependencies).
-For better accuracy, see context-tracker-tiktoken.py.
+Token counting backends (CLAUDE_TOKENIZER_BACKEND):
+    auto        Most accurate backend that fits the latency budget (default)
+    tiktoken    tiktoken with p50k_base encoding, ~90-95% accuracy
+                (requires: pip install tiktoken)
+    calibrated  Per-content-type characters-per-token ratios for prose, code
+                and JSON, no dependencies
+    estimate    ~4 characters per token, no dependencies, ~80-90% accuracy
+
+In auto mode, each call forecasts how long every backend would take for the
+text it has to count (from benchmark-tokenizers.py results, or built-in
+defaults) and uses the most accurate one that fits in
+CLAUDE_TOKENIZER_BUDGET_MS milliseconds. A chosen backend that would exceed
+the budget is replaced for that call by the next most accurate backend that
+fits, with a warning on stderr, and the report names the backends used. A
+budget of 0 disables the limit.
+
+Session state, the token memo, the ledger and the latency histogram live in
+one per-user SQLite database (context_store.py, WAL mode), opened once per
+hook call. Without context_store.py or SQLite, session state falls back to a
+temp file per session and the other three are off.
+
+Token counts of text blocks of MEMO_MIN_CHARS or more are memoized in an LRU
+keyed by a hash of the backend and the text, so files re-read and identical
+outputs repeated across sessions are tokenized once. Set CLAUDE_TOKEN_MEMO=0
+to disable it.
+
+Sessions not updated for CLAUDE_CONTEXT_SESSION_TTL_DAYS days are pruned
+once a day.
+
+Every hook call also overwrites a fixed-size usage record for its session
+(tokens, delta of the last request, limit, percentage, timestamp), so
+statuslines and dashboards can show usage without reading transcripts:
+    python3 context-tracker.py --sessions [--json]   # active sessions
+    python3 context-tracker.py --statusline          # statusLine command
+
+With CLAUDE_CONTEXT_LEDGER=1, every transcript block read (text, thinking,
+tool calls and tool results) is also appended to the ledger with its role,
+type, tool name, token count and timestamp. Aggregate it without re-reading
+any transcript:
+    python3 context-tracker.py --ledger [--by tool|session|role|type|day]
+                                        [--since DATE] [--until DATE]
+
+Each call records how long it spent parsing input, reading the transcript,
+tokenizing and writing state in the latency histogram. Print its percentiles
+with:
+    python3 context-tracker.py --latency
 
 Usage:
     Configure both hooks to use the same script:
     - UserPromptSubmit: saves current token count
     - Stop: calculates delta and reports usage
+
+Counting is incremental: the session state remembers how far into the
+transcript it has read and the running token count, so each call only
+tokenizes the lines appended since the previous one.
+
+Counting is also compaction-aware: after /compact or auto-compaction the
+context is the summary plus what follows, so counting starts at the latest
+compaction boundary. The first call of a session finds it by scanning the
+transcript backwards from the end.
+
+The tiktoken backend uses tokenizer-service.py, a per-user background process
+that keeps the encoding loaded, so hook calls skip importing tiktoken and
+loading its BPE ranks. The first call starts the service and counts
+in-process; the hook also counts in-process whenever the service is
+unavailable. Set CLAUDE_TOKENIZER_SERVICE=0 to always count in-process.
+
+Both count text blocks in batches of about a megabyte with tiktoken's batch
+encoder, spread over CLAUDE_TOKENIZER_THREADS threads (default: all CPUs),
+without joining the transcript into one string.
 """
+import argparse
+import contextlib
+import datetime
+import importlib.util
 import json
+import mmap
 import os
+import re
+import socket
+import stat
+import subprocess
+import struct
 import sys
 import tempfile
+import time
+import zlib
+
+try:
+    import context_store
+except ImportError:  # Not copied, or Python without SQLite: per-session files
+    context_store = None
 
 # Configuration
 CONTEXT_LIMIT = 128000  # Claude's context window (adjust for your model)
+TAIL_BYTES = 64  # Bytes before the saved offset used to detect a rewritten transcript
+SCAN_CHUNK = 1 << 20  # Bytes read per step when scanning backwards for a boundary
+FAST_JSON_MIN_BYTES = 1 << 20  # Use orjson, if installed, for reads this large
+BACKEND = os.environ.get("CLAUDE_TOKENIZER_BACKEND", "auto")
+LATENCY_BUDGET_MS = float(os.environ.get("CLAUDE_TOKENIZER_BUDGET_MS", "100"))
+ENCODING = "p50k_base"
+USE_SERVICE = os.environ.get("CLAUDE_TOKENIZER_SERVICE", "1") != "0"
+SERVICE_TIMEOUT = 2.0  # Seconds to wait for the tokenizer service
+SERVICE_RETRY = 300  # Seconds before starting the service again after a failed start
+BATCH_CHARS = 1 << 20  # Characters of text blocks encoded per batch
+PARALLEL_MIN_CHARS = 1 << 16  # Smaller batches are encoded on one thread
+THREADS = int(os.environ.get("CLAUDE_TOKENIZER_THREADS", "0")) or os.cpu_count() or 1
+RECORD_TIMINGS = os.environ.get("CLAUDE_CONTEXT_TIMINGS", "1") != "0"
+USE_MEMO = os.environ.get("CLAUDE_TOKEN_MEMO", "1") != "0"
+MEMO_MIN_CHARS = 256  # Shorter blocks are cheaper to count than to look up
+MEMO_MAX_ENTRIES = 200_000  # About 10 MB; least recently used entries go first
+SESSION_TTL = float(os.environ.get("CLAUDE_CONTEXT_SESSION_TTL_DAYS", "14")) * 86400
+PRUNE_INTERVAL = 86400  # Seconds between prunes of stale sessions
+STORE_TIMEOUT = 1.0  # Seconds to wait for another hook's write to the store
+USE_LEDGER = os.environ.get("CLAUDE_CONTEXT_LEDGER", "0") == "1"
+ACTIVE_MINUTES = float(os.environ.get("CLAUDE_CONTEXT_ACTIVE_MINUTES", "60"))
+SERVICE_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tokenizer-service.py"
+)
+
+# Characters per token for p50k_base, refitted by benchmark-tokenizers.py --save
+DEFAULT_RATIOS = {"prose": 4.2, "code": 3.3, "json": 2.9}
+NON_ASCII_TOKENS = 0.8  # Tokens per non-ASCII character (accents, CJK, emoji)
+
+# Forecast inputs per backend, replaced by benchmark-tokenizers.py --save
+DEFAULT_PROFILE = {
+    "tiktoken": {"chars_per_second": 4e6, "startup_ms": 250.0},
+    "calibrated": {"chars_per_second": 60e6, "startup_ms": 0.0},
+    "estimate": {"chars_per_second": 1e12, "startup_ms": 0.0},
+}
+
+# Latency histogram: geometric buckets from 0.05 ms to about a minute
+HISTOGRAM_BUCKETS_MS = [0.05 * 1.25**i for i in range(64)]
+HISTOGRAM_MAX_SAMPLES = 10000  # Halve all counts past this, favouring recent calls
+PHASES = ("parse", "read", "tokenize", "state", "ledger", "total")
+
+# Usage record: magic, version, flags, tokens, delta, limit, percentage,
+# updated, followed by a CRC32 of those fields to detect torn reads
+USAGE_RECORD = struct.Struct("<4sHHqqqdd")
+USAGE_CHECK = struct.Struct("<I")
+USAGE_SIZE = USAGE_RECORD.size + USAGE_CHECK.size
+USAGE_MAGIC = b"CTXU"
+USAGE_VERSION = 1
+USAGE_ESTIMATED = 1  # Flag: the count is (partly) estimated
+
+_SEGMENT_RE = re.compile(r"\n\s*\n")
+_COMPACTION_MARKERS = (b'"compact_boundary"', b'"isCompactSummary"')
+# Block types that only occur in list content (compact and json.dumps spacing)
+_TOOL_BLOCK_MARKERS = tuple(
+    f'"type"{colon}"{kind}"'.encode()
+    for kind in ("tool_use", "tool_result")
+    for colon in (":", ": ")
+)
+_CODE_CHARS = "{}()[];=<>_/\\|&*$"
 
 
 def get_state_file(session_id: str) -> str:
-    """Get temp file path for storing pre-message token count, isolated by session."""
+    """Get the per-session temp file used when the state store is unavailable."""
     return os.path.join(tempfile.gettempdir(), f"claude-context-{session_id}.json")
 
 
+def get_store_file() -> str:
+    """Get the per-user database of sessions, memo, ledger and latency."""
+    return os.path.join(get_cache_dir(), "context.sqlite")
+
+
+def get_cache_dir() -> str:
+    """Get the per-user directory for profiles and latency data."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "claude-context")
+
+
+def get_service_marker() -> str:
+    """Get the file whose modification time is the last service start."""
+    return os.path.join(get_cache_dir(), "service-start")
+
+
+def get_profile_file() -> str:
+    """Get the file holding benchmark results and calibrated ratios."""
+    return os.path.join(get_cache_dir(), "tokenizers.json")
+
+
+def get_usage_dir() -> str:
+    """Get the per-user directory holding one usage record per session."""
+    return os.path.join(get_cache_dir(), "usage")
+
+
+def get_usage_file(session_id: str) -> str:
+    """Get the usage record of a session."""
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id)
+    return os.path.join(get_usage_dir(), f"{name}.usage")
+
+
+def load_profile() -> dict:
+    """Load benchmark results, or an empty profile if there are none."""
+    try:
+        with open(get_profile_file(), "r") as f:
+            profile = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return profile if isinstance(profile, dict) else {}
+
+
+def get_socket_path() -> str:
+    """Get the tokenizer service socket (same rules as tokenizer-service.py)."""
+    override = os.environ.get("CLAUDE_TOKENIZER_SOCKET")
+    if override:
+        return override
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(
+        tempfile.gettempdir(), f"claude-tokenizer-{os.getuid()}"
+    )
+    return os.path.join(runtime_dir, "claude-tokenizer.sock")
+
+
+def socket_owned(path: str) -> bool:
+    """Check that ``path`` is a socket created by this user, not by someone else."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+def start_service() -> None:
+    """Start the tokenizer service in the background, detached from the hook."""
+    if not os.path.exists(SERVICE_SCRIPT):
+        return
+    try:
+        subprocess.Popen(
+            [sys.executable, SERVICE_SCRIPT],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError:
+        pass
+
+
+def service_available() -> bool:
+    """Check whether the tokenizer service can be used at all."""
+    return USE_SERVICE and hasattr(socket, "AF_UNIX")
+
+
+_service_checked = False
+_service_running = None  # Unknown until probed or used in this hook call
+
+
+def service_running() -> bool:
+    """
+    Check, once per hook call, whether the service is accepting connections.
+
+    A socket file alone is not enough: a killed service leaves it behind, and
+    connecting to it is refused.
+    """
+    global _service_running
+    if _service_running is None:
+        _service_running = False
+        path = get_socket_path()
+        if service_available() and socket_owned(path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(SERVICE_TIMEOUT)
+                try:
+                    sock.connect(path)
+                    _service_running = True
+                except OSError:
+                    pass
+    return _service_running
+
+
+def ensure_service() -> None:
+    """
+    Start the tokenizer service if tiktoken may be used and it is not running.
+
+    Checked at most once per hook call. Each start is recorded; while a
+    started service has not come up, no new start is attempted for
+    SERVICE_RETRY seconds, so a service that keeps failing does not cost
+    every hook call a process spawn. The new service replaces a stale socket.
+    """
+    global _service_checked
+    if _service_checked or BACKEND not in ("auto", "tiktoken"):
+        return
+    _service_checked = True
+    if not service_available() or service_running():
+        return
+    if not TiktokenBackend().available():
+        return
+    marker = get_service_marker()
+    try:
+        if time.time() - os.stat(marker).st_mtime < SERVICE_RETRY:
+            return
+    except OSError:
+        pass
+    try:
+        os.makedirs(os.path.dirname(marker), exist_ok=True)
+        with open(marker, "w"):
+            pass
+    except OSError:
+        return  # Without a record every call would retry; count in-process
+    start_service()
+
+
+def count_tokens_service(texts: list):
+    """
+    Count the tokens of each text with the tokenizer service.
+
+    Returns the counts, or None if the service cannot answer. If it is not
+    running, it is started for the next call (see ensure_service).
+    """
+    global _service_running
+    if not service_available():
+        return None
+    path = get_socket_path()
+    if not socket_owned(path):
+        # Missing, or not created by this user's service: never send it text
+        _service_running = False
+        ensure_service()
+        return None
+    try:
+        # UTF-8 sizes without keeping encoded copies: ASCII needs no encoding
+        sizes = [
+            len(text) if text.isascii() else len(text.encode("utf-8"))
+            for text in texts
+        ]
+    except UnicodeEncodeError:
+        return None
+
+    header = {"encoding": ENCODING, "sizes": sizes}
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(SERVICE_TIMEOUT)
+            sock.connect(path)
+            _service_running = True
+            sock.sendall(json.dumps(header).encode() + b"\n")
+            for text in texts:  # One encoded text alive at a time
+                sock.sendall(text.encode("utf-8"))
+            reply = json.loads(sock.makefile("rb").readline())
+    except (FileNotFoundError, ConnectionRefusedError):
+        # A stale socket from a killed service; a new one replaces it
+        _service_running = False
+        ensure_service()
+        return None
+    except (OSError, ValueError):
+        return None
+
+    counts = reply.get("counts") if isinstance(reply, dict) else None
+    if not isinstance(counts, list) or len(counts) != len(texts):
+        return None
+    return counts
+
+
+# =============================================================================
+# Latency Instrumentation
+# =============================================================================
+
+
+class PhaseTimer:
+    """Accumulates wall-clock time per hook phase."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def milliseconds(self) -> dict:
+        """Phase times in milliseconds, including the total so far."""
+        times = {name: seconds * 1000 for name, seconds in self.phases.items()}
+        times["total"] = (time.perf_counter() - self.started) * 1000
+        return times
+
+
+TIMER = PhaseTimer()
+
+
+def bucket_index(ms: float) -> int:
+    """Index of the histogram bucket holding ``ms``."""
+    for i, edge in enumerate(HISTOGRAM_BUCKETS_MS):
+        if ms <= edge:
+            return i
+    return len(HISTOGRAM_BUCKETS_MS) - 1
+
+
+def record_timings(timings: dict) -> None:
+    """Add one call's phase timings to the per-user latency histogram."""
+    store = get_store()
+    if store is None:
+        return
+    try:
+        store.add_timings({name: bucket_index(ms) for name, ms in timings.items()})
+    except context_store.Error:
+        pass  # Timing data is best effort; never fail the hook over it
+
+
+def percentile(counts: list, fraction: float) -> float:
+    """Estimate a percentile from bucket counts (bucket upper edge)."""
+    target = fraction * sum(counts)
+    seen = 0
+    for i, count in enumerate(counts):
+        seen += count
+        if seen >= target and count:
+            return HISTOGRAM_BUCKETS_MS[i]
+    return 0.0
+
+
+def print_latency_report() -> None:
+    """Print p50, p95 and p99 per phase from the latency histogram."""
+    store = get_store() if os.path.exists(get_store_file()) else None
+    phases = store.latency_histogram(len(HISTOGRAM_BUCKETS_MS)) if store else {}
+    if not phases:
+        print(f"No timings recorded yet in {get_store_file()}")
+        return
+    print(f"{'phase':<10}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name in PHASES:
+        counts = phases.get(name)
+        if not counts:
+            continue
+        print(
+            f"{name:<10}{sum(counts):>8}"
+            + "".join(f"{percentile(counts, q):>10.2f}" for q in (0.5, 0.95, 0.99))
+        )
+
+
+# =============================================================================
+# Tokenizer Backends
+# =============================================================================
+
+
+class OverBudget(Exception):
+    """Counting this text would exceed the latency budget."""
+
+
+def within_budget(ms: float) -> bool:
+    """Check a forecast against CLAUDE_TOKENIZER_BUDGET_MS (0 means no limit)."""
+    return LATENCY_BUDGET_MS <= 0 or ms <= LATENCY_BUDGET_MS
+
+
 def count_tokens_estimate(text: str) -> int:
     """
     Estimate token count using character-based approximation.
@@ -37,29 +459,883 @@ def count_tokens_estimate(text: str) -> int:
     return len(text) // 4
 
 
-def read_transcript(transcript_path: str) -> str:
-    """Read and concatenate all content from transcript file."""
-    if not transcript_path or not os.path.exists(transcript_path):
-        return ""
+def classify_segment(segment: str) -> str:
+    """Guess whether a paragraph is prose, code or JSON from its characters."""
+    stripped = segment.strip()
+    if stripped[:1] in ("{", "[") and stripped[-1:] in ("}", "]"):
+        return "json"
+    symbols = sum(segment.count(c) for c in _CODE_CHARS)
+    if symbols * 12 > len(segment) or "\n    " in segment:
+        return "code"
+    return "prose"
+
+
+def split_segments(text: str) -> list:
+    """Split text into paragraphs, each classified on its own."""
+    return _SEGMENT_RE.split(text)
+
+
+class TokenizerBackend:
+    """Interface of a token counting backend."""
+
+    name = ""
+    label = ""
+    memoize = False  # Whether counting costs more than a memo lookup
+
+    def available(self) -> bool:
+        return True
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+    def count_many(self, texts: list) -> list:
+        """Count each text separately."""
+        return [self.count(text) for text in texts]
+
+    def count_blocks(self, blocks: list) -> int:
+        """Count text blocks as one transcript."""
+        return sum(self.count_many(blocks))
+
+    def memo_namespace(self) -> str:
+        """Everything besides the text that a memoized count depends on."""
+        return self.name
+
+
+class EstimateBackend(TokenizerBackend):
+    """~4 characters per token."""
+
+    name = "estimate"
+    label = "estimated"
+
+    def count(self, text: str) -> int:
+        return count_tokens_estimate(text)
+
+    def count_blocks(self, blocks: list) -> int:
+        # As if joined by newlines, without building the joined string
+        return max(0, sum(map(len, blocks)) + len(blocks) - 1) // 4
+
+
+class CalibratedBackend(TokenizerBackend):
+    """Characters-per-token ratios per content type, fitted against tiktoken."""
+
+    name = "calibrated"
+    label = "calibrated"
+    memoize = True
+
+    def __init__(self, ratios: dict = None):
+        self.ratios = dict(DEFAULT_RATIOS, **(ratios or {}))
+
+    def memo_namespace(self) -> str:
+        return f"{self.name}:{sorted(self.ratios.items())}:{NON_ASCII_TOKENS}"
+
+    def count(self, text: str) -> int:
+        tokens = 0.0
+        for segment in split_segments(text):
+            non_ascii = len(segment) - len(segment.encode("ascii", "ignore"))
+            ratio = self.ratios[classify_segment(segment)]
+            tokens += (len(segment) - non_ascii) / ratio + non_ascii * NON_ASCII_TOKENS
+        return round(tokens)
+
+
+class TiktokenBackend(TokenizerBackend):
+    """
+    tiktoken with p50k_base encoding, via the tokenizer service if possible.
+
+    This provides ~90-95% accuracy compared to Claude's actual tokenizer.
+
+    Note: Anthropic hasn't released an official offline tokenizer.
+    tiktoken with p50k_base is a reasonable approximation since both
+    Claude and GPT models use BPE (byte-pair encoding).
+    """
+
+    name = "tiktoken"
+    label = "tiktoken"
+    memoize = True
+
+    def __init__(self, profile: dict = None):
+        self.profile = profile or {}
+
+    def available(self) -> bool:
+        return importlib.util.find_spec("tiktoken") is not None
+
+    def memo_namespace(self) -> str:
+        return f"{self.name}:{ENCODING}"
+
+    def count(self, text: str) -> int:
+        return self.count_many([text])[0] if text else 0
+
+    def count_many(self, texts: list) -> list:
+        if not texts:
+            return []
+        counts = count_tokens_service(texts)
+        if counts is not None:
+            return counts
+        chars = sum(map(len, texts))
+        if not within_budget(forecast_ms(self, chars, self.profile, True)):
+            raise OverBudget(self.name)
+        return self.count_local(texts)
+
+    def count_local(self, texts: list) -> list:
+        import tiktoken
+
+        return count_batched(tiktoken.get_encoding(ENCODING), texts)
+
+
+def count_batched(enc, texts: list) -> list:
+    """
+    Count each text with ``enc`` in batches of about BATCH_CHARS characters.
+
+    Batches large enough to pay for it are encoded by tiktoken on THREADS
+    threads (its encoder releases the GIL). Only one batch of token lists is
+    alive at a time, and special-token strings in the text count as text.
+    """
+    counts, batch, chars = [], [], 0
+    for i, text in enumerate(texts):
+        batch.append(text)
+        chars += len(text)
+        if chars < BATCH_CHARS and i + 1 < len(texts):
+            continue
+        threads = min(THREADS, len(batch))
+        if threads > 1 and chars >= PARALLEL_MIN_CHARS:
+            tokens = enc.encode_ordinary_batch(batch, num_threads=threads)
+            counts.extend(map(len, tokens))
+        else:
+            counts.extend(len(enc.encode_ordinary(text)) for text in batch)
+        batch, chars = [], 0
+    return counts
+
+
+def get_backends(profile: dict) -> list:
+    """All backends, most accurate first."""
+    return [
+        TiktokenBackend(profile),
+        CalibratedBackend(profile.get("ratios")),
+        EstimateBackend(),
+    ]
+
+
+def forecast_ms(backend, chars: int, profile: dict, in_process: bool = False) -> float:
+    """Forecast how long ``backend`` takes to count ``chars`` characters."""
+    measured = profile.get("backends", {}).get(backend.name, {})
+    speed = dict(DEFAULT_PROFILE[backend.name], **measured)
+    startup_ms = speed["startup_ms"]
+    if backend.name == "tiktoken" and not in_process and service_running():
+        startup_ms = 0.0  # Encoding already loaded by the service
+    return startup_ms + chars / speed["chars_per_second"] * 1000
+
+
+def select_backend(chars: int, profile: dict = None):
+    """
+    Pick the backend for counting ``chars`` characters.
 
+    A backend named in CLAUDE_TOKENIZER_BACKEND is used as long as it is
+    available and forecast to finish within the latency budget; otherwise
+    the next most accurate backend that fits is used, with a warning. In
+    auto mode, the most accurate backend that fits the budget is used. The
+    estimate is the fallback either way.
+    """
+    profile = load_profile() if profile is None else profile
+    backends = get_backends(profile)
+    if BACKEND != "auto":
+        for backend in backends:
+            if backend.name == BACKEND:
+                if backend.available():
+                    if within_budget(forecast_ms(backend, chars, profile)):
+                        return backend
+                    return over_budget_fallback(backend.name, chars, profile)
+                print(
+                    f"Warning: {BACKEND} tokenizer not available "
+                    "(pip install tiktoken), using estimation",
+                    file=sys.stderr,
+                )
+                return backends[-1]
+        print(f"Warning: unknown tokenizer backend {BACKEND!r}", file=sys.stderr)
+
+    for backend in backends:
+        if backend.available() and within_budget(forecast_ms(backend, chars, profile)):
+            return backend
+    return backends[-1]
+
+
+def over_budget_fallback(name: str, chars: int, profile: dict = None):
+    """
+    Pick a backend to replace backend ``name``, which would exceed the budget.
+
+    This is the most accurate of the less accurate backends that is forecast
+    to fit, or the estimate. Replacing a backend named in
+    CLAUDE_TOKENIZER_BACKEND is reported on stderr.
+    """
+    profile = load_profile() if profile is None else profile
+    backends = get_backends(profile)
+    names = [backend.name for backend in backends]
+    start = names.index(name) + 1 if name in names else len(backends)
+    fallback = backends[-1]
+    for backend in backends[start:-1]:
+        if backend.available() and within_budget(forecast_ms(backend, chars, profile)):
+            fallback = backend
+            break
+    if name == BACKEND:
+        print(
+            f"Warning: {name} tokenizer would exceed the {LATENCY_BUDGET_MS:g} ms "
+            f"budget (CLAUDE_TOKENIZER_BUDGET_MS), using {fallback.name}",
+            file=sys.stderr,
+        )
+    return fallback
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with the backend selected for this text."""
+    try:
+        return select_backend(len(text)).count(text)
+    except OverBudget as e:
+        return over_budget_fallback(str(e), len(text)).count(text)
+
+
+# =============================================================================
+# Token Memo
+# =============================================================================
+
+
+def count_blocks(backend, blocks: list) -> int:
+    """Count the tokens of transcript text blocks with ``backend``."""
+    if not (USE_MEMO and backend.memoize):
+        return backend.count_blocks(blocks)
+    return sum(count_each(backend, blocks))
+
+
+def count_each(backend, blocks: list) -> list:
+    """
+    Count the tokens of each block with ``backend``.
+
+    For backends worth memoizing, blocks of MEMO_MIN_CHARS or more are looked
+    up in the token memo first. Misses and short blocks are counted in one
+    batch and the new counts are added to the memo. The memo is best effort:
+    if it cannot be used, everything is counted.
+    """
+    store = get_store() if USE_MEMO and backend.memoize else None
+    if store is None:
+        return backend.count_many(blocks)
+    long_blocks = [block for block in blocks if len(block) >= MEMO_MIN_CHARS]
+    if not long_blocks:
+        return backend.count_many(blocks)
+
+    namespace = backend.memo_namespace()
+    keys = [store.memo_key(namespace, block) for block in long_blocks]
+    try:
+        known = store.memo_get(list(set(keys)))
+    except context_store.Error:
+        known = {}
+
+    misses = {}
+    for key, block in zip(keys, long_blocks):
+        if key not in known:
+            misses.setdefault(key, block)
+    short_blocks = [block for block in blocks if len(block) < MEMO_MIN_CHARS]
+    counts = backend.count_many(list(misses.values()) + short_blocks)
+    new = dict(zip(misses, counts))
+    long_counts = iter(known.get(key, new.get(key, 0)) for key in keys)
+    short_counts = iter(counts[len(misses) :])
+    tokens = [
+        next(long_counts if len(block) >= MEMO_MIN_CHARS else short_counts)
+        for block in blocks
+    ]
+    try:
+        store.memo_update(list(known), new)
+    except context_store.Error:
+        pass
+    return tokens
+
+
+# =============================================================================
+# Transcript and State
+# =============================================================================
+
+
+def prune_files(directory: str, prefix: str, suffix: str, cutoff: float) -> None:
+    """Delete per-session files in ``directory`` last written before ``cutoff``."""
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if not (entry.name.startswith(prefix) and entry.name.endswith(suffix)):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+
+_store = None
+_store_opened = False
+
+
+def get_store():
+    """Open the context store once per process; None if it cannot be used."""
+    global _store, _store_opened
+    if not _store_opened and context_store is not None:
+        _store_opened = True
+        try:
+            _store = context_store.ContextStore(
+                get_store_file(),
+                timeout=STORE_TIMEOUT,
+                session_ttl=SESSION_TTL,
+                prune_interval=PRUNE_INTERVAL,
+                memo_max_entries=MEMO_MAX_ENTRIES,
+                max_samples=HISTOGRAM_MAX_SAMPLES,
+            )
+        except (context_store.Error, OSError):
+            _store = None
+    return _store
+
+
+def load_state_file(session_id: str) -> dict:
+    """Load a per-session temp file, or an empty state."""
+    try:
+        with open(get_state_file(session_id), "r") as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def load_state(session_id: str) -> dict:
+    """Load the session state, or an empty one if missing or unreadable."""
+    store = get_store()
+    if store is None:
+        return load_state_file(session_id)
+    try:
+        state = store.load_session(session_id)
+    except (context_store.Error, ValueError):
+        return load_state_file(session_id)
+    if state is None:
+        # Carry over a session started before the store existed
+        state = load_state_file(session_id)
+        if state:
+            try:
+                os.unlink(get_state_file(session_id))
+            except OSError:
+                pass
+    return state if isinstance(state, dict) else {}
+
+
+def save_state(session_id: str, state: dict) -> None:
+    """Save the session state, falling back to an atomically replaced file."""
+    store = get_store()
+    if store is not None:
+        try:
+            now = time.time()
+            if store.save_session(session_id, state, now):
+                cutoff = now - SESSION_TTL
+                prune_files(tempfile.gettempdir(), "claude-context-", ".json", cutoff)
+                prune_files(get_usage_dir(), "", ".usage", cutoff)
+            return
+        except context_store.Error:
+            pass
+    path = get_state_file(session_id)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def extract_text(entry) -> list:
+    """Extract text content from the various transcript message formats."""
+    msg = entry.get("message") if isinstance(entry, dict) else None
+    if not isinstance(msg, dict):
+        return []
+    if isinstance(msg.get("content"), str):
+        return [msg["content"]]
+    if isinstance(msg.get("content"), list):
+        return [
+            block.get("text", "")
+            for block in msg["content"]
+            if isinstance(block, dict) and block.get("type") == "text"
+        ]
+    return []
+
+
+def is_compaction_entry(entry) -> bool:
+    """Check for a compaction boundary or the summary message that follows it."""
+    return isinstance(entry, dict) and (
+        entry.get("subtype") == "compact_boundary"
+        or entry.get("isCompactSummary") is True
+    )
+
+
+def is_compaction_line(line: bytes) -> bool:
+    """Check a raw transcript line, parsing it only if it mentions compaction."""
+    if not any(marker in line for marker in _COMPACTION_MARKERS):
+        return False
+    try:
+        return is_compaction_entry(json.loads(line))
+    except ValueError:
+        return False
+
+
+def find_last_boundary(transcript_path: str, end: int) -> int:
+    """
+    Return the offset of the latest compaction line before ``end``, or 0.
+
+    Reads the transcript backwards in SCAN_CHUNK blocks and only splits a
+    block into lines when it contains a compaction marker, so a long session
+    is usually decided by its last few blocks.
+    """
+    with open(transcript_path, "rb") as f:
+        pos, rest = end, b""
+        while pos > 0:
+            start = max(0, pos - SCAN_CHUNK)
+            f.seek(start)
+            block = f.read(pos - start) + rest
+            # The first line of a block may begin in the block before it
+            cut = block.find(b"\n") if start > 0 else -1
+            if start > 0 and cut < 0:
+                pos, rest = start, block
+                continue
+            body, body_start = block[cut + 1 :], start + cut + 1
+            if any(marker in body for marker in _COMPACTION_MARKERS):
+                found, line_start = None, body_start
+                for line in body.split(b"\n"):
+                    if is_compaction_line(line):
+                        found = line_start
+                    line_start += len(line) + 1
+                if found is not None:
+                    return found
+            pos, rest = start, block[: max(cut, 0)]
+    return 0
+
+
+def get_json_loads(nbytes: int):
+    """Return orjson's decoder for large reads when it is installed, else json's."""
+    if nbytes < FAST_JSON_MIN_BYTES:
+        return json.loads
+    try:
+        import orjson
+    except ImportError:
+        return json.loads
+
+    def loads(data: bytes):
+        try:
+            return orjson.loads(data)
+        except ValueError:  # orjson is stricter (e.g. lone surrogates)
+            return json.loads(data)
+
+    return loads
+
+
+def may_contain_text(mm: mmap.mmap, start: int, end: int) -> bool:
+    """
+    Cheap byte-level check whether a line can add text or mark a compaction.
+
+    Only lines with a message can add text. A message with no "text" token
+    but a tool_use or tool_result block has list content without text
+    blocks. The block's "type" key is matched, not just the tool_use token,
+    which also appears as a stop_reason next to plain string content. Quotes
+    inside JSON strings are escaped, so none of these tokens can come from
+    message text.
+    """
+    if mm.find(b'"message"', start, end) < 0:
+        return any(mm.find(m, start, end) >= 0 for m in _COMPACTION_MARKERS)
+    if mm.find(b'"text"', start, end) >= 0:
+        return True
+    return all(mm.find(m, start, end) < 0 for m in _TOOL_BLOCK_MARKERS)
+
+
+def read_transcript(transcript_path: str, offset: int = 0, entries=None) -> tuple:
+    """
+    Read and concatenate the content of transcript lines after ``offset``.
+
+    Returns the text blocks, the byte offset just past the last line read,
+    and the offset of the last compaction line read (or None). Text before
+    that compaction is dropped. A final line that is still being written (no
+    newline, not yet valid JSON) is left for the next call.
+
+    The file is memory-mapped and lines are found with ``find``; lines that
+    cannot contain text (mostly tool calls and results) are skipped without
+    being decoded, so a cold read of a large transcript is I/O-bound.
+
+    If ``entries`` is a list, every line is decoded and each complete entry
+    is appended to it, compactions notwithstanding, for the token ledger.
+    """
     content = []
-    with open(transcript_path, "r") as f:
-        for line in f:
+    boundary = None
+    with open(transcript_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= offset:
+            return [], offset, None
+        loads = get_json_loads(size - offset)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            while offset < size:
+                end = mm.find(b"\n", offset, size)
+                complete = end >= 0
+                if not complete:
+                    end = size
+                elif entries is None and not may_contain_text(mm, offset, end):
+                    offset = end + 1
+                    continue
+                try:
+                    entry = loads(mm[offset:end])
+                except ValueError:
+                    if not complete:
+                        break
+                    entry = None
+                if is_compaction_entry(entry):
+                    content.clear()
+                    boundary = offset
+                offset = end + 1 if complete else end
+                content.extend(extract_text(entry))
+                if entries is not None and isinstance(entry, dict):
+                    entries.append(entry)
+
+    return content, offset, boundary
+
+
+def read_tail(transcript_path: str, offset: int) -> str:
+    """Return the bytes just before ``offset`` as hex, to recognise the file later."""
+    start = max(0, offset - TAIL_BYTES)
+    with open(transcript_path, "rb") as f:
+        f.seek(start)
+        return f.read(offset - start).hex()
+
+
+def count_transcript_tokens(transcript_path: str, state: dict, entries=None) -> int:
+    """
+    Return the transcript's token count, tokenizing only what was appended.
+
+    The byte offset, running count, tokens counted by each backend and the
+    latest compaction boundary live in ``state["transcript"]``. Only text
+    after the boundary is counted. If the transcript shrank, was replaced,
+    or no longer ends the same way at the saved offset, it is counted again
+    from its latest boundary. Entries read are appended to ``entries`` if it
+    is a list (see read_transcript).
+    """
+    if not transcript_path or not os.path.exists(transcript_path):
+        return 0
+
+    stat = os.stat(transcript_path)
+    cursor = state.get("transcript")
+    if not (
+        isinstance(cursor, dict)
+        and cursor.get("path") == transcript_path
+        and cursor.get("inode") == stat.st_ino
+        and cursor.get("offset", 0) <= stat.st_size
+        and cursor.get("tail") == read_tail(transcript_path, cursor.get("offset", 0))
+    ):
+        boundary = find_last_boundary(transcript_path, stat.st_size)
+        cursor = {
+            "path": transcript_path,
+            "inode": stat.st_ino,
+            "offset": boundary,
+            "boundary": boundary,
+            "tokens": 0,
+        }
+
+    with TIMER.phase("read"):
+        blocks, offset, boundary = read_transcript(
+            transcript_path, cursor["offset"], entries
+        )
+    if boundary is not None and boundary != cursor.get("boundary"):
+        # Compacted since the last call: earlier messages left the context
+        cursor.update(boundary=boundary, tokens=0, by_backend={})
+    if offset > cursor["offset"]:
+        with TIMER.phase("tokenize"):
+            chars = sum(map(len, blocks)) + len(blocks)
+            backend = select_backend(chars)
             try:
-                entry = json.loads(line.strip())
-                # Extract text content from various message formats
-                if "message" in entry:
-                    msg = entry["message"]
-                    if isinstance(msg.get("content"), str):
-                        content.append(msg["content"])
-                    elif isinstance(msg.get("content"), list):
-                        for block in msg["content"]:
-                            if isinstance(block, dict) and block.get("type") == "text":
-                                content.append(block.get("text", ""))
-            except json.JSONDecodeError:
+                tokens = count_blocks(backend, blocks)
+            except OverBudget as e:
+                backend = over_budget_fallback(str(e), chars)
+                tokens = count_blocks(backend, blocks)
+        by_backend = cursor.setdefault("by_backend", {})
+        by_backend[backend.label] = by_backend.get(backend.label, 0) + tokens
+        cursor["tokens"] += tokens
+        cursor["offset"] = offset
+        cursor["tail"] = read_tail(transcript_path, offset)
+    else:
+        cursor.setdefault("tail", read_tail(transcript_path, offset))
+
+    state["transcript"] = cursor
+    return cursor["tokens"]
+
+
+def counting_method(state: dict) -> str:
+    """Describe how the current count was produced, for the usage report."""
+    labels = list(state.get("transcript", {}).get("by_backend", {}))
+    if len(labels) == 1:
+        return labels[0]
+    if not labels:
+        return "estimated"
+    return "partly estimated" if EstimateBackend.label in labels else "mixed"
+
+
+# =============================================================================
+# Usage Summaries
+# =============================================================================
+
+
+def write_usage(session_id: str, tokens: int, delta: int, estimated: bool) -> None:
+    """
+    Overwrite the session's usage record in place.
+
+    The record has a fixed size and is written from offset 0 with a single
+    write, so the file never changes size and readers need exactly one read.
+    """
+    body = USAGE_RECORD.pack(
+        USAGE_MAGIC,
+        USAGE_VERSION,
+        USAGE_ESTIMATED if estimated else 0,
+        tokens,
+        delta,
+        CONTEXT_LIMIT,
+        tokens / CONTEXT_LIMIT * 100,
+        time.time(),
+    )
+    try:
+        os.makedirs(get_usage_dir(), mode=0o700, exist_ok=True)
+        fd = os.open(get_usage_file(session_id), os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, body + USAGE_CHECK.pack(zlib.crc32(body)))
+        finally:
+            os.close(fd)
+    except OSError:
+        pass  # Best effort: the hook's own report does not depend on it
+
+
+def read_usage(path: str):
+    """Read a usage record; None if it is missing, foreign or keeps changing."""
+    for _ in range(3):  # A read racing a write fails the checksum; retry
+        try:
+            with open(path, "rb") as f:
+                data = f.read(USAGE_SIZE)
+        except OSError:
+            return None
+        if len(data) != USAGE_SIZE:
+            return None
+        (check,) = USAGE_CHECK.unpack_from(data, USAGE_RECORD.size)
+        if zlib.crc32(data[: USAGE_RECORD.size]) == check:
+            break
+    else:
+        return None
+    magic, version, flags, tokens, delta, limit, percentage, updated = (
+        USAGE_RECORD.unpack_from(data)
+    )
+    if magic != USAGE_MAGIC or version != USAGE_VERSION:
+        return None
+    return {
+        "tokens": tokens,
+        "delta": delta,
+        "limit": limit,
+        "percentage": round(percentage, 1),
+        "estimated": bool(flags & USAGE_ESTIMATED),
+        "updated": updated,
+    }
+
+
+def list_usage(max_age: float) -> list:
+    """Usage records updated in the last ``max_age`` seconds, newest first."""
+    cutoff = time.time() - max_age
+    sessions = []
+    try:
+        entries = os.scandir(get_usage_dir())
+    except OSError:
+        return sessions
+    with entries:
+        for entry in entries:
+            if not entry.name.endswith(".usage"):
                 continue
+            usage = read_usage(entry.path)
+            if usage and usage["updated"] >= cutoff:
+                usage["session_id"] = entry.name[: -len(".usage")]
+                sessions.append(usage)
+    sessions.sort(key=lambda usage: usage["updated"], reverse=True)
+    return sessions
 
-    return "\n".join(content)
+
+def print_sessions(as_json: bool = False) -> None:
+    """Print the sessions active in the last ACTIVE_MINUTES minutes."""
+    sessions = list_usage(ACTIVE_MINUTES * 60)
+    if as_json:
+        print(json.dumps(sessions, indent=2))
+        return
+    if not sessions:
+        print(f"No sessions active in the last {ACTIVE_MINUTES:g} minutes")
+        return
+    now = time.time()
+    print(f"{'session':<38}{'tokens':>10}{'used':>8}{'last req':>10}{'updated':>10}")
+    for usage in sessions:
+        approx = "~" if usage["estimated"] else ""
+        age = f"{int(now - usage['updated'])}s ago"
+        print(
+            f"{usage['session_id']:<38}{approx + format(usage['tokens'], ','):>10}"
+            f"{usage['percentage']:>7.1f}%{usage['delta']:>10,}{age:>10}"
+        )
+
+
+def print_statusline(data: dict) -> None:
+    """Print a one-line usage summary for Claude Code's statusLine command."""
+    usage = read_usage(get_usage_file(data.get("session_id", "unknown")))
+    if usage:
+        approx = "~" if usage["estimated"] else ""
+        tokens, percentage = usage["tokens"], usage["percentage"]
+        print(f"Context: {approx}{tokens:,} tokens ({percentage:.1f}%)")
+
+
+# =============================================================================
+# Token Ledger
+# =============================================================================
+
+
+def parse_timestamp(value) -> float:
+    """Convert a transcript's ISO 8601 timestamp to seconds since the epoch."""
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return time.time()
+
+
+def ledger_blocks(entry: dict) -> list:
+    """
+    Split a transcript entry into (type, tool, tool_use_id, text) blocks.
+
+    Tool calls are counted by their JSON input, tool results by their text.
+    Tool results name their tool_use_id; the tool is resolved later.
+    """
+    msg = entry.get("message")
+    if not isinstance(msg, dict):
+        return []
+    content = msg.get("content")
+    if isinstance(content, str):
+        return [("text", None, None, content)]
+    if not isinstance(content, list):
+        return []
+    blocks = []
+    for block in content:
+        if not isinstance(block, dict):
+            continue
+        kind = block.get("type")
+        if kind == "text":
+            blocks.append(("text", None, None, block.get("text", "")))
+        elif kind == "thinking":
+            blocks.append(("thinking", None, None, block.get("thinking", "")))
+        elif kind == "tool_use":
+            text = json.dumps(block.get("input", {}), ensure_ascii=False)
+            blocks.append(("tool_use", block.get("name"), block.get("id"), text))
+        elif kind == "tool_result":
+            result = block.get("content", "")
+            if isinstance(result, list):
+                result = "\n".join(
+                    part.get("text", "")
+                    for part in result
+                    if isinstance(part, dict) and part.get("type") == "text"
+                )
+            blocks.append(("tool_result", None, block.get("tool_use_id"), str(result)))
+    return blocks
+
+
+def append_ledger(session_id: str, entries: list) -> None:
+    """
+    Count the blocks of newly read transcript entries and add them to the ledger.
+
+    Counts come from the backend the latency budget allows for their total
+    size, through the token memo, so text blocks just counted for the running
+    total are mostly memo hits. Best effort: failures leave the ledger as is.
+    """
+    rows, texts = [], []
+    for entry in entries:
+        uuid = entry.get("uuid")
+        if not uuid:
+            continue
+        msg = entry.get("message")
+        role = msg.get("role") if isinstance(msg, dict) else None
+        timestamp = parse_timestamp(entry.get("timestamp"))
+        for index, (kind, tool, tool_use_id, text) in enumerate(ledger_blocks(entry)):
+            rows.append(
+                [session_id, uuid, index, timestamp, role, kind, tool, tool_use_id]
+            )
+            texts.append(text)
+    store = get_store()
+    if not rows or store is None:
+        return
+
+    chars = sum(map(len, texts)) + len(texts)
+    backend = select_backend(chars)
+    try:
+        counts = count_each(backend, texts)
+    except OverBudget as e:
+        counts = count_each(over_budget_fallback(str(e), chars), texts)
+    if len(counts) != len(texts):
+        # A backend that drops or merges blocks would shift every count
+        counts = EstimateBackend().count_many(texts)
+
+    try:
+        tools = {row[7]: row[6] for row in rows if row[5] == "tool_use"}
+        unresolved = list(
+            {row[7] for row in rows if row[5] == "tool_result"} - tools.keys() - {None}
+        )
+        if unresolved:
+            tools.update(store.tool_names(unresolved))
+        for row, tokens in zip(rows, counts):
+            if row[5] == "tool_result":
+                row[6] = tools.get(row[7])
+            row.append(tokens)
+        store.ledger_append(rows)
+    except context_store.Error:
+        pass
+
+
+def parse_date(value: str) -> float:
+    """Parse an ISO 8601 date or time for --since/--until, in local time."""
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not an ISO 8601 date: {value!r}") from None
+
+
+def print_ledger_report(argv: list) -> None:
+    """Print token totals from the ledger, grouped and filtered per ``argv``."""
+    if context_store is None:
+        print("The ledger needs context_store.py next to this script and SQLite")
+        return
+    parser = argparse.ArgumentParser(prog="context-tracker.py --ledger")
+    groups = context_store.ContextStore.GROUPS
+    parser.add_argument("--by", choices=sorted(groups), default="tool")
+    parser.add_argument("--since", type=parse_date, help="e.g. 2026-10-01")
+    parser.add_argument("--until", type=parse_date, help="exclusive")
+    parser.add_argument("--session", help="only this session id")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    store = get_store() if os.path.exists(get_store_file()) else None
+    rows = []
+    if store is not None:
+        rows = store.ledger_aggregate(args.by, args.since, args.until, args.session)
+    if not rows:
+        print(f"No ledger rows in {get_store_file()}; set CLAUDE_CONTEXT_LEDGER=1")
+        return
+
+    if args.json:
+        print(
+            json.dumps(
+                [
+                    {args.by: name, "blocks": blocks, "tokens": tokens}
+                    for name, blocks, tokens in rows
+                ],
+                indent=2,
+            )
+        )
+        return
+    total = sum(tokens for _, _, tokens in rows) or 1
+    width = max([len(str(name)) for name, _, _ in rows] + [len(args.by)]) + 2
+    print(f"{args.by:<{width}}{'blocks':>10}{'tokens':>14}{'share':>8}")
+    for name, blocks, tokens in rows:
+        print(f"{str(name):<{width}}{blocks:>10,}{tokens:>14,}{tokens / total:>8.1%}")
+
+
+# =============================================================================
+# Hook Entry Points
+# =============================================================================
 
 
 def handle_user_prompt_submit(data: dict) -> None:
@@ -67,13 +1343,24 @@ def handle_user_prompt_submit(data: dict) -> None:
     session_id = data.get("session_id", "unknown")
     transcript_path = data.get("transcript_path", "")
 
-    transcript_content = read_transcript(transcript_path)
-    current_tokens = count_tokens_estimate(transcript_content)
+    with TIMER.phase("state"):
+        state = load_state(session_id)
+    entries = [] if USE_LEDGER else None
+    current_tokens = count_transcript_tokens(transcript_path, state, entries)
+    if entries:
+        with TIMER.phase("ledger"):
+            append_ledger(session_id, entries)
 
     # Save to temp file for later comparison
-    state_file = get_state_file(session_id)
-    with open(state_file, "w") as f:
-        json.dump({"pre_tokens": current_tokens}, f)
+    state["pre_tokens"] = current_tokens
+    with TIMER.phase("state"):
+        save_state(session_id, state)
+        write_usage(
+            session_id,
+            current_tokens,
+            state.get("last_delta", 0),
+            "estimated" in counting_method(state),
+        )
 
 
 def handle_stop(data: dict) -> None:
@@ -81,28 +1368,29 @@ def handle_stop(data: dict) -> None:
     session_id = data.get("session_id", "unknown")
     transcript_path = data.get("transcript_path", "")
 
-    transcript_content = read_transcript(transcript_path)
-    current_tokens = count_tokens_estimate(transcript_content)
-
-    # Load pre-message count
-    state_file = get_state_file(session_id)
-    pre_tokens = 0
-    if os.path.exists(state_file):
-        try:
-            with open(state_file, "r") as f:
-                state = json.load(f)
-                pre_tokens = state.get("pre_tokens", 0)
-        except (json.JSONDecodeError, IOError):
-            pass
+    with TIMER.phase("state"):
+        state = load_state(session_id)
+    entries = [] if USE_LEDGER else None
+    current_tokens = count_transcript_tokens(transcript_path, state, entries)
+    if entries:
+        with TIMER.phase("ledger"):
+            append_ledger(session_id, entries)
+    pre_tokens = state.get("pre_tokens", 0)
 
     # Calculate delta
     delta_tokens = current_tokens - pre_tokens
+    method = counting_method(state)
+    state["last_delta"] = delta_tokens
+    with TIMER.phase("state"):
+        save_state(session_id, state)
+        write_usage(session_id, current_tokens, delta_tokens, "estimated" in method)
+
     remaining = CONTEXT_LIMIT - current_tokens
     percentage = (current_tokens / CONTEXT_LIMIT) * 100
 
     # Report usage (stderr so it doesn't interfere with hook output)
     print(
-        f"Context (estimated): ~{current_tokens:,} tokens "
+        f"Context ({method}): ~{current_tokens:,} tokens "
         f"({percentage:.1f}% used, ~{remaining:,} remaining)",
         file=sys.stderr,
     )
@@ -111,14 +1399,36 @@ def handle_stop(data: dict) -> None:
 
 
 def main():
-    data = json.load(sys.stdin)
+    args = sys.argv[1:]
+    if "--latency" in args:
+        print_latency_report()
+        sys.exit(0)
+    if args[:1] == ["--ledger"]:
+        print_ledger_report(args[1:])
+        sys.exit(0)
+    if "--sessions" in args:
+        print_sessions(as_json="--json" in args)
+        sys.exit(0)
+    if "--statusline" in args:
+        try:
+            print_statusline(json.load(sys.stdin))
+        except (ValueError, AttributeError):
+            pass  # Print nothing rather than an error in the statusline
+        sys.exit(0)
+
+    with TIMER.phase("parse"):
+        data = json.load(sys.stdin)
     event = data.get("hook_event_name", "")
+    if event in ("UserPromptSubmit", "Stop"):
+        ensure_service()  # Ready for this or the next call
 
     if event == "UserPromptSubmit":
         handle_user_prompt_submit(data)
     elif event == "Stop":
         handle_stop(data)
 
+    if RECORD_TIMINGS:
+        record_timings(TIMER.milliseconds())
     sys.exit(0)
 
 
@@ -0,0 +1,293 @@
+"""
+Context Store - the per-user SQLite database of context-tracker.py.
+
+Everything the context tracker keeps between hook calls lives in one
+database, opened once per hook call:
+
+    sessions    JSON state of each session, pruned after a time to live
+    token_memo  token counts of repeated text blocks, least recently used
+                entries dropped first
+    ledger      token count of every transcript block, for --ledger
+    latency     histogram of hook phase timings, for --latency
+
+WAL mode lets readers proceed while another hook writes, and every write is
+a single transaction, so concurrent hooks never see a torn row. Stdlib only;
+copy it next to context-tracker.py.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+Error = sqlite3.Error  # Raised by every ContextStore method
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)",
+    "CREATE TABLE IF NOT EXISTS sessions ("
+    "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)",
+    "CREATE TABLE IF NOT EXISTS token_memo ("
+    "key BLOB PRIMARY KEY, tokens INTEGER NOT NULL, used REAL NOT NULL"
+    ") WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS token_memo_used ON token_memo (used)",
+    "CREATE TABLE IF NOT EXISTS ledger ("
+    "session_id TEXT NOT NULL, uuid TEXT NOT NULL, block INTEGER NOT NULL, "
+    "timestamp REAL NOT NULL, role TEXT, type TEXT NOT NULL, tool TEXT, "
+    "tool_use_id TEXT, tokens INTEGER NOT NULL, "
+    "PRIMARY KEY (session_id, uuid, block)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS ledger_timestamp ON ledger (timestamp)",
+    "CREATE INDEX IF NOT EXISTS ledger_tool ON ledger (tool, timestamp)",
+    "CREATE INDEX IF NOT EXISTS ledger_tool_use_id ON ledger (tool_use_id) "
+    "WHERE tool_use_id IS NOT NULL",
+    "CREATE TABLE IF NOT EXISTS latency ("
+    "phase TEXT NOT NULL, bucket INTEGER NOT NULL, count INTEGER NOT NULL, "
+    "PRIMARY KEY (phase, bucket)) WITHOUT ROWID",
+)
+
+QUERY_CHUNK = 500  # Keys per IN (...) query, below SQLite's parameter limit
+MEMO_TRIM = 0.1  # Share of memo_max_entries evicted at once when over the cap
+
+
+class ContextStore:
+    """
+    Sessions, token memo, ledger and latency histogram of one user.
+
+    Sessions idle for longer than ``session_ttl`` seconds are deleted at
+    most once every ``prune_interval``. The memo keeps at most
+    ``memo_max_entries`` counts; its size is tracked in ``meta``, so the
+    least recently used entries are only looked up when it is over the cap,
+    and then enough are evicted to leave room for a while. The latency
+    histogram halves a phase's counts once it holds more than
+    ``max_samples`` calls, favouring recent calls.
+    """
+
+    GROUPS = {
+        "tool": "coalesce(tool, '(' || type || ')')",
+        "session": "session_id",
+        "role": "role",
+        "type": "type",
+        "day": "date(timestamp, 'unixepoch', 'localtime')",
+    }
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        timeout: float = 1.0,
+        session_ttl: float = 14 * 86400,
+        prune_interval: float = 86400,
+        memo_max_entries: int = 200_000,
+        max_samples: int = 10000,
+    ):
+        self.path = path
+        self.session_ttl = session_ttl
+        self.prune_interval = prune_interval
+        self.memo_max_entries = memo_max_entries
+        self.max_samples = max_samples
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        try:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                self.db.execute(statement)
+        except BaseException:
+            self.db.close()
+            raise
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run the block as one write transaction, rolled back on error."""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def close(self) -> None:
+        self.db.close()
+
+    # -- Sessions -------------------------------------------------------------
+
+    def load_session(self, session_id: str):
+        """Return the session's state, or None if there is none."""
+        row = self.db.execute(
+            "SELECT state FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_session(self, session_id: str, state: dict, now: float = None) -> bool:
+        """
+        Replace the session's state, pruning stale sessions when due.
+
+        Returns True if it pruned, so the caller can remove other per-session
+        data last written before ``now - session_ttl``.
+        """
+        now = time.time() if now is None else now
+        self.db.execute(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+            (session_id, json.dumps(state), now),
+        )
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'last_prune'"
+        ).fetchone()
+        if row is not None and now - row[0] <= self.prune_interval:
+            return False
+        self.prune_sessions(now)
+        return True
+
+    def prune_sessions(self, now: float) -> int:
+        """Delete sessions idle for longer than session_ttl; return how many."""
+        with self.transaction():
+            deleted = self.db.execute(
+                "DELETE FROM sessions WHERE updated < ?", (now - self.session_ttl,)
+            ).rowcount
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('last_prune', ?)", (now,)
+            )
+        return deleted
+
+    # -- Token memo -----------------------------------------------------------
+
+    @staticmethod
+    def memo_key(namespace: str, text: str) -> bytes:
+        """Key of a text's count: a hash of the backend's namespace and the text."""
+        digest = hashlib.blake2b(namespace.encode(), digest_size=16)
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8", "surrogatepass"))
+        return digest.digest()
+
+    def memo_get(self, keys: list) -> dict:
+        """Look up counts; keys that are not memoized are left out."""
+        found = {}
+        for i in range(0, len(keys), QUERY_CHUNK):
+            chunk = keys[i : i + QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(
+                self.db.execute(
+                    f"SELECT key, tokens FROM token_memo WHERE key IN ({placeholders})",
+                    chunk,
+                )
+            )
+        return found
+
+    def memo_update(self, used: list, counts: dict) -> None:
+        """Mark entries as used, add new counts and evict the oldest if full."""
+        now = time.time()
+        with self.transaction():
+            self.db.executemany(
+                "UPDATE token_memo SET used = ? WHERE key = ?",
+                [(now, key) for key in used],
+            )
+            if not counts:
+                return
+            rows = [(key, tokens, now) for key, tokens in counts.items()]
+            added = self.db.executemany(
+                "INSERT OR IGNORE INTO token_memo VALUES (?, ?, ?)", rows
+            ).rowcount
+            if added < len(rows):
+                # Another hook counted some of them meanwhile; use these counts
+                self.db.executemany(
+                    "UPDATE token_memo SET tokens = ?, used = ? WHERE key = ?",
+                    [(tokens, now, key) for key, tokens in counts.items()],
+                )
+
+            row = self.db.execute(
+                "SELECT value FROM meta WHERE key = 'memo_entries'"
+            ).fetchone()
+            if row is None:  # First update, or a database from before the count
+                entries = self.db.execute(
+                    "SELECT count(*) FROM token_memo"
+                ).fetchone()[0]
+            else:
+                entries = int(row[0]) + added
+            if entries > self.memo_max_entries:
+                keep = self.memo_max_entries - int(self.memo_max_entries * MEMO_TRIM)
+                entries -= self.db.execute(
+                    "DELETE FROM token_memo WHERE key IN ("
+                    "SELECT key FROM token_memo ORDER BY used LIMIT ?)",
+                    (entries - keep,),
+                ).rowcount
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('memo_entries', ?)", (entries,)
+            )
+
+    # -- Ledger ---------------------------------------------------------------
+
+    def tool_names(self, tool_use_ids: list) -> dict:
+        """Map tool use ids already in the ledger to their tool names."""
+        names = {}
+        for i in range(0, len(tool_use_ids), QUERY_CHUNK):
+            chunk = tool_use_ids[i : i + QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            names.update(
+                self.db.execute(
+                    "SELECT tool_use_id, tool FROM ledger WHERE type = 'tool_use' "
+                    f"AND tool_use_id IN ({placeholders})",
+                    chunk,
+                )
+            )
+        return names
+
+    def ledger_append(self, rows: list) -> None:
+        """Add rows; blocks already in the ledger are left as they are."""
+        with self.transaction():
+            self.db.executemany(
+                "INSERT OR IGNORE INTO ledger VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def ledger_aggregate(
+        self, by: str, since=None, until=None, session_id=None
+    ) -> list:
+        """Return (group, blocks, tokens) rows, largest token total first."""
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("timestamp < ?")
+            params.append(until)
+        if session_id is not None:
+            conditions.append("session_id = ?")
+            params.append(session_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.db.execute(
+            f"SELECT {self.GROUPS[by]} AS name, count(*), sum(tokens) FROM ledger "
+            f"{where} GROUP BY name ORDER BY sum(tokens) DESC",
+            params,
+        ).fetchall()
+
+    # -- Latency --------------------------------------------------------------
+
+    def add_timings(self, buckets: dict) -> None:
+        """Count one call in the histogram bucket of each phase it timed."""
+        with self.transaction():
+            for phase, bucket in buckets.items():
+                self.db.execute(
+                    "INSERT INTO latency VALUES (?, ?, 1) ON CONFLICT (phase, bucket) "
+                    "DO UPDATE SET count = count + 1",
+                    (phase, bucket),
+                )
+                (total,) = self.db.execute(
+                    "SELECT sum(count) FROM latency WHERE phase = ?", (phase,)
+                ).fetchone()
+                if total > self.max_samples:
+                    self.db.execute(
+                        "UPDATE latency SET count = count / 2 WHERE phase = ?",
+                        (phase,),
+                    )
+                    self.db.execute("DELETE FROM latency WHERE count = 0")
+
+    def latency_histogram(self, buckets: int) -> dict:
+        """Return the calls per bucket of each phase, as lists of ``buckets``."""
+        histogram = {}
+        for phase, bucket, count in self.db.execute(
+            "SELECT phase, bucket, count FROM latency WHERE bucket < ?", (buckets,)
+        ):
+            histogram.setdefault(phase, [0] * buckets)[bucket] = count
+        return histogram
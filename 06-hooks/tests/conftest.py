@@ -0,0 +1,69 @@
+"""Pytest configuration and shared fixtures for the context tracker tests."""
+
+from __future__ import annotations
+
+import importlib.util
+import json
+import sys
+import tempfile
+from collections.abc import Iterator
+from pathlib import Path
+from types import ModuleType
+
+import pytest
+
+HOOKS_DIR = Path(__file__).resolve().parent.parent
+
+# context-tracker.py imports context_store from its own directory
+sys.path.insert(0, str(HOOKS_DIR))
+
+
+@pytest.fixture
+def tracker(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> ModuleType:
+    """Load a fresh context-tracker.py whose cache and temp dirs are in tmp_path."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("CLAUDE_TOKENIZER_SERVICE", "0")
+    temp_dir = tmp_path / "tmp"
+    temp_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(temp_dir))
+
+    spec = importlib.util.spec_from_file_location(
+        "context_tracker", HOOKS_DIR / "context-tracker.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    if module._store is not None:
+        module._store.close()
+
+
+@pytest.fixture
+def service() -> ModuleType:
+    """Load tokenizer-service.py."""
+    spec = importlib.util.spec_from_file_location(
+        "tokenizer_service", HOOKS_DIR / "tokenizer-service.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def socket_path(monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    """A short CLAUDE_TOKENIZER_SOCKET path; socket paths are limited to ~100 bytes."""
+    with tempfile.TemporaryDirectory(dir="/tmp") as directory:
+        path = Path(directory) / "tokenizer.sock"
+        monkeypatch.setenv("CLAUDE_TOKENIZER_SOCKET", str(path))
+        yield path
+
+
+def message(uuid: str, text: str, role: str = "user") -> dict:
+    """A transcript entry holding one text message."""
+    return {"type": role, "uuid": uuid, "message": {"role": role, "content": text}}
+
+
+def write_transcript(path: Path, entries: list[dict], mode: str = "w") -> None:
+    """Write (or with mode "a", append) entries as JSON lines."""
+    with path.open(mode) as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
@@ -0,0 +1,664 @@
+"""Tests for the context tracker hook and its store."""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import socket
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+from types import ModuleType
+
+import pytest
+from conftest import message, write_transcript
+
+
+@pytest.fixture
+def recorder(tracker: ModuleType, monkeypatch: pytest.MonkeyPatch):
+    """A backend counting one token per character, used for every count."""
+
+    class RecordingBackend(tracker.TokenizerBackend):
+        name = "recording"
+        label = "recorded"
+
+        def __init__(self):
+            self.counted = []
+
+        def count(self, text: str) -> int:
+            self.counted.append(text)
+            return len(text)
+
+    backend = RecordingBackend()
+    monkeypatch.setattr(tracker, "select_backend", lambda *args: backend)
+    return backend
+
+
+class TestIncrementalCounting:
+    """The transcript cursor saved in the session state."""
+
+    def test_counts_only_appended_lines(
+        self, tracker: ModuleType, recorder, tmp_path: Path
+    ) -> None:
+        transcript = tmp_path / "session.jsonl"
+        write_transcript(transcript, [message("1", "first"), message("2", "second")])
+        state = {}
+
+        assert tracker.count_transcript_tokens(str(transcript), state) == 11
+        assert state["transcript"]["offset"] == transcript.stat().st_size
+
+        recorder.counted.clear()
+        write_transcript(transcript, [message("3", "third")], mode="a")
+        assert tracker.count_transcript_tokens(str(transcript), state) == 16
+        assert recorder.counted == ["third"]
+        assert state["transcript"]["offset"] == transcript.stat().st_size
+
+        recorder.counted.clear()
+        assert tracker.count_transcript_tokens(str(transcript), state) == 16
+        assert recorder.counted == []
+
+    def test_leaves_a_partial_last_line_for_the_next_call(
+        self, tracker: ModuleType, recorder, tmp_path: Path
+    ) -> None:
+        transcript = tmp_path / "session.jsonl"
+        write_transcript(transcript, [message("1", "first")])
+        with transcript.open("a") as f:
+            f.write('{"type": "user", "message": {"con')
+        state = {}
+
+        assert tracker.count_transcript_tokens(str(transcript), state) == 5
+        with transcript.open("a") as f:
+            f.write('tent": "later"}}\n')
+        assert tracker.count_transcript_tokens(str(transcript), state) == 10
+
+    @pytest.mark.parametrize(
+        "rewritten",
+        [["short"], ["first!", "second"]],
+        ids=["truncated", "rewritten"],
+    )
+    def test_recounts_a_truncated_or_rewritten_transcript(
+        self, tracker: ModuleType, recorder, tmp_path: Path, rewritten: list[str]
+    ) -> None:
+        transcript = tmp_path / "session.jsonl"
+        write_transcript(transcript, [message("1", "first"), message("2", "second")])
+        state = {}
+        tracker.count_transcript_tokens(str(transcript), state)
+
+        recorder.counted.clear()
+        write_transcript(
+            transcript, [message(str(i), text) for i, text in enumerate(rewritten)]
+        )
+        tokens = tracker.count_transcript_tokens(str(transcript), state)
+
+        assert recorder.counted == rewritten
+        assert tokens == sum(map(len, rewritten))
+
+
+class TestLineFilter:
+    """Lines that cannot add text are skipped without being decoded."""
+
+    TOOL_USE = {"type": "tool_use", "id": "t1", "name": "Read", "input": {}}
+    TOOL_RESULT = {"type": "tool_result", "tool_use_id": "t1", "content": "file"}
+
+    @staticmethod
+    def may_contain_text(tracker: ModuleType, entry: dict, **dumps) -> bool:
+        line = json.dumps(entry, **dumps).encode() + b"\n"
+        mm = mmap.mmap(-1, len(line))
+        mm.write(line)
+        return tracker.may_contain_text(mm, 0, len(line))
+
+    @pytest.mark.parametrize(
+        "separators", [None, (",", ":")], ids=["spaced", "compact"]
+    )
+    def test_tool_only_lines_are_skipped(
+        self, tracker: ModuleType, separators: tuple
+    ) -> None:
+        calls = message("1", "", "assistant")
+        calls["message"]["content"] = [self.TOOL_USE]
+        results = message("2", "")
+        results["message"]["content"] = [self.TOOL_RESULT]
+        mixed = message("3", "", "assistant")
+        mixed["message"]["content"] = [{"type": "text", "text": "hi"}, self.TOOL_USE]
+
+        dumps = {"separators": separators}
+        assert not self.may_contain_text(tracker, calls, **dumps)
+        assert not self.may_contain_text(tracker, results, **dumps)
+        assert self.may_contain_text(tracker, mixed, **dumps)
+        assert self.may_contain_text(tracker, message("4", "plain"), **dumps)
+
+    def test_lines_without_a_message_are_skipped_unless_compaction(
+        self, tracker: ModuleType
+    ) -> None:
+        assert not self.may_contain_text(tracker, {"type": "summary", "x": "text"})
+        boundary = {"type": "system", "subtype": "compact_boundary"}
+        assert self.may_contain_text(tracker, boundary)
+
+    def test_string_content_with_a_tool_use_stop_reason_is_read(
+        self, tracker: ModuleType, recorder, tmp_path: Path
+    ) -> None:
+        # Used to be a false negative: the stop_reason matched "tool_use"
+        entry = message("1", "I will read the file.", "assistant")
+        entry["message"]["stop_reason"] = "tool_use"
+        assert self.may_contain_text(tracker, entry)
+
+        transcript = tmp_path / "session.jsonl"
+        write_transcript(transcript, [entry])
+        assert tracker.count_transcript_tokens(str(transcript), {}) == 21
+
+
+class TestCompaction:
+    """Counting restarts at the latest compaction boundary."""
+
+    BOUNDARY = {"type": "system", "subtype": "compact_boundary"}
+    SUMMARY = dict(message("s", "summary"), isCompactSummary=True)
+
+    def test_compaction_resets_the_running_count(
+        self, tracker: ModuleType, recorder, tmp_path: Path
+    ) -> None:
+        transcript = tmp_path / "session.jsonl"
+        write_transcript(transcript, [message("1", "before compaction")])
+        state = {}
+        assert tracker.count_transcript_tokens(str(transcript), state) == 17
+
+        write_transcript(transcript, [self.BOUNDARY], mode="a")
+        summary_offset = transcript.stat().st_size
+        write_transcript(transcript, [self.SUMMARY, message("2", "after")], mode="a")
+        assert tracker.count_transcript_tokens(str(transcript), state) == 12
+        assert state["transcript"]["boundary"] == summary_offset
+
+    def test_first_call_starts_at_the_latest_boundary(
+        self, tracker: ModuleType, recorder, tmp_path: Path
+    ) -> None:
+        transcript = tmp_path / "session.jsonl"
+        write_transcript(
+            transcript,
+            [message("1", "old"), self.BOUNDARY, self.SUMMARY, message("2", "after")],
+        )
+        state = {}
+
+        assert tracker.count_transcript_tokens(str(transcript), state) == 12
+        assert recorder.counted == ["summary", "after"]
+
+
+class TestTokenMemo:
+    """Counts of long blocks are memoized across calls."""
+
+    def test_memo_hits_and_misses(self, tracker: ModuleType, recorder) -> None:
+        recorder.memoize = True
+        long_text = "x" * tracker.MEMO_MIN_CHARS
+        other_text = "y" * tracker.MEMO_MIN_CHARS
+        blocks = [long_text, "short", long_text]
+
+        counts = tracker.count_each(recorder, blocks)
+        assert counts == [len(long_text), 5, len(long_text)]
+        assert recorder.counted == [long_text, "short"]  # Duplicates counted once
+
+        recorder.counted.clear()
+        counts = tracker.count_each(recorder, [long_text, other_text, "short"])
+        assert counts == [len(long_text), len(other_text), 5]
+        assert recorder.counted == [other_text, "short"]  # Short blocks never memoized
+
+    def test_memo_is_keyed_by_backend_namespace(
+        self, tracker: ModuleType, recorder, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        recorder.memoize = True
+        long_text = "x" * tracker.MEMO_MIN_CHARS
+        tracker.count_each(recorder, [long_text])
+
+        recorder.counted.clear()
+        monkeypatch.setattr(recorder, "memo_namespace", lambda: "recording:v2")
+        tracker.count_each(recorder, [long_text])
+        assert recorder.counted == [long_text]
+
+    def test_memo_keeps_the_most_recently_used_entries(
+        self, tracker: ModuleType
+    ) -> None:
+        store = tracker.get_store()
+        store.memo_max_entries = 2
+        store.memo_update([], {b"a": 1})
+        store.memo_update([], {b"b": 2})
+        store.memo_update([b"a"], {})
+        store.memo_update([], {b"c": 3})
+
+        assert store.memo_get([b"a", b"b", b"c"]) == {b"a": 1, b"c": 3}
+
+    def test_memo_only_evicts_when_over_the_cap(self, tracker: ModuleType) -> None:
+        store = tracker.get_store()
+        store.memo_max_entries = 20
+        store.memo_update([], {b"first": 1})  # Counts the memo once
+        statements = []
+        store.db.set_trace_callback(statements.append)
+
+        for i in range(19):
+            store.memo_update([], {f"key{i}".encode(): i})
+        assert not [sql for sql in statements if "count(" in sql or "DELETE" in sql]
+
+        store.memo_update([b"first"], {b"over": 20})
+        assert any(sql.startswith("DELETE FROM token_memo") for sql in statements)
+        store.db.set_trace_callback(None)
+
+        # Trimmed to 90%, keeping the entries used last
+        (entries,) = store.db.execute("SELECT count(*) FROM token_memo").fetchone()
+        assert entries == 18
+        assert store.memo_get([b"first", b"over"]) == {b"first": 1, b"over": 20}
+
+
+class TestSessionPruning:
+    """Sessions and their files expire after SESSION_TTL."""
+
+    def test_prunes_stale_sessions_and_files(
+        self, tracker: ModuleType, tmp_path: Path
+    ) -> None:
+        store = tracker.get_store()
+        stale = time.time() - tracker.SESSION_TTL - tracker.PRUNE_INTERVAL - 60
+        store.save_session("old", {"pre_tokens": 1}, now=stale)
+
+        old_file = Path(tracker.get_state_file("old"))
+        old_file.write_text("{}")
+        tracker.write_usage("old", 1, 0, False)
+        tracker.write_usage("new", 2, 0, False)
+        old_usage = Path(tracker.get_usage_file("old"))
+        for path in (old_file, old_usage):
+            os.utime(path, (stale, stale))
+
+        tracker.save_state("new", {"pre_tokens": 2})
+
+        assert store.load_session("old") is None
+        assert tracker.load_state("new") == {"pre_tokens": 2}
+        assert not old_file.exists()
+        assert not old_usage.exists()
+        assert Path(tracker.get_usage_file("new")).exists()
+
+    def test_prunes_at_most_once_per_interval(self, tracker: ModuleType) -> None:
+        store = tracker.get_store()
+        now = time.time()
+
+        assert store.save_session("a", {}, now=now) is True
+        assert store.save_session("b", {}, now=now + 60) is False
+        assert store.save_session("c", {}, now=now + store.prune_interval + 1)
+
+    def test_falls_back_to_files_without_the_store(
+        self, tracker: ModuleType, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr(tracker, "context_store", None)
+
+        tracker.save_state("s", {"pre_tokens": 3})
+
+        assert Path(tracker.get_state_file("s")).exists()
+        assert tracker.load_state("s") == {"pre_tokens": 3}
+
+
+class TestLatencyBudget:
+    """Counts that would exceed the budget fall back to the estimate."""
+
+    def test_over_budget_backend_falls_back_to_estimate(
+        self, tracker: ModuleType, recorder, tmp_path: Path
+    ) -> None:
+        def over_budget(texts: list) -> list:
+            raise tracker.OverBudget(recorder.name)
+
+        recorder.count_many = over_budget
+        transcript = tmp_path / "session.jsonl"
+        write_transcript(transcript, [message("1", "a" * 40), message("2", "b" * 40)])
+        state = {}
+
+        assert tracker.count_transcript_tokens(str(transcript), state) == 81 // 4
+        assert tracker.counting_method(state) == "estimated"
+
+    def test_slow_backend_is_replaced_by_estimate(
+        self, tracker: ModuleType, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr(tracker, "BACKEND", "calibrated")
+        slow = {"backends": {"calibrated": {"chars_per_second": 1000}}}
+
+        assert tracker.select_backend(10, slow).name == "calibrated"
+        assert tracker.select_backend(10_000, slow).name == "estimate"
+        monkeypatch.setattr(tracker, "LATENCY_BUDGET_MS", 0)
+        assert tracker.select_backend(10_000, slow).name == "calibrated"
+
+    def test_explicit_backend_over_budget_uses_the_next_best(
+        self,
+        tracker: ModuleType,
+        monkeypatch: pytest.MonkeyPatch,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        monkeypatch.setattr(tracker, "BACKEND", "tiktoken")
+        monkeypatch.setattr(tracker.TiktokenBackend, "available", lambda self: True)
+
+        # Without the service, tiktoken's startup alone is over the default budget
+        assert tracker.select_backend(10, {}).name == "calibrated"
+        assert "tiktoken tokenizer would exceed" in capsys.readouterr().err
+        monkeypatch.setattr(tracker, "LATENCY_BUDGET_MS", 0)
+        assert tracker.select_backend(10, {}).name == "tiktoken"
+        assert capsys.readouterr().err == ""
+
+    def test_backend_over_budget_while_counting_uses_the_next_best(
+        self,
+        tracker: ModuleType,
+        tmp_path: Path,
+        monkeypatch: pytest.MonkeyPatch,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        monkeypatch.setattr(tracker, "BACKEND", "tiktoken")
+        monkeypatch.setattr(
+            tracker, "select_backend", lambda *args: tracker.TiktokenBackend()
+        )
+        transcript = tmp_path / "session.jsonl"
+        write_transcript(transcript, [message("1", "some text to count")])
+        state = {}
+
+        assert tracker.count_transcript_tokens(str(transcript), state) > 0
+        assert tracker.counting_method(state) == "calibrated"
+        assert "using calibrated" in capsys.readouterr().err
+
+
+class TestLatencyHistogram:
+    """Phase timings recorded in the store."""
+
+    def test_records_and_halves_timings(self, tracker: ModuleType) -> None:
+        store = tracker.get_store()
+        store.max_samples = 4
+        for _ in range(4):
+            tracker.record_timings({"total": 1.0})
+        histogram = store.latency_histogram(len(tracker.HISTOGRAM_BUCKETS_MS))
+        assert sum(histogram["total"]) == 4
+
+        tracker.record_timings({"total": 1.0, "read": 0.01})
+        histogram = store.latency_histogram(len(tracker.HISTOGRAM_BUCKETS_MS))
+        assert histogram["total"][tracker.bucket_index(1.0)] == 2
+        assert histogram["read"][0] == 1
+
+
+class TestTokenizerService:
+    """Starting the service, and not trusting a socket file alone."""
+
+    @pytest.fixture
+    def starts(
+        self, tracker: ModuleType, socket_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> list:
+        """Service starts requested by the tracker (none really happen)."""
+        started = []
+        monkeypatch.setattr(tracker, "USE_SERVICE", True)
+        monkeypatch.setattr(tracker.TiktokenBackend, "available", lambda self: True)
+        monkeypatch.setattr(tracker, "start_service", lambda: started.append(1))
+        return started
+
+    @staticmethod
+    def new_hook_call(tracker: ModuleType) -> None:
+        tracker._service_checked = False
+        tracker._service_running = None
+
+    def test_stale_socket_starts_the_service(
+        self, tracker: ModuleType, socket_path: Path, starts: list
+    ) -> None:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(str(socket_path))  # Left behind by a killed service
+        tiktoken = tracker.TiktokenBackend()
+        startup_ms = tracker.DEFAULT_PROFILE["tiktoken"]["startup_ms"]
+
+        assert tracker.count_tokens_service(["text"]) is None
+        assert starts == [1]
+        assert tracker.forecast_ms(tiktoken, 0, {}) == startup_ms
+
+    def test_retries_a_failed_start_after_a_while(
+        self, tracker: ModuleType, starts: list
+    ) -> None:
+        tracker.ensure_service()
+        self.new_hook_call(tracker)
+        tracker.ensure_service()
+        assert starts == [1]  # The first start has not come up yet
+
+        marker = tracker.get_service_marker()
+        retry = time.time() - tracker.SERVICE_RETRY - 1
+        os.utime(marker, (retry, retry))
+        self.new_hook_call(tracker)
+        tracker.ensure_service()
+        assert starts == [1, 1]
+
+    def test_live_service_skips_the_startup_cost(
+        self, tracker: ModuleType, socket_path: Path, starts: list
+    ) -> None:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+            listener.bind(str(socket_path))
+            listener.listen()
+            tracker.ensure_service()
+            assert tracker.forecast_ms(tracker.TiktokenBackend(), 0, {}) == 0
+        assert starts == []
+
+    @pytest.mark.skipif(
+        os.getuid() != 0, reason="needs root to own a socket as another user"
+    )
+    def test_ignores_a_socket_of_another_user(
+        self, tracker: ModuleType, socket_path: Path, starts: list
+    ) -> None:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+            listener.bind(str(socket_path))
+            listener.listen()
+            os.chown(socket_path, 12345, 12345)
+            listener.settimeout(0.1)
+
+            assert tracker.count_tokens_service(["secret"]) is None
+            with pytest.raises(TimeoutError):
+                listener.accept()
+
+
+class TestUsageRecords:
+    """Fixed-size usage records and the --sessions report built from them."""
+
+    def test_round_trip_overwrites_in_place(self, tracker: ModuleType) -> None:
+        before = time.time()
+        tracker.write_usage("s1", 64000, 1200, True)
+        tracker.write_usage("s1", 70000, 6000, False)
+
+        path = Path(tracker.get_usage_file("s1"))
+        assert path.stat().st_size == tracker.USAGE_SIZE
+        usage = tracker.read_usage(str(path))
+        assert usage.pop("updated") >= before
+        assert usage == {
+            "tokens": 70000,
+            "delta": 6000,
+            "limit": tracker.CONTEXT_LIMIT,
+            "percentage": round(70000 / tracker.CONTEXT_LIMIT * 100, 1),
+            "estimated": False,
+        }
+
+    def test_rejects_torn_truncated_and_foreign_records(
+        self, tracker: ModuleType
+    ) -> None:
+        tracker.write_usage("s1", 64000, 1200, False)
+        path = Path(tracker.get_usage_file("s1"))
+        record = path.read_bytes()
+
+        # A write racing the read leaves a body that fails its checksum
+        path.write_bytes(record[:8] + b"\xff" + record[9:])
+        assert tracker.read_usage(str(path)) is None
+        path.write_bytes(record[:-1])
+        assert tracker.read_usage(str(path)) is None
+
+        body = b"XXXX" + record[4 : tracker.USAGE_RECORD.size]
+        path.write_bytes(body + tracker.USAGE_CHECK.pack(zlib.crc32(body)))
+        assert tracker.read_usage(str(path)) is None
+        assert tracker.read_usage(str(path.with_name("missing.usage"))) is None
+
+    def test_sessions_lists_active_sessions_newest_first(
+        self,
+        tracker: ModuleType,
+        monkeypatch: pytest.MonkeyPatch,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        now = time.time()
+        for session_id, tokens, age in [
+            ("idle", 1000, tracker.ACTIVE_MINUTES * 60 + 60),
+            ("older", 2000, 30),
+            ("newer", 3000, 10),
+        ]:
+            with monkeypatch.context() as m:
+                m.setattr(tracker.time, "time", lambda age=age: now - age)
+                tracker.write_usage(session_id, tokens, 100, session_id == "newer")
+        Path(tracker.get_usage_dir(), "notes.txt").write_text("not a record")
+
+        monkeypatch.setattr(sys, "argv", ["context-tracker.py", "--sessions", "--json"])
+        with pytest.raises(SystemExit):
+            tracker.main()
+        sessions = json.loads(capsys.readouterr().out)
+        assert [s["session_id"] for s in sessions] == ["newer", "older"]
+        assert [s["tokens"] for s in sessions] == [3000, 2000]
+
+        monkeypatch.setattr(sys, "argv", ["context-tracker.py", "--sessions"])
+        with pytest.raises(SystemExit):
+            tracker.main()
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0].split() == [
+            "session",
+            "tokens",
+            "used",
+            "last",
+            "req",
+            "updated",
+        ]
+        assert lines[1].split()[:2] == ["newer", "~3,000"]
+        assert lines[2].split()[:2] == ["older", "2,000"]
+        assert len(lines) == 3
+
+
+class TestLedger:
+    """Per-block token counts in the ledger and their aggregation."""
+
+    CALL = {"type": "tool_use", "id": "t1", "name": "Read", "input": {"path": "a"}}
+    RESULT = {"type": "tool_result", "tool_use_id": "t1", "content": "file body"}
+
+    @staticmethod
+    def entry(uuid: str, role: str, content: list, hour: int = 10) -> dict:
+        return {
+            "type": role,
+            "uuid": uuid,
+            "timestamp": f"2026-10-01T{hour:02d}:00:00Z",
+            "message": {"role": role, "content": content},
+        }
+
+    def test_appends_each_block_once_and_aggregates(
+        self,
+        tracker: ModuleType,
+        recorder,
+        monkeypatch: pytest.MonkeyPatch,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        thinking = {"type": "thinking", "thinking": "plan"}
+        text = {"type": "text", "text": "hello"}
+        entries = [
+            self.entry("1", "assistant", [thinking, text, self.CALL]),
+            self.entry("2", "user", [self.RESULT], hour=11),
+        ]
+        tracker.append_ledger("s1", entries)
+        tracker.append_ledger("s1", entries)  # Re-read: nothing added twice
+
+        store = tracker.get_store()
+        call_tokens = len(json.dumps(self.CALL["input"]))
+        assert store.ledger_aggregate("tool") == [
+            ("Read", 2, call_tokens + len("file body")),
+            ("(text)", 1, 5),
+            ("(thinking)", 1, 4),
+        ]
+        assert store.ledger_aggregate("role") == [
+            ("assistant", 3, 9 + call_tokens),
+            ("user", 1, 9),
+        ]
+        until = tracker.parse_timestamp("2026-10-01T11:00:00Z")
+        assert store.ledger_aggregate("type", until=until)[0] == (
+            "tool_use",
+            1,
+            call_tokens,
+        )
+        assert store.ledger_aggregate("session", session_id="other") == []
+
+        argv = ["context-tracker.py", "--ledger", "--by", "type", "--json"]
+        monkeypatch.setattr(sys, "argv", argv)
+        with pytest.raises(SystemExit):
+            tracker.main()
+        report = json.loads(capsys.readouterr().out)
+        assert {row["type"]: row["blocks"] for row in report} == {
+            "tool_use": 1,
+            "tool_result": 1,
+            "text": 1,
+            "thinking": 1,
+        }
+
+    def test_resolves_tool_results_from_an_earlier_call(
+        self, tracker: ModuleType, recorder
+    ) -> None:
+        tracker.append_ledger("s1", [self.entry("1", "assistant", [self.CALL])])
+        tracker.append_ledger("s1", [self.entry("2", "user", [self.RESULT])])
+        orphan = dict(self.RESULT, tool_use_id="unknown")
+        tracker.append_ledger("s1", [self.entry("3", "user", [orphan])])
+
+        tools = tracker.get_store().ledger_aggregate("tool")
+        assert {name: blocks for name, blocks, _ in tools} == {
+            "Read": 2,
+            "(tool_result)": 1,
+        }
+
+    def test_estimates_when_a_backend_returns_the_wrong_number_of_counts(
+        self, tracker: ModuleType, recorder
+    ) -> None:
+        recorder.count_many = lambda texts: [1]
+        text = {"type": "text", "text": "a" * 40}
+        tracker.append_ledger("s1", [self.entry("1", "assistant", [text, self.CALL])])
+
+        expected = tracker.EstimateBackend().count_many(
+            ["a" * 40, json.dumps(self.CALL["input"])]
+        )
+        rows = tracker.get_store().ledger_aggregate("type")
+        assert sorted(tokens for _, _, tokens in rows) == sorted(expected)
+
+
+class TestCountBatched:
+    """In-process tiktoken counting in batches, and texts sent to the service."""
+
+    class WordEncoding:
+        def __init__(self):
+            self.batches = []
+
+        def encode_ordinary(self, text: str) -> list:
+            self.batches.append([text])
+            return text.split()
+
+        def encode_ordinary_batch(self, texts: list, num_threads: int) -> list:
+            self.batches.append(list(texts))
+            return [text.split() for text in texts]
+
+    def test_counts_in_order_batch_by_batch(
+        self, tracker: ModuleType, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr(tracker, "BATCH_CHARS", 10)
+        monkeypatch.setattr(tracker, "PARALLEL_MIN_CHARS", 10)
+        monkeypatch.setattr(tracker, "THREADS", 4)
+        enc = self.WordEncoding()
+
+        counts = tracker.count_batched(enc, ["one two", "three", "a", "b c", "last"])
+        assert counts == [2, 1, 1, 2, 1]
+        # Batches of about BATCH_CHARS; the short last one is encoded serially
+        assert enc.batches == [["one two", "three"], ["a"], ["b c"], ["last"]]
+        assert tracker.count_batched(enc, []) == []
+
+    def test_sends_each_text_to_the_service(
+        self,
+        tracker: ModuleType,
+        service: ModuleType,
+        socket_path: Path,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        monkeypatch.setattr(tracker, "USE_SERVICE", True)
+        monkeypatch.setattr(service, "get_encoding", lambda name: self.WordEncoding())
+        server = service.TokenizerServer(str(socket_path))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            texts = ["one two", "", "ünïcode text here", "x " * 1000]
+            assert tracker.count_tokens_service(texts) == [2, 0, 3, 1000]
+            assert tracker.count_tokens_service(["\ud800 lone surrogate"]) is None
+        finally:
+            server.shutdown()
+            server.server_close()
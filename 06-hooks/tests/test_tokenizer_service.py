@@ -0,0 +1,167 @@
+"""Tests for the tokenizer service and its socket."""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from types import ModuleType
+
+import pytest
+from conftest import HOOKS_DIR
+
+
+class WordEncoding:
+    """Stands in for a tiktoken encoding: one token per word."""
+
+    def encode_ordinary(self, text: str) -> list:
+        return text.split()
+
+    def encode_ordinary_batch(self, texts: list, num_threads: int) -> list:
+        return [text.split() for text in texts]
+
+
+@pytest.fixture
+def server(
+    service: ModuleType, socket_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[Path]:
+    """A service answering on socket_path with WordEncoding."""
+    monkeypatch.setattr(service, "get_encoding", lambda name: WordEncoding())
+    server = service.TokenizerServer(str(socket_path))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield socket_path
+    server.shutdown()
+    server.server_close()
+
+
+def request(path: Path, header: dict, data: bytes) -> dict:
+    """Send one request and return the service's reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(path))
+        sock.sendall(json.dumps(header).encode() + b"\n" + data)
+        sock.shutdown(socket.SHUT_WR)
+        return json.loads(sock.makefile("rb").readline())
+
+
+def wait_for(condition, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+class TestProtocol:
+    """Requests and replies on the socket."""
+
+    def test_counts_one_text(self, server: Path) -> None:
+        data = "one two three".encode()
+        assert request(server, {"bytes": len(data)}, data) == {"tokens": 3}
+
+    def test_counts_each_text(self, server: Path) -> None:
+        texts = ["a b", "", "é ü ö x"]
+        data = [text.encode() for text in texts]
+        reply = request(server, {"sizes": list(map(len, data))}, b"".join(data))
+        assert reply == {"counts": [2, 0, 4]}
+
+    def test_reports_a_truncated_request(self, server: Path) -> None:
+        reply = request(server, {"bytes": 10}, b"short")
+        assert "truncated" in reply["error"]
+
+
+class TestCountBatched:
+    """Texts are read off the request stream and counted in batches."""
+
+    def test_reads_and_counts_batch_by_batch(
+        self, service: ModuleType, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        texts = ["one two", "three", "", "four five six", "sévén"]
+        data = [text.encode() for text in texts]
+        stream = io.BytesIO(b"".join(data))
+        batches = []
+
+        class Recording(WordEncoding):
+            def encode_ordinary_batch(self, texts: list, num_threads: int) -> list:
+                batches.append((list(texts), stream.tell()))
+                return super().encode_ordinary_batch(texts, num_threads)
+
+        monkeypatch.setattr(service, "BATCH_BYTES", 10)
+        monkeypatch.setattr(service, "PARALLEL_MIN_BYTES", 0)
+        monkeypatch.setattr(service, "THREADS", 2)
+
+        counts = service.count_batched(Recording(), stream, list(map(len, data)))
+        assert counts == [2, 1, 0, 3, 1]
+        # Each batch is counted before the texts after it are read
+        assert batches == [
+            (["one two", "three"], len(data[0] + data[1])),
+            (["", "four five six"], len(b"".join(data[:4]))),
+        ]
+
+    def test_rejects_a_truncated_stream(self, service: ModuleType) -> None:
+        with pytest.raises(ValueError, match="truncated"):
+            service.count_batched(WordEncoding(), io.BytesIO(b"abc"), [2, 5])
+
+
+class TestSocket:
+    """Where the socket lives and when it is removed."""
+
+    def test_socket_dir_is_private(
+        self, service: ModuleType, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.delenv("CLAUDE_TOKENIZER_SOCKET", raising=False)
+        monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+        monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+        directory = tmp_path / f"claude-tokenizer-{os.getuid()}"
+        assert service.get_socket_path() == str(directory / "claude-tokenizer.sock")
+
+        service.make_private_dir(str(directory))
+        assert directory.stat().st_mode & 0o777 == 0o700
+        service.make_private_dir(str(directory))  # An existing private dir is fine
+
+        directory.chmod(0o755)
+        with pytest.raises(PermissionError):
+            service.make_private_dir(str(directory))
+        monkeypatch.setattr(sys, "argv", ["tokenizer-service.py"])
+        assert service.main() == 1
+
+    def test_sigterm_removes_the_socket(self, socket_path: Path) -> None:
+        process = subprocess.Popen(
+            [sys.executable, str(HOOKS_DIR / "tokenizer-service.py")],
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for(socket_path.exists)
+            process.send_signal(signal.SIGTERM)
+            assert process.wait(timeout=10) == 0
+        finally:
+            process.kill()
+        assert not socket_path.exists()
+
+    def test_replaces_a_stale_socket(self, socket_path: Path) -> None:
+        script = [sys.executable, str(HOOKS_DIR / "tokenizer-service.py")]
+
+        def status() -> int:
+            return subprocess.run(
+                [*script, "--status"], capture_output=True, check=False
+            ).returncode
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(str(socket_path))  # Closed without unlinking, like a kill -9
+        assert status() == 1
+
+        process = subprocess.Popen(script, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(lambda: status() == 0)
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+        assert not socket_path.exists()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Tokenizer Service - Keeps tiktoken encodings loaded for the context tracker hooks.
+
+Every hook event starts a new process, and importing tiktoken and loading the
+BPE ranks takes most of a hook's run time. This service loads each encoding
+once and answers counting requests on a per-user Unix socket.
+
+context-tracker.py starts the service on demand and counts in-process
+whenever it is unavailable, so nothing needs to be configured. The service
+exits after IDLE_TIMEOUT seconds without requests, or on SIGTERM, and removes
+its socket either way.
+
+The socket and its lock live in $XDG_RUNTIME_DIR or, without one, in a
+claude-tokenizer-<uid> directory in the temp directory. That directory is
+created with mode 0700, and the service refuses to run if it already exists
+with another owner or wider permissions. Clients only connect to a socket
+owned by their own user.
+
+Protocol (one request per connection):
+    request:  {"encoding": "p50k_base", "bytes": N}\\n, then N bytes of UTF-8 text
+    response: {"tokens": 123}\\n  or  {"error": "..."}\\n
+
+    To count several texts separately, send "sizes": [N1, N2, ...] instead of
+    "bytes", followed by the texts back to back; the response is
+    {"counts": [...]}.
+
+Usage:
+    python3 tokenizer-service.py            # run in the foreground
+    python3 tokenizer-service.py --status   # print whether the service is running
+
+Environment:
+    CLAUDE_TOKENIZER_SOCKET  Socket path (default: claude-tokenizer.sock in the directory above)
+    CLAUDE_TOKENIZER_IDLE    Seconds without requests before exiting (default: 900)
+    CLAUDE_TOKENIZER_THREADS Threads per large request (default: CPU count)
+"""
+import fcntl
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+# Configuration
+DEFAULT_ENCODING = "p50k_base"
+IDLE_TIMEOUT = float(os.environ.get("CLAUDE_TOKENIZER_IDLE", "900"))
+MAX_REQUEST_BYTES = 512 * 1024 * 1024  # Refuse anything larger than this
+MAX_HEADER_BYTES = 16 * 1024 * 1024  # Room for the sizes of many texts
+BATCH_BYTES = 1 << 20  # Bytes of texts encoded per batch
+PARALLEL_MIN_BYTES = 1 << 16  # Smaller batches are encoded on one thread
+THREADS = int(os.environ.get("CLAUDE_TOKENIZER_THREADS", "0")) or os.cpu_count() or 1
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def get_socket_path() -> str:
+    """Get the per-user socket path shared by the service and its clients."""
+    override = os.environ.get("CLAUDE_TOKENIZER_SOCKET")
+    if override:
+        return override
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(
+        tempfile.gettempdir(), f"claude-tokenizer-{os.getuid()}"
+    )
+    return os.path.join(runtime_dir, "claude-tokenizer.sock")
+
+
+def make_private_dir(path: str) -> None:
+    """
+    Create ``path`` with mode 0700, or check that it is such a directory.
+
+    In a shared temp directory anyone can create the path first, so an
+    existing directory is only used if this user owns it and no one else
+    has access.
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if (
+        not stat.S_ISDIR(st.st_mode)
+        or st.st_uid != os.getuid()
+        or st.st_mode & 0o077
+    ):
+        raise PermissionError(f"{path} is not a directory private to this user")
+
+
+def get_encoding(name: str):
+    """Load an encoding once; concurrent requests wait for the first load."""
+    with _encodings_lock:
+        if name not in _encodings:
+            import tiktoken
+
+            _encodings[name] = tiktoken.get_encoding(name)
+        return _encodings[name]
+
+
+def count_batched(enc, stream, sizes: list) -> list:
+    """
+    Count the texts of ``sizes`` bytes each, read back to back from ``stream``.
+
+    Texts are read as they are counted: batches of about BATCH_BYTES are
+    decoded and encoded together, on THREADS threads when large enough, so
+    only one batch is held at a time, never the whole request.
+    """
+    counts, batch, chars = [], [], 0
+    for i, n in enumerate(sizes):
+        data = stream.read(n)
+        if len(data) != n:
+            raise ValueError("truncated request")
+        batch.append(data.decode("utf-8"))
+        del data
+        chars += n
+        if chars < BATCH_BYTES and i + 1 < len(sizes):
+            continue
+        threads = min(THREADS, len(batch))
+        if threads > 1 and chars >= PARALLEL_MIN_BYTES:
+            tokens = enc.encode_ordinary_batch(batch, num_threads=threads)
+            counts.extend(map(len, tokens))
+        else:
+            counts.extend(len(enc.encode_ordinary(text)) for text in batch)
+        batch, chars = [], 0
+    return counts
+
+
+class TokenizerHandler(socketserver.StreamRequestHandler):
+    """Answer one counting request."""
+
+    def handle(self) -> None:
+        self.server.touch()
+        try:
+            header = json.loads(self.rfile.readline(MAX_HEADER_BYTES))
+            sizes = header.get("sizes")
+            single = sizes is None
+            if single:
+                sizes = [int(header.get("bytes", 0))]
+            if min(sizes, default=0) < 0 or sum(sizes) > MAX_REQUEST_BYTES:
+                raise ValueError(f"request size out of range: {sum(sizes)}")
+            enc = get_encoding(header.get("encoding", DEFAULT_ENCODING))
+            counts = count_batched(enc, self.rfile, sizes)
+            reply = {"tokens": counts[0]} if single else {"counts": counts}
+        except Exception as e:  # Report every failure; the client falls back
+            reply = {"error": f"{type(e).__name__}: {e}"}
+        try:
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+        except OSError:
+            pass  # Client gave up waiting
+        self.server.touch()
+
+
+class TokenizerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Threaded Unix socket server that remembers when it was last used."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str):
+        super().__init__(socket_path, TokenizerHandler)
+        self.last_active = time.monotonic()
+
+    def touch(self) -> None:
+        self.last_active = time.monotonic()
+
+    def idle_for(self) -> float:
+        return time.monotonic() - self.last_active
+
+
+def is_running(socket_path: str) -> bool:
+    """Check whether a service is accepting connections on the socket."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(1.0)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+def serve(socket_path: str, idle_timeout: float) -> int:
+    """Run the service until it has been idle for ``idle_timeout`` seconds."""
+    # The lock decides which of several concurrently started services runs;
+    # its holder may safely replace a stale socket left by a killed service.
+    lock_file = open(socket_path + ".lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return 0  # Another service is already running
+
+    old_umask = os.umask(0o077)  # Socket readable by this user only
+    try:
+        remove_socket(socket_path)
+        server = TokenizerServer(socket_path)
+    except OSError as e:
+        print(f"Cannot listen on {socket_path}: {e}", file=sys.stderr)
+        lock_file.close()
+        return 1
+    finally:
+        os.umask(old_umask)
+
+    # Leave through the cleanup below when stopped with kill or systemctl
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Load the default encoding in the background so the first client only
+    # waits for it if it connects before loading finishes
+    threading.Thread(target=lambda: get_encoding(DEFAULT_ENCODING), daemon=True).start()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        while server.idle_for() < idle_timeout:
+            time.sleep(min(idle_timeout, 5.0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        try:
+            remove_socket(socket_path)
+        except OSError:
+            pass  # Exiting anyway; the next service replaces it
+        lock_file.close()
+    return 0
+
+
+def remove_socket(socket_path: str) -> None:
+    """Remove the socket file, if there is one; only the lock holder may."""
+    try:
+        os.unlink(socket_path)
+    except FileNotFoundError:
+        pass
+
+
+def main() -> int:
+    socket_path = get_socket_path()
+    if "--status" in sys.argv[1:]:
+        running = is_running(socket_path)
+        print(f"{socket_path}: {'running' if running else 'not running'}")
+        return 0 if running else 1
+    if not os.environ.get("CLAUDE_TOKENIZER_SOCKET"):
+        try:
+            make_private_dir(os.path.dirname(socket_path))
+        except OSError as e:
+            print(f"Not starting: {e}", file=sys.stderr)
+            return 1
+    return serve(socket_path, IDLE_TIMEOUT)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,9 @@
 #!/usr/bin/env -S uv run --script
 # /// script
-# dependencies = ["ebooklib", "markdown", "beautifulsoup4", "httpx", "pillow", "tenacity"]
+# dependencies = [
+#     "ebooklib", "markdown", "beautifulsoup4", "httpx", "pillow", "tenacity",
+#     "tomli; python_version < '3.11'",
+# ]
 # ///
 """
 Build an EPUB from the Claude How-To markdown files.
@@ -19,6 +22,25 @@ Usage:
         --verbose, -v   Enable verbose logging
         --timeout       Timeout for API requests in seconds (default: 30)
         --max-concurrent Maximum concurrent API requests (default: 10)
+        --batch         JSON file listing several editions to build together
+        --serve         Run a build daemon on --socket
+        --socket        Unix socket of the build daemon
+        --daemon        Hand the build to the daemon on --socket, if one answers
+        --manifest      TOML chapter manifest (default: scripts/chapters.toml)
+        --report        Write a JSON build report (sizes and timings)
+        --memory-profile Write per-stage tracemalloc results to a JSON file
+        --compress-level Deflate level for text entries (default: 6)
+        --max-compression Smallest output for release builds (slower)
+        --no-search-index Skip the embedded full-text search index
+        --validate      Check the EPUB structure after writing it
+        --check-links   Check external links (HEAD, then GET), exit code 3 if broken
+        --max-per-host  Maximum concurrent link checks per host (default: 4)
+        --link-cache    Link check cache file (default: links.json in --cache-dir)
+        --link-ttl      Hours a cached link check stays valid (default: 24)
+        --degraded      Finish with placeholders for failed diagrams (exit code 2)
+        --cache-dir     Keep diagrams and timings here between builds (default: off)
+        --no-cache      Ignore --cache-dir
+        --plan          Predict what a build would do and cost, without building
 
     The script uses inline script dependencies (PEP 723), so uv will
     automatically install required packages in an isolated environment.
@@ -28,11 +50,27 @@ Output:
 
 Features:
     - Organizes chapters by folder structure (01-slash-commands, etc.)
+    - Config-driven chapter order via a TOML manifest with globs and sections
     - Renders Mermaid diagrams as PNG images via Kroki.io API (async concurrent)
     - Generates a cover image from the project logo
     - Converts internal markdown links to EPUB chapter references
     - Handles SVG images by replacing with styled placeholders
-    - Strict error mode: fails if any diagram cannot be rendered
+    - Embeds a compact full-text search index (search/index.bin) built
+      while chapters are converted
+    - Strict error mode: fails if any diagram cannot be rendered, cancelling
+      outstanding fetches at the first failure
+    - Built-in structural EPUB validation (mimetype, manifest, spine, nav,
+      internal links and anchors, media types) in one pass over the zip
+    - Optional external link check with per-host limits and a TTL cache
+    - Degraded mode: finishes with placeholders and reports failed diagrams
+    - JSON build report with per-chapter, per-diagram, per-stage and
+      per-media-type size and timing breakdown
+    - Batch mode: builds several editions concurrently with shared caches
+    - Daemon mode: a Unix-socket server runs concurrent builds with warm,
+      shared caches; with --daemon the CLI becomes a thin client
+    - Persistent diagram cache and a --plan dry run that predicts changed
+      chapters, diagrams to fetch, network bytes and time from the last build
+      without importing the rendering stack
 
 Requirements:
     - uv (recommended) or Python 3.10+ with dependencies installed
@@ -45,27 +83,70 @@ from __future__ import annotations
 import argparse
 import asyncio
 import base64
+import functools
+import hashlib
 import html
+import importlib
+import json
 import logging
 import os
 import re
+import socket
 import sys
+import threading
+import time
+import tracemalloc
+import zipfile
 import zlib
-from dataclasses import dataclass, field
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable, Sequence
+from dataclasses import asdict, dataclass, field, replace
 from io import BytesIO
 from pathlib import Path
+from types import ModuleType
+from typing import IO, TYPE_CHECKING, Any
+from urllib.parse import unquote
+from xml.etree import ElementTree
 
-import httpx
-import markdown
-from bs4 import BeautifulSoup
-from ebooklib import epub
-from PIL import Image, ImageDraw, ImageFont
-from tenacity import (
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_exponential,
-)
+
+class _LazyModule:
+    """Module proxy that imports the module on first attribute access.
+
+    ``--plan`` and the daemon client never touch the rendering and
+    packaging stack, so they should not pay for importing it.
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module: ModuleType | None = None
+
+    def __getattr__(self, attr: str) -> Any:
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+if TYPE_CHECKING:
+    import bs4
+    import httpx
+    import markdown
+    import tenacity
+    from ebooklib import epub
+    from PIL import Image, ImageDraw, ImageFont
+else:
+    bs4 = _LazyModule("bs4")
+    httpx = _LazyModule("httpx")
+    markdown = _LazyModule("markdown")
+    tenacity = _LazyModule("tenacity")
+    epub = _LazyModule("ebooklib.epub")
+    Image = _LazyModule("PIL.Image")
+    ImageDraw = _LazyModule("PIL.ImageDraw")
+    ImageFont = _LazyModule("PIL.ImageFont")
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
 
 # =============================================================================
 # Custom Exceptions
@@ -101,6 +182,34 @@ class CoverGenerationError(EPUBBuildError):
 # =============================================================================
 
 
+# Entry types that are already compressed; deflating them again wastes CPU
+PRECOMPRESSED_EXTENSIONS = frozenset(
+    {".png", ".jpg", ".jpeg", ".gif", ".webp", ".woff", ".woff2", ".mp3", ".mp4"}
+)
+
+
+@dataclass
+class CompressionPolicy:
+    """How each entry of the EPUB container is compressed.
+
+    Already-compressed media is stored as-is and text is deflated at
+    ``text_level``. ``max_compression`` (for release builds) deflates text at
+    level 9 and deflates media too, but only where that makes it smaller.
+    """
+
+    text_level: int = 6
+    max_compression: bool = False
+
+    def choose(self, name: str, data: bytes) -> tuple[int, int | None]:
+        """Return ``(compress_type, compresslevel)`` for one entry."""
+        if Path(name).suffix.lower() not in PRECOMPRESSED_EXTENSIONS:
+            level = 9 if self.max_compression else self.text_level
+            return zipfile.ZIP_DEFLATED, level
+        if self.max_compression and len(zlib.compress(data, 9)) < len(data):
+            return zipfile.ZIP_DEFLATED, 9
+        return zipfile.ZIP_STORED, None
+
+
 @dataclass
 class EPUBConfig:
     """Configuration for EPUB generation."""
@@ -116,6 +225,10 @@ class EPUBConfig:
     language: str = "en"
     author: str = "Claude Code Community"
 
+    # Content (chapter_order, then manifest_path, then get_chapter_order())
+    chapter_order: list[tuple[str, str]] | None = None
+    manifest_path: Path | None = None
+
     # Cover Settings
     cover_width: int = 600
     cover_height: int = 900
@@ -129,6 +242,28 @@ class EPUBConfig:
     max_retries: int = 3
     max_concurrent_requests: int = 10
 
+    # External link checking (off by default: it needs the network)
+    check_links: bool = False
+    max_requests_per_host: int = 4
+    link_cache_path: Path | None = None
+    link_cache_ttl: float = 24 * 3600.0
+
+    # Error handling: strict (fail fast) unless degraded output is allowed
+    degraded: bool = False
+
+    # Packaging Settings
+    compression: CompressionPolicy = field(default_factory=CompressionPolicy)
+    search_index: bool = True
+
+    # JSON build report with size and timing breakdown (optional)
+    report_path: Path | None = None
+
+    # Structural check of the written EPUB
+    validate: bool = False
+
+    # Persistent caches: rendered diagrams and the last build's record
+    cache_dir: Path | None = None
+
     # Font paths (platform-specific)
     title_font_paths: list[str] = field(
         default_factory=lambda: [
@@ -148,6 +283,41 @@ class EPUBConfig:
     )
 
 
+@dataclass
+class DiagramFailure:
+    """A diagram that could not be rendered in degraded mode."""
+
+    index: int
+    error: str
+    files: list[str] = field(default_factory=list)
+
+
+@dataclass
+class ChapterReport:
+    """Size and conversion cost of one chapter, for the build report."""
+
+    chapter: str
+    source: str
+    source_bytes: int
+    source_sha256: str = ""
+    xhtml_bytes: int = 0
+    seconds: float = 0.0
+    diagrams: int = 0
+    links: int = 0
+
+
+@dataclass
+class DiagramReport:
+    """Render latency and cache outcome of one diagram, for the build report."""
+
+    index: int
+    image: str
+    cache: str  # "hit" (already rendered or in flight) or "miss"
+    seconds: float
+    png_bytes: int
+    wait_seconds: float = 0.0  # Queued for a request slot, part of ``seconds``
+
+
 @dataclass
 class BuildState:
     """Mutable state for the build process."""
@@ -156,6 +326,15 @@ class BuildState:
     mermaid_counter: int = 0
     mermaid_added_to_book: set[str] = field(default_factory=set)
     path_to_chapter: dict[str, str] = field(default_factory=dict)
+    packaging_stats: dict[str, PackagingStats] = field(default_factory=dict)
+    diagram_failures: dict[str, DiagramFailure] = field(default_factory=dict)
+    external_links: dict[str, set[str]] = field(default_factory=dict)
+    broken_links: dict[str, LinkResult] = field(default_factory=dict)
+    stage_seconds: dict[str, float] = field(default_factory=dict)
+    chapter_reports: list[ChapterReport] = field(default_factory=list)
+    diagram_reports: dict[str, DiagramReport] = field(default_factory=dict)
+    local_images: dict[str, str] = field(default_factory=dict)
+    chapter_ids: dict[str, set[str]] = field(default_factory=dict)
 
     def reset(self) -> None:
         """Reset all state for a fresh build."""
@@ -163,6 +342,15 @@ class BuildState:
         self.mermaid_counter = 0
         self.mermaid_added_to_book.clear()
         self.path_to_chapter.clear()
+        self.packaging_stats.clear()
+        self.diagram_failures.clear()
+        self.external_links.clear()
+        self.broken_links.clear()
+        self.stage_seconds.clear()
+        self.chapter_reports.clear()
+        self.diagram_reports.clear()
+        self.local_images.clear()
+        self.chapter_ids.clear()
 
 
 @dataclass
@@ -175,6 +363,310 @@ class ChapterInfo:
     chapter_filename: str
     is_folder_overview: bool = False
     folder_name: str | None = None
+    section_path: tuple[str, ...] = ()
+
+
+# =============================================================================
+# Shared Resources
+# =============================================================================
+
+
+MARKDOWN_EXTENSIONS = ["tables", "fenced_code", "codehilite", "toc"]
+
+
+def github_slug(value: str, separator: str) -> str:
+    """Make a heading id the way GitHub does, so in-guide anchors resolve.
+
+    Lowercases, drops punctuation and emoji, and replaces each space with
+    ``separator`` without collapsing runs ("🎓 Learning Path" becomes
+    "-learning-path", "Comparison & Integration" "comparison--integration").
+    """
+    value = re.sub(r"[^\w\- ]", "", value.strip().lower())
+    return value.replace(" ", separator)
+
+
+MARKDOWN_EXTENSION_CONFIGS = {"toc": {"slugify": github_slug}}
+
+
+MAX_IDLE_CONVERTERS = 4
+DIAGRAM_CACHE_BYTES = 64 * 1024 * 1024
+COVER_CACHE_BYTES = 16 * 1024 * 1024
+
+
+class MarkdownConverterPool:
+    """Reusable markdown converters shared between builds.
+
+    Creating a converter loads every extension, so converters are reset
+    and reused instead; at most ``max_idle`` are kept between conversions.
+    Converted documents are not kept: chapters are converted after their
+    per-build diagram rewrite, so editions rarely share identical input.
+    Conversion is CPU-bound and runs in build worker threads, which the GIL
+    lets convert one chapter at a time.
+    """
+
+    def __init__(self, max_idle: int = MAX_IDLE_CONVERTERS) -> None:
+        self.max_idle = max_idle
+        self._idle: list[markdown.Markdown] = []
+        self._lock = threading.Lock()
+
+    def convert(self, md_content: str) -> str:
+        """Convert markdown to HTML with an idle converter."""
+        with self._lock:
+            converter = self._idle.pop() if self._idle else None
+        if converter is None:
+            converter = markdown.Markdown(
+                extensions=MARKDOWN_EXTENSIONS,
+                extension_configs=MARKDOWN_EXTENSION_CONFIGS,
+            )
+
+        try:
+            return converter.reset().convert(md_content)
+        finally:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(converter)
+
+
+class ByteLRUCache:
+    """Thread-safe cache of byte strings, bounded by their total size.
+
+    The least recently used entries are evicted once the total exceeds
+    ``max_bytes``; a value larger than the whole budget is not kept.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, key: Hashable) -> bytes:
+        data = self.get(key)
+        if data is None:
+            raise KeyError(key)
+        return data
+
+    def __setitem__(self, key: Hashable, data: bytes) -> None:
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get(self, key: Hashable) -> bytes | None:
+        """Return the cached value (marking it recently used), or None."""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+
+class FileIndex:
+    """Cache of markdown sources and directory listings used during a build."""
+
+    def __init__(self) -> None:
+        self._text: dict[Path, str] = {}
+        self._listings: dict[Path, list[str]] = {}
+
+    def markdown_files(self, directory: Path) -> list[str]:
+        """List markdown files under a directory, walking it only once."""
+        listing = self._listings.get(directory)
+        if listing is None:
+            listing = list_markdown_files(directory)
+            self._listings[directory] = listing
+        return listing
+
+    def read_text(self, path: Path) -> str:
+        """Read a UTF-8 file once and serve later reads from memory."""
+        text = self._text.get(path)
+        if text is None:
+            text = path.read_text(encoding="utf-8")
+            self._text[path] = text
+        return text
+
+
+DIAGRAM_DISK_CACHE_BYTES = 256 * 1024 * 1024
+DIAGRAM_DISK_CACHE_AGE = 30 * 24 * 3600.0
+
+
+class DiagramDiskCache:
+    """Rendered diagrams kept on disk between builds.
+
+    Files are named by the SHA-256 of the diagram source, so lookups need
+    no index and ``--plan`` can check them without rendering anything.
+    Writes go through a temporary file so readers never see partial PNGs.
+    A file's modification time is its last use; ``prune`` drops diagrams
+    unused for ``max_age`` seconds and then the least recently used ones
+    beyond ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_bytes: int = DIAGRAM_DISK_CACHE_BYTES,
+        max_age: float = DIAGRAM_DISK_CACHE_AGE,
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def path(self, cache_key: str) -> Path:
+        digest = hashlib.sha256(cache_key.encode("utf-8")).hexdigest()
+        return self.directory / f"{digest}.png"
+
+    def __contains__(self, cache_key: str) -> bool:
+        return self.path(cache_key).is_file()
+
+    def get(self, cache_key: str) -> bytes | None:
+        path = self.path(cache_key)
+        try:
+            data = path.read_bytes()
+            path.touch()  # Record the use for prune()
+        except OSError:
+            return None
+        return data
+
+    def put(self, cache_key: str, data: bytes) -> None:
+        """Store a diagram; the cache is best effort, so failures are ignored."""
+        path = self.path(cache_key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(data)
+            tmp_path.replace(path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+
+    def prune(self) -> int:
+        """Evict stale and least recently used diagrams; return how many."""
+        files: list[tuple[float, int, Path]] = []
+        for path in self.directory.glob("*.png"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        oldest = time.time() - self.max_age
+        kept = removed = 0
+        for mtime, size, path in sorted(files, reverse=True):
+            if mtime >= oldest and kept + size <= self.max_bytes:
+                kept += size
+                continue
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+@dataclass
+class SharedResources:
+    """Caches and connections that can be shared between builds.
+
+    A single build creates its own instance. Batch builds hand the same
+    instance to every edition, so each diagram, font and cover is produced
+    once per batch rather than once per edition. Diagrams and covers are
+    held in size-bounded caches so a long-lived daemon does not grow
+    without limit. With a ``disk`` cache, rendered diagrams also outlive
+    the process.
+    """
+
+    diagrams: ByteLRUCache = field(
+        default_factory=lambda: ByteLRUCache(DIAGRAM_CACHE_BYTES)
+    )
+    fonts: dict[tuple[str, int], ImageFont.FreeTypeFont | ImageFont.ImageFont] = field(
+        default_factory=dict
+    )
+    covers: ByteLRUCache = field(
+        default_factory=lambda: ByteLRUCache(COVER_CACHE_BYTES)
+    )
+    converters: MarkdownConverterPool = field(default_factory=MarkdownConverterPool)
+    files: FileIndex = field(default_factory=FileIndex)
+    client: httpx.AsyncClient | None = None
+    semaphore: asyncio.Semaphore | None = None
+    disk: DiagramDiskCache | None = None
+    _pending: dict[str, asyncio.Future[bytes]] = field(default_factory=dict, repr=False)
+    _waiters: dict[str, int] = field(default_factory=dict, repr=False)
+
+    async def fetch_diagram(
+        self, cache_key: str, fetch: Callable[[], Awaitable[bytes]]
+    ) -> bytes:
+        """Return diagram bytes, running ``fetch`` at most once per diagram.
+
+        Concurrent builds asking for the same diagram wait on one request.
+        The request is cancelled once every build waiting on it is cancelled.
+        """
+        data = self.diagrams.get(cache_key)
+        if data is not None:
+            return data
+        if self.disk is not None:
+            data = self.disk.get(cache_key)
+            if data is not None:
+                self.diagrams[cache_key] = data
+                return data
+
+        pending = self._pending.get(cache_key)
+        if pending is None:
+            pending = asyncio.ensure_future(fetch())
+            self._pending[cache_key] = pending
+            pending.add_done_callback(lambda task: self._on_fetched(cache_key, task))
+
+        self._waiters[cache_key] = self._waiters.get(cache_key, 0) + 1
+        try:
+            return await asyncio.shield(pending)
+        finally:
+            self._waiters[cache_key] -= 1
+            if not self._waiters[cache_key]:
+                del self._waiters[cache_key]
+                pending.cancel()  # No-op once the fetch has finished
+
+    @classmethod
+    def for_config(cls, config: EPUBConfig) -> SharedResources:
+        """Fresh resources, with the on-disk diagram cache if one is configured."""
+        if config.cache_dir is None:
+            return cls()
+        return cls(disk=DiagramDiskCache(config.cache_dir / "diagrams"))
+
+    def has_diagram(self, cache_key: str) -> bool:
+        """Whether a diagram is cached or already being fetched."""
+        return (
+            cache_key in self.diagrams
+            or cache_key in self._pending
+            or (self.disk is not None and cache_key in self.disk)
+        )
+
+    def _on_fetched(self, cache_key: str, task: asyncio.Future[bytes]) -> None:
+        """Move a finished fetch into the diagram cache."""
+        self._pending.pop(cache_key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.diagrams[cache_key] = task.result()
+            if self.disk is not None:
+                self.disk.put(cache_key, task.result())
+
+
+def create_http_client(config: EPUBConfig) -> httpx.AsyncClient:
+    """Create the HTTP client used for diagram rendering."""
+    return httpx.AsyncClient(
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=config.max_concurrent_requests),
+        timeout=httpx.Timeout(config.request_timeout),
+    )
 
 
 # =============================================================================
@@ -222,9 +714,8 @@ def validate_inputs(config: EPUBConfig, logger: logging.Logger) -> None:
             f"Logo file not found: {logo_path}. Cover will be generated without logo."
         )
 
-    # Verify at least some markdown files exist
-    md_files = list(config.root_path.glob("**/*.md"))
-    if not md_files:
+    # Verify at least some markdown files exist (stop at the first one)
+    if next(config.root_path.glob("**/*.md"), None) is None:
         errors.append(f"No markdown files found in {config.root_path}")
 
     if errors:
@@ -250,15 +741,27 @@ def sanitize_mermaid(mermaid_code: str) -> str:
     return sanitized
 
 
+def kroki_diagram_url(base_url: str, mermaid_code: str) -> str:
+    """Kroki GET URL that renders ``mermaid_code`` as PNG."""
+    compressed = zlib.compress(mermaid_code.encode("utf-8"), level=9)
+    encoded = base64.urlsafe_b64encode(compressed).decode("ascii")
+    return f"{base_url}/mermaid/png/{encoded}"
+
+
 class MermaidRenderer:
     """Async renderer for Mermaid diagrams via Kroki.io API."""
 
     def __init__(
-        self, config: EPUBConfig, state: BuildState, logger: logging.Logger
+        self,
+        config: EPUBConfig,
+        state: BuildState,
+        logger: logging.Logger,
+        shared: SharedResources | None = None,
     ) -> None:
         self.config = config
         self.state = state
         self.logger = logger
+        self.shared = shared or SharedResources()
         self._semaphore: asyncio.Semaphore | None = None
 
     async def _fetch_single(
@@ -271,43 +774,75 @@ class MermaidRenderer:
         if cache_key in self.state.mermaid_cache:
             self.logger.debug(f"Cache hit for diagram {index}")
             return cache_key, self.state.mermaid_cache[cache_key]
+        cache = "hit" if self.shared.has_diagram(cache_key) else "miss"
+        if cache == "hit":
+            self.logger.debug(f"Shared cache hit for diagram {index}")
+        started = time.perf_counter()
+        acquired = None
+
+        async def fetch() -> bytes:
+            nonlocal acquired
+            # Rate limit with semaphore
+            assert self._semaphore is not None
+            async with self._semaphore:
+                acquired = time.perf_counter()
+                result = await self._fetch_with_retry(client, mermaid_code, index)
+                if result is None:
+                    raise MermaidRenderError(
+                        f"Failed to render Mermaid diagram {index} after {self.config.max_retries} attempts"
+                    )
+                return result
 
-        # Rate limit with semaphore
-        assert self._semaphore is not None
-        async with self._semaphore:
-            result = await self._fetch_with_retry(client, mermaid_code, index)
-            if result is None:
-                raise MermaidRenderError(
-                    f"Failed to render Mermaid diagram {index} after {self.config.max_retries} attempts"
-                )
-            return cache_key, result
+        data = await self.shared.fetch_diagram(cache_key, fetch)
+        result = self._store(cache_key, data)
+        self.state.diagram_reports[cache_key] = DiagramReport(
+            index=index,
+            image=result[1],
+            cache=cache,
+            seconds=round(time.perf_counter() - started, 4),
+            png_bytes=len(data),
+            wait_seconds=round(acquired - started, 4) if acquired is not None else 0.0,
+        )
+        return cache_key, result
+
+    def _store(self, cache_key: str, data: bytes) -> tuple[bytes, str]:
+        """Name a rendered diagram for this build and cache it."""
+        self.state.mermaid_counter += 1
+        img_name = f"mermaid_{self.state.mermaid_counter}.png"
+        result = (data, img_name)
+        self.state.mermaid_cache[cache_key] = result
+        return result
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=1, max=10),
-        retry=retry_if_exception_type((httpx.TimeoutException, httpx.NetworkError)),
-        reraise=True,
-    )
     async def _fetch_with_retry(
         self, client: httpx.AsyncClient, mermaid_code: str, index: int
-    ) -> tuple[bytes, str] | None:
-        """Fetch diagram with retry logic."""
+    ) -> bytes | None:
+        """Fetch diagram, retrying timeouts and network errors with backoff."""
+        retrying = tenacity.AsyncRetrying(
+            stop=tenacity.stop_after_attempt(self.config.max_retries),
+            wait=tenacity.wait_exponential(multiplier=1, min=1, max=10),
+            retry=tenacity.retry_if_exception_type(
+                (httpx.TimeoutException, httpx.NetworkError)
+            ),
+            reraise=True,
+        )
+        async for attempt in retrying:
+            with attempt:
+                return await self._fetch_once(client, mermaid_code, index)
+        return None
+
+    async def _fetch_once(
+        self, client: httpx.AsyncClient, mermaid_code: str, index: int
+    ) -> bytes:
+        """Fetch a diagram from Kroki once."""
         try:
-            compressed = zlib.compress(mermaid_code.encode("utf-8"), level=9)
-            encoded = base64.urlsafe_b64encode(compressed).decode("ascii")
-            url = f"{self.config.kroki_base_url}/mermaid/png/{encoded}"
+            url = kroki_diagram_url(self.config.kroki_base_url, mermaid_code)
 
             self.logger.debug(f"Fetching diagram {index}...")
             response = await client.get(url, timeout=self.config.request_timeout)
 
             if response.status_code == 200:
-                self.state.mermaid_counter += 1
-                img_name = f"mermaid_{self.state.mermaid_counter}.png"
-                result = (response.content, img_name)
-                cache_key = mermaid_code.strip()
-                self.state.mermaid_cache[cache_key] = result
-                self.logger.info(f"Rendered diagram {index} -> {img_name}")
-                return result
+                self.logger.info(f"Rendered diagram {index}")
+                return response.content
             else:
                 self.logger.warning(
                     f"Kroki API returned {response.status_code} for diagram {index}"
@@ -329,26 +864,19 @@ class MermaidRenderer:
         self, diagrams: list[tuple[int, str]]
     ) -> dict[str, tuple[bytes, str]]:
         """Render all Mermaid diagrams concurrently."""
-        self._semaphore = asyncio.Semaphore(self.config.max_concurrent_requests)
+        self._semaphore = self.shared.semaphore or asyncio.Semaphore(
+            self.config.max_concurrent_requests
+        )
         results: dict[str, tuple[bytes, str]] = {}
 
-        async with httpx.AsyncClient(
-            follow_redirects=True,
-            limits=httpx.Limits(max_connections=self.config.max_concurrent_requests),
-            timeout=httpx.Timeout(self.config.request_timeout),
-        ) as client:
-            tasks = [
-                self._fetch_single(client, sanitize_mermaid(code), idx)
-                for idx, code in diagrams
-            ]
-
-            self.logger.info(f"Fetching {len(tasks)} Mermaid diagrams concurrently...")
-
-            # Use gather with return_exceptions=False for strict mode
-            completed = await asyncio.gather(*tasks)
+        if self.shared.client is not None:
+            completed = await self._gather(self.shared.client, diagrams)
+        else:
+            async with create_http_client(self.config) as client:
+                completed = await self._gather(client, diagrams)
 
-            for cache_key, data in completed:
-                results[cache_key] = data
+        for cache_key, data in completed:
+            results[cache_key] = data
 
         success_count = len(results)
         self.logger.info(
@@ -356,19 +884,74 @@ class MermaidRenderer:
         )
         return results
 
+    async def _gather(
+        self, client: httpx.AsyncClient, diagrams: list[tuple[int, str]]
+    ) -> list[tuple[str, tuple[bytes, str]]]:
+        """Fetch every diagram through ``client``.
+
+        In strict mode the first failure cancels every outstanding fetch
+        (including pending retries) and is raised. In degraded mode failures
+        are recorded in ``state.diagram_failures`` and the rest complete.
+        """
+        tasks = [
+            asyncio.ensure_future(
+                self._fetch_single(client, sanitize_mermaid(code), idx)
+            )
+            for idx, code in diagrams
+        ]
+
+        self.logger.info(f"Fetching {len(tasks)} Mermaid diagrams concurrently...")
+
+        if self.config.degraded:
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+            completed = []
+            for (idx, code), outcome in zip(diagrams, outcomes, strict=True):
+                if isinstance(outcome, Exception):
+                    self._record_failure(idx, code, outcome)
+                elif isinstance(outcome, BaseException):
+                    raise outcome
+                else:
+                    completed.append(outcome)
+            return completed
+
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in tasks:
+                if task in done and task.exception() is not None:
+                    raise task.exception()  # type: ignore[misc]
+            return [task.result() for task in tasks]
+        finally:
+            outstanding = [task for task in tasks if not task.done()]
+            for task in outstanding:
+                task.cancel()
+            if outstanding:
+                self.logger.info(f"Cancelled {len(outstanding)} outstanding fetches")
+                await asyncio.gather(*outstanding, return_exceptions=True)
+
+    def _record_failure(self, index: int, mermaid_code: str, error: Exception) -> None:
+        """Remember a diagram that failed so it can be replaced by a placeholder."""
+        self.logger.error(f"Diagram {index} failed, using a placeholder: {error}")
+        cache_key = sanitize_mermaid(mermaid_code).strip()
+        self.state.diagram_failures[cache_key] = DiagramFailure(
+            index=index, error=str(error) or type(error).__name__
+        )
+
 
 def extract_all_mermaid_blocks(
-    md_files: list[tuple[Path, str]], logger: logging.Logger
+    md_files: list[tuple[Path, str]],
+    logger: logging.Logger,
+    files: FileIndex | None = None,
 ) -> list[tuple[int, str]]:
     """Extract all unique Mermaid code blocks from markdown files."""
     pattern = r"```mermaid\n(.*?)```"
     seen: set[str] = set()
     diagrams: list[tuple[int, str]] = []
     counter = 0
+    files = files or FileIndex()
 
     for file_path, _ in md_files:
         try:
-            content = file_path.read_text(encoding="utf-8")
+            content = files.read_text(file_path)
             for match in re.finditer(pattern, content, flags=re.DOTALL):
                 code = match.group(1).strip()
                 if code not in seen:
@@ -403,116 +986,345 @@ def get_chapter_order() -> list[tuple[str, str]]:
         ("07-plugins", "Plugins"),
         ("08-checkpoints", "Checkpoints"),
         ("09-advanced-features", "Advanced Features"),
+        ("10-cli", "CLI Reference"),
         ("resources.md", "Resources"),
     ]
 
 
-def collect_folder_files(folder_path: Path) -> list[tuple[Path, str]]:
+@dataclass
+class ManifestEntry:
+    """A chapter manifest entry: a file, a folder, or a section of globs."""
+
+    title: str
+    path: str | None = None
+    include: list[str] = field(default_factory=list)
+    exclude: list[str] = field(default_factory=list)
+    sections: list[ManifestEntry] = field(default_factory=list)
+
+
+ChapterOrder = Sequence[tuple[str, str] | ManifestEntry]
+
+DEFAULT_MANIFEST = Path(__file__).with_name("chapters.toml")
+
+# Vendored, generated and environment folders never hold book chapters
+SKIP_DIRS = frozenset(
+    {"__pycache__", "build", "dist", "node_modules", "site-packages", "venv"}
+)
+
+
+def _glob_to_regex(pattern: str) -> re.Pattern[str]:
+    """Compile a root-relative glob (``*``, ``?``, ``**``) to a regex."""
+    parts: list[str] = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile("".join(parts))
+
+
+def _glob_base(pattern: str) -> str:
+    """Leading folders of a root-relative glob that contain no wildcard."""
+    base: list[str] = []
+    for part in pattern.split("/")[:-1]:
+        if "*" in part or "?" in part:
+            break
+        base.append(part)
+    return "/".join(base)
+
+
+def _parse_manifest_entry(data: object, where: str) -> ManifestEntry:
+    """Build a ManifestEntry from one parsed TOML table."""
+    if not isinstance(data, dict) or not isinstance(data.get("title"), str):
+        raise ValidationError(f"{where}: every entry needs a 'title'")
+
+    entry = ManifestEntry(
+        title=data["title"],
+        path=data.get("path"),
+        include=list(data.get("include", [])),
+        exclude=list(data.get("exclude", [])),
+        sections=[
+            _parse_manifest_entry(section, f"{where} > {data['title']}")
+            for section in data.get("section", [])
+        ],
+    )
+    if entry.path is None and not entry.include and not entry.sections:
+        raise ValidationError(
+            f"{where}: '{entry.title}' needs a 'path', 'include' or 'section'"
+        )
+    return entry
+
+
+def load_manifest(manifest_path: Path) -> list[ManifestEntry]:
+    """Load the chapter order from a TOML manifest.
+
+    Each ``[[chapter]]`` table has a ``title`` and any of ``path`` (a file or
+    folder), ``include``/``exclude`` globs relative to the root, and nested
+    ``[[chapter.section]]`` tables. A file belongs to the first entry that
+    claims it, so later catch-all globs skip files already placed.
+    """
+    try:
+        data = tomllib.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        raise ValidationError(f"Cannot read manifest {manifest_path}: {e}") from e
+
+    entries = [
+        _parse_manifest_entry(chapter, str(manifest_path))
+        for chapter in data.get("chapter", [])
+    ]
+    if not entries:
+        raise ValidationError(f"Manifest lists no chapters: {manifest_path}")
+    return entries
+
+
+def _folder_order_key(rel_path: str) -> tuple[tuple[object, ...], ...]:
+    """Sort key placing README first, then files, then subfolders (recursively)."""
+    *dirs, name = rel_path.split("/")
+    return (*((1, d) for d in dirs), (0, name != "README.md", name))
+
+
+def _titleize(name: str) -> str:
+    """Turn a file or folder name into a display title."""
+    return name.replace("-", " ").replace("_", " ").title()
+
+
+def _file_title(rel_path: str) -> str:
+    """Title for a file relative to its folder, prefixed by subfolder names."""
+    *dirs, name = rel_path.split("/")
+    title = "Overview" if name == "README.md" else _titleize(Path(name).stem)
+    return ": ".join([*(_titleize(d) for d in dirs), title])
+
+
+def list_markdown_files(directory: Path) -> list[str]:
+    """List markdown files under a directory in a single walk.
+
+    Returns POSIX paths relative to ``directory`` in folder order (see
+    ``_folder_order_key``). Hidden subdirectories and ``SKIP_DIRS`` are
+    skipped.
+    """
+    found: list[str] = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [
+            d for d in dirnames if not d.startswith(".") and d not in SKIP_DIRS
+        ]
+        rel_dir = os.path.relpath(dirpath, directory).replace(os.sep, "/")
+        prefix = "" if rel_dir == "." else rel_dir + "/"
+        found.extend(prefix + name for name in filenames if name.endswith(".md"))
+    found.sort(key=_folder_order_key)
+    return found
+
+
+def collect_folder_files(
+    folder_path: Path, files: FileIndex | None = None
+) -> list[tuple[Path, str]]:
     """Collect all markdown files from a folder, README first."""
-    files: list[tuple[Path, str]] = []
-
-    # Get README first if it exists
-    readme = folder_path / "README.md"
-    if readme.exists():
-        files.append((readme, "Overview"))
-
-    # Get all other markdown files
-    for md_file in sorted(folder_path.glob("*.md")):
-        if md_file.name != "README.md":
-            title = md_file.stem.replace("-", " ").replace("_", " ").title()
-            files.append((md_file, title))
-
-    # Recursively get subfolders
-    for subfolder in sorted(folder_path.iterdir()):
-        if subfolder.is_dir() and not subfolder.name.startswith("."):
-            subfiles = collect_folder_files(subfolder)
-            for sf, st in subfiles:
-                rel_path = sf.relative_to(folder_path)
-                if len(rel_path.parts) > 1:
-                    prefix = (
-                        rel_path.parts[0].replace("-", " ").replace("_", " ").title()
-                    )
-                    files.append((sf, f"{prefix}: {st}"))
-                else:
-                    files.append((sf, st))
+    listing = (files or FileIndex()).markdown_files(folder_path)
+    return [(folder_path / rel, _file_title(rel)) for rel in listing]
 
-    return files
+
+@dataclass
+class _CollectedFile:
+    """A source file placed by the collector, before it is numbered."""
+
+    rel_path: str
+    display_name: str
+    file_title: str
+    section_path: tuple[str, ...]
+    is_overview: bool
 
 
 class ChapterCollector:
-    """Collects and organizes chapter information in a single pass."""
+    """Collects and organizes chapter information in a single pass.
+
+    Only the folders the manifest names, and the fixed leading folders of
+    its globs, are walked, each once. Chapter files are named ``chap_<n>.xhtml`` or
+    ``chap_<n>_<i>.xhtml`` with zero padding sized to the number of
+    entries, so names stay unique and sort in reading order at any scale.
+    """
 
-    def __init__(self, root_path: Path, state: BuildState) -> None:
+    def __init__(
+        self, root_path: Path, state: BuildState, files: FileIndex | None = None
+    ) -> None:
         self.root_path = root_path
         self.state = state
+        self.files = files or FileIndex()
 
-    def collect_all_chapters(
-        self, chapter_order: list[tuple[str, str]]
-    ) -> list[ChapterInfo]:
+    def collect_all_chapters(self, chapter_order: ChapterOrder) -> list[ChapterInfo]:
         """Collect all chapters and build path mapping in one pass."""
+        entries = [
+            item
+            if isinstance(item, ManifestEntry)
+            else ManifestEntry(title=item[1], path=item[0])
+            for item in chapter_order
+        ]
+
+        claimed: set[str] = set()
+        groups: list[tuple[ManifestEntry, list[_CollectedFile]]] = []
+        for entry in entries:
+            collected = self._expand(entry, (), claimed)
+            if collected:
+                groups.append((entry, collected))
+
         chapters: list[ChapterInfo] = []
-        chapter_num = 0
-
-        for item, display_name in chapter_order:
-            item_path = self.root_path / item
-
-            if item_path.is_file() and item_path.suffix == ".md":
-                chapter_num += 1
-                chapter_filename = f"chap_{chapter_num:02d}.xhtml"
-                self.state.path_to_chapter[item] = chapter_filename
-
-                chapters.append(
-                    ChapterInfo(
-                        file_path=item_path,
-                        display_name=display_name,
-                        file_title=display_name,
-                        chapter_filename=chapter_filename,
-                    )
-                )
+        width = max(2, len(str(len(groups))))
+        for chapter_num, (entry, collected) in enumerate(groups, start=1):
+            if len(collected) == 1 and not collected[0].section_path:
+                chapter_filename = f"chap_{chapter_num:0{width}d}.xhtml"
+                chapters.append(self._chapter(collected[0], chapter_filename))
+                continue
 
-            elif item_path.is_dir():
-                folder_chapters = self._collect_folder(
-                    item_path, item, display_name, chapter_num
+            file_width = max(2, len(str(len(collected) - 1)))
+            for i, item in enumerate(collected):
+                chapter_filename = (
+                    f"chap_{chapter_num:0{width}d}_{i:0{file_width}d}.xhtml"
                 )
-                if folder_chapters:
-                    chapter_num += 1
-                    chapters.extend(folder_chapters)
+                chapters.append(self._chapter(item, chapter_filename))
+                if i == 0 and entry.path:
+                    # Map folder itself
+                    self.state.path_to_chapter[entry.path] = chapter_filename
+                    self.state.path_to_chapter[entry.path.rstrip("/")] = (
+                        chapter_filename
+                    )
 
         return chapters
 
-    def _collect_folder(
-        self, folder_path: Path, item: str, display_name: str, base_chapter_num: int
-    ) -> list[ChapterInfo]:
-        """Collect chapters from a folder."""
-        folder_files = collect_folder_files(folder_path)
-        if not folder_files:
-            return []
+    def _chapter(self, item: _CollectedFile, chapter_filename: str) -> ChapterInfo:
+        """Record a numbered file and return its ChapterInfo."""
+        self.state.path_to_chapter[str(Path(item.rel_path))] = chapter_filename
+        return ChapterInfo(
+            file_path=self.root_path / item.rel_path,
+            display_name=item.display_name,
+            file_title=item.file_title,
+            chapter_filename=chapter_filename,
+            is_folder_overview=item.is_overview,
+            folder_name=item.section_path[0] if item.section_path else None,
+            section_path=item.section_path,
+        )
 
-        chapter_num = base_chapter_num + 1
-        chapters: list[ChapterInfo] = []
+    def _expand(
+        self,
+        entry: ManifestEntry,
+        parents: tuple[str, ...],
+        claimed: set[str],
+    ) -> list[_CollectedFile]:
+        """Resolve an entry and its nested sections to ordered files."""
+        item_path = self.root_path / entry.path if entry.path else None
+        is_single_file = (
+            item_path is not None
+            and item_path.is_file()
+            and item_path.suffix == ".md"
+            and not entry.include
+            and not entry.sections
+        )
 
-        # Map folder itself
-        first_filename = f"chap_{chapter_num:02d}_00.xhtml"
-        self.state.path_to_chapter[item] = first_filename
-        self.state.path_to_chapter[item.rstrip("/")] = first_filename
-
-        for i, (file_path, file_title) in enumerate(folder_files):
-            chapter_filename = f"chap_{chapter_num:02d}_{i:02d}.xhtml"
-            rel_path = str(file_path.relative_to(self.root_path))
-            self.state.path_to_chapter[rel_path] = chapter_filename
-
-            chapters.append(
-                ChapterInfo(
-                    file_path=file_path,
-                    display_name=display_name if i == 0 else file_title,
-                    file_title=file_title,
-                    chapter_filename=chapter_filename,
-                    is_folder_overview=(i == 0),
-                    folder_name=display_name,
+        if is_single_file:
+            assert entry.path is not None
+            rel = Path(entry.path).as_posix()
+            if rel in claimed:
+                return []
+            claimed.add(rel)
+            return [
+                _CollectedFile(
+                    rel_path=rel,
+                    display_name=entry.title,
+                    file_title=entry.title,
+                    section_path=parents,
+                    is_overview=False,
                 )
+            ]
+
+        section_path = (*parents, entry.title)
+        own: list[tuple[str, str]] = []
+
+        if item_path is not None and item_path.is_dir():
+            folder = Path(entry.path or "").as_posix().rstrip("/")
+            own.extend(
+                (f"{folder}/{rel}", _file_title(rel))
+                for rel in self._folder_listing(folder)
+                if f"{folder}/{rel}" not in claimed
             )
 
-        return chapters
+        if entry.include:
+            matched = self._match_globs(entry.include, entry.exclude)
+            matched = [rel for rel in matched if rel not in claimed]
+            # Root-relative POSIX paths: split off the file name directly
+            base = os.path.commonpath(
+                [rel.rpartition("/")[0] for rel in matched or [""]]
+            )
+            own.extend(
+                (rel, _file_title(rel[len(base) + 1 :] if base else rel))
+                for rel in matched
+            )
+
+        collected: list[_CollectedFile] = []
+        for i, (rel, title) in enumerate(own):
+            if rel in claimed:
+                continue
+            claimed.add(rel)
+            collected.append(
+                _CollectedFile(
+                    rel_path=rel,
+                    display_name=entry.title if i == 0 else title,
+                    file_title=title,
+                    section_path=section_path,
+                    is_overview=(i == 0),
+                )
+            )
+
+        for section in entry.sections:
+            collected.extend(self._expand(section, section_path, claimed))
+
+        return collected
+
+    def _folder_listing(self, folder: str) -> list[str]:
+        """Markdown files under a root-relative folder, relative to it."""
+        directory = self.root_path / folder if folder else self.root_path
+        if not directory.is_dir():
+            return []
+        return self.files.markdown_files(directory)
+
+    def _match_globs(self, include: list[str], exclude: list[str]) -> list[str]:
+        """Root-relative markdown files matching ``include`` but not ``exclude``.
+
+        Each pattern only looks at the listing of its fixed leading folders,
+        so ``docs/**/*.md`` never walks the rest of the root.
+        """
+        excluded = [_glob_to_regex(pattern) for pattern in exclude]
+        matched: set[str] = set()
+        for pattern in include:
+            regex = _glob_to_regex(pattern)
+            base = _glob_base(pattern)
+            prefix = f"{base}/" if base else ""
+            matched.update(
+                prefix + rel
+                for rel in self._folder_listing(base)
+                if regex.fullmatch(prefix + rel)
+            )
+        return sorted(
+            (rel for rel in matched if not any(p.fullmatch(rel) for p in excluded)),
+            key=_folder_order_key,
+        )
+
+
+def resolve_chapter_order(config: EPUBConfig) -> ChapterOrder:
+    """Pick the chapter order: explicit list, then manifest, then default."""
+    if config.chapter_order:
+        return config.chapter_order
+    if config.manifest_path is not None:
+        return load_manifest(config.manifest_path)
+    return get_chapter_order()
 
 
 # =============================================================================
@@ -521,13 +1333,21 @@ class ChapterCollector:
 
 
 def load_font(
-    font_paths: list[str], size: int, logger: logging.Logger
+    font_paths: list[str],
+    size: int,
+    logger: logging.Logger,
+    cache: dict[tuple[str, int], ImageFont.FreeTypeFont | ImageFont.ImageFont]
+    | None = None,
 ) -> ImageFont.FreeTypeFont | ImageFont.ImageFont:
     """Load a font from a list of paths, with fallback to default."""
     for font_path in font_paths:
+        if cache is not None and (font_path, size) in cache:
+            return cache[(font_path, size)]
         try:
             font = ImageFont.truetype(font_path, size)
             logger.debug(f"Loaded font: {font_path}")
+            if cache is not None:
+                cache[(font_path, size)] = font
             return font
         except OSError:
             continue
@@ -584,6 +1404,8 @@ def create_cover_image(
     logger: logging.Logger,
     title: str = "Claude Code\nHow-To Guide",
     subtitle: str = "Complete Guide to Claude Code Features",
+    font_cache: dict[tuple[str, int], ImageFont.FreeTypeFont | ImageFont.ImageFont]
+    | None = None,
 ) -> bytes:
     """Create a cover image with proper error handling."""
     try:
@@ -593,8 +1415,8 @@ def create_cover_image(
         draw = ImageDraw.Draw(cover)
 
         # Load fonts once
-        title_font = load_font(config.title_font_paths, 72, logger)
-        subtitle_font = load_font(config.subtitle_font_paths, 24, logger)
+        title_font = load_font(config.title_font_paths, 72, logger, font_cache)
+        subtitle_font = load_font(config.subtitle_font_paths, 24, logger, font_cache)
 
         # Add logo if available
         logo_path = config.logo_path or (config.root_path / "claude-howto-logo.png")
@@ -635,6 +1457,26 @@ def create_cover_image(
         raise CoverGenerationError(f"Cover generation failed: {e}") from e
 
 
+def _cover_cache_key(config: EPUBConfig) -> tuple[object, ...]:
+    """Return the config values that determine the cover image."""
+    logo = config.logo_path or (config.root_path / "claude-howto-logo.png")
+    try:
+        logo_mtime = logo.stat().st_mtime_ns
+    except OSError:
+        logo_mtime = None
+    return (
+        logo,
+        logo_mtime,
+        config.cover_width,
+        config.cover_height,
+        config.cover_bg_color,
+        config.cover_title_color,
+        config.cover_subtitle_color,
+        tuple(config.title_font_paths),
+        tuple(config.subtitle_font_paths),
+    )
+
+
 # =============================================================================
 # HTML Generation
 # =============================================================================
@@ -694,15 +1536,47 @@ def handle_svg_image(src: str, alt: str, logger: logging.Logger) -> str:
     return placeholder
 
 
+def handle_failed_diagram(failure: DiagramFailure, logger: logging.Logger) -> str:
+    """Placeholder for a diagram that could not be rendered (degraded mode).
+
+    Kept on one line so markdown passes it through as a raw HTML block.
+    """
+    logger.debug(f"Replaced failed diagram {failure.index} with a placeholder")
+    return (
+        '<div class="diagram-placeholder" style="border: 1px dashed #ccc; '
+        "padding: 1em; text-align: center; background: #f9f9f9; "
+        'border-radius: 4px; margin: 1em 0;">'
+        f"<p><em>[Diagram {failure.index} could not be rendered]</em></p>"
+        '<p style="font-size: 0.8em; color: #666;">'
+        f"{html.escape(failure.error)}</p></div>"
+    )
+
+
+def diagram_failure_report(state: BuildState) -> list[dict[str, Any]]:
+    """Machine-readable list of diagrams that failed in degraded mode."""
+    return [
+        {"index": f.index, "error": f.error, "files": sorted(set(f.files))}
+        for f in sorted(state.diagram_failures.values(), key=lambda f: f.index)
+    ]
+
+
 # =============================================================================
 # Markdown Processing
 # =============================================================================
 
 
 def process_mermaid_blocks(
-    md_content: str, book: epub.EpubBook, state: BuildState, logger: logging.Logger
+    md_content: str,
+    book: epub.EpubBook,
+    state: BuildState,
+    logger: logging.Logger,
+    current_file: Path | None = None,
 ) -> str:
-    """Find mermaid code blocks and replace with image references."""
+    """Find mermaid code blocks and replace with image references.
+
+    Diagrams that failed in degraded mode become placeholders, and the
+    file they appear in is added to the failure record.
+    """
     pattern = r"```mermaid\n(.*?)```"
 
     def replace_mermaid(match: re.Match[str]) -> str:
@@ -722,6 +1596,11 @@ def process_mermaid_blocks(
                 book.add_item(img_item)
                 state.mermaid_added_to_book.add(img_name)
             return f"\n![Diagram](images/{img_name})\n"
+        elif cache_key in state.diagram_failures:
+            failure = state.diagram_failures[cache_key]
+            if current_file is not None:
+                failure.files.append(str(current_file))
+            return f"\n\n{handle_failed_diagram(failure, logger)}\n\n"
         else:
             # This should not happen in strict mode since we pre-fetch all diagrams
             logger.error("Mermaid diagram not found in cache")
@@ -734,11 +1613,39 @@ def convert_internal_links(
     html_content: str, current_file: Path, root_path: Path, state: BuildState
 ) -> str:
     """Convert markdown links to internal EPUB chapter links."""
-    soup = BeautifulSoup(html_content, "html.parser")
+    soup = bs4.BeautifulSoup(html_content, "html.parser")
+    _rewrite_internal_links(soup, current_file, root_path, state)
+    return str(soup)
+
 
-    for link in soup.find_all("a"):
-        href = link.get("href", "")
-        if not href or href.startswith(("http://", "https://", "mailto:", "#")):
+def _rewrite_internal_links(
+    soup: bs4.BeautifulSoup, current_file: Path, root_path: Path, state: BuildState
+) -> int:
+    """Point relative links in ``soup`` at their EPUB chapters, in place.
+
+    External links are recorded in ``state.external_links`` for checking.
+    Links to files that are not chapters of the book (LICENSE, example
+    scripts, folders, missing files) and anchors that no heading in the
+    chapter defines are unwrapped to plain text, since they cannot resolve
+    inside the EPUB. Returns the number of links in ``soup``.
+    """
+    try:
+        source = current_file.relative_to(root_path).as_posix()
+    except ValueError:
+        source = current_file.as_posix()
+    ids = {str(element["id"]) for element in soup.find_all(id=True)}
+    links = soup.find_all("a", href=True)
+    for link in links:
+        href = link["href"]
+        if href.startswith(("http://", "https://")):
+            url = href.split("#", 1)[0]
+            state.external_links.setdefault(url, set()).add(source)
+            continue
+        if not href or href == "#" or href.startswith(EXTERNAL_SCHEMES):
+            continue
+        if href.startswith("#"):
+            if href[1:] not in ids:
+                link.unwrap()
             continue
 
         # Remove anchor part for path resolution
@@ -748,32 +1655,99 @@ def convert_internal_links(
             anchor = "#" + anchor
 
         # Resolve relative path from current file's directory
-        if href:
-            resolved = (current_file.parent / href).resolve()
-            try:
-                rel_to_root = resolved.relative_to(root_path)
-            except ValueError:
-                # Link points outside the repo
-                continue
+        resolved = (current_file.parent / unquote(href)).resolve()
+        try:
+            rel_to_root = resolved.relative_to(root_path)
+        except ValueError:
+            # Link points outside the repo
+            link.unwrap()
+            continue
 
-            # Normalize the path for lookup
-            lookup_path = str(rel_to_root)
+        # Try the file itself, then the README of a folder
+        for path in (str(rel_to_root), str(rel_to_root / "README.md")):
+            if path in state.path_to_chapter:
+                link["href"] = state.path_to_chapter[path] + anchor
+                break
+        else:
+            link.unwrap()
 
-            # Try various path forms for matching
-            paths_to_try = [
-                lookup_path,
-                lookup_path.rstrip("/"),
-                lookup_path + "/README.md"
-                if not lookup_path.endswith(".md")
-                else lookup_path,
-            ]
+    return len(links)
 
-            for path in paths_to_try:
-                if path in state.path_to_chapter:
-                    link["href"] = state.path_to_chapter[path] + anchor
-                    break
 
-    return str(soup)
+_IMAGE_MEDIA_TYPES = {
+    ".gif": "image/gif",
+    ".jpeg": "image/jpeg",
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+}
+
+
+def _embed_local_image(
+    img: bs4.Tag,
+    current_file: Path,
+    root_path: Path,
+    *,
+    book: epub.EpubBook,
+    state: BuildState,
+    logger: logging.Logger,
+) -> None:
+    """Package a local raster image with the book and point ``img`` at it.
+
+    Each source file is added once per build. Images that cannot be
+    packaged (missing, outside the repo, or not a raster format) are
+    replaced with their alt text so the book has no dangling references.
+    """
+    src = str(img.get("src", ""))
+    if not src or src.startswith(EXTERNAL_SCHEMES):
+        return
+    if src.removeprefix("images/") in state.mermaid_added_to_book:
+        return
+
+    path = (current_file.parent / unquote(src)).resolve()
+    media_type = _IMAGE_MEDIA_TYPES.get(path.suffix.lower())
+    try:
+        rel = path.relative_to(root_path).as_posix()
+    except ValueError:
+        media_type = None
+    if media_type is None or not path.is_file():
+        logger.warning(f"{current_file.name}: image {src} not packaged")
+        img.replace_with(f"[{img.get('alt') or 'Image'}]")
+        return
+
+    file_name = state.local_images.get(rel)
+    if file_name is None:
+        file_name = f"images/{rel.replace('/', '-')}"
+        book.add_item(
+            epub.EpubItem(
+                uid="image-" + re.sub(r"[^\w.-]", "_", rel.replace("/", "-")),
+                file_name=file_name,
+                media_type=media_type,
+                content=path.read_bytes(),
+            )
+        )
+        state.local_images[rel] = file_name
+    img["src"] = file_name
+
+
+_CHAPTER_ANCHOR_RE = re.compile(r'href="([^"#/:]+\.xhtml)#([^"]*)"')
+
+
+def _drop_missing_anchors(chapters: Sequence[epub.EpubHtml], state: BuildState) -> None:
+    """Point links to anchors another chapter lacks at that chapter's top.
+
+    Ids are only known once every chapter is converted, so this runs on the
+    finished XHTML after the chapter loop.
+    """
+
+    def replace(match: re.Match[str]) -> str:
+        target, anchor = match.groups()
+        if html.unescape(anchor) in state.chapter_ids.get(target, ()):
+            return match.group(0)
+        return f'href="{target}"'
+
+    for chapter in chapters:
+        chapter.content = _CHAPTER_ANCHOR_RE.sub(replace, chapter.content)
 
 
 def md_to_html(
@@ -783,44 +1757,932 @@ def md_to_html(
     book: epub.EpubBook,
     state: BuildState,
     logger: logging.Logger,
+    converters: MarkdownConverterPool | None = None,
+    *,
+    search_index: SearchIndexBuilder | None = None,
+    chapter_filename: str | None = None,
+    report: ChapterReport | None = None,
 ) -> str:
     """Convert markdown to HTML with proper styling.
 
     Handles:
     - Mermaid diagrams (rendered as PNG images)
     - SVG images (replaced with styled placeholders)
-    - Internal links (converted to EPUB chapter references)
+    - Local images (packaged with the book)
+    - Internal links (converted to EPUB chapter references, or plain text
+      when the target is not part of the book)
+    - Search indexing (when ``search_index`` and ``chapter_filename`` are given)
+    - Diagram and link counts (when ``report`` is given)
     - Standard markdown features
+
+    The HTML is parsed once and every step works on the same tree.
     """
+    if report is not None:
+        report.diagrams = md_content.count("```mermaid\n")
+
     # Process mermaid blocks first (before markdown conversion)
-    md_content = process_mermaid_blocks(md_content, book, state, logger)
+    md_content = process_mermaid_blocks(md_content, book, state, logger, current_file)
 
     # Convert markdown to HTML
-    html_content = markdown.markdown(
-        md_content,
-        extensions=[
-            "tables",
-            "fenced_code",
-            "codehilite",
-            "toc",
-        ],
-    )
+    if converters is not None:
+        html_content = converters.convert(md_content)
+    else:
+        html_content = markdown.markdown(
+            md_content,
+            extensions=MARKDOWN_EXTENSIONS,
+            extension_configs=MARKDOWN_EXTENSION_CONFIGS,
+        )
 
-    # Clean up any SVG references (they won't work in EPUB)
-    soup = BeautifulSoup(html_content, "html.parser")
+    # Clean up any SVG references (they won't work in EPUB) and package
+    # local images with the book
+    soup = bs4.BeautifulSoup(html_content, "html.parser")
     for img in soup.find_all("img"):
         src = img.get("src", "")
         if src.endswith(".svg"):
             alt = img.get("alt", "Image")
             placeholder = handle_svg_image(src, alt, logger)
-            img.replace_with(BeautifulSoup(placeholder, "html.parser"))
-
-    html_content = str(soup)
+            img.replace_with(bs4.BeautifulSoup(placeholder, "html.parser"))
+        else:
+            _embed_local_image(
+                img, current_file, root_path, book=book, state=state, logger=logger
+            )
 
     # Convert internal links to EPUB chapter references
-    html_content = convert_internal_links(html_content, current_file, root_path, state)
+    links = _rewrite_internal_links(soup, current_file, root_path, state)
+    if report is not None:
+        report.links = links
+    if chapter_filename is not None:
+        state.chapter_ids[chapter_filename] = {
+            str(element["id"]) for element in soup.find_all(id=True)
+        }
+
+    # Index the text while the parsed tree is at hand
+    if search_index is not None and chapter_filename is not None:
+        search_index.add_chapter(chapter_filename, soup)
 
-    return html_content
+    return str(soup)
+
+
+# =============================================================================
+# Search Index
+# =============================================================================
+
+
+SEARCH_INDEX_MAGIC = b"CHSI\x01"
+SEARCH_INDEX_PATH = "search/index.bin"
+
+_TERM_RE = re.compile(r"\w\w+")
+_HEADING_TAGS = frozenset({"h1", "h2", "h3", "h4", "h5", "h6"})
+_UNINDEXED_TAGS = frozenset({"script", "style"})
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    """Append an unsigned LEB128 varint."""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    """Read an unsigned LEB128 varint; return ``(value, next position)``."""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _write_text(out: bytearray, text: str) -> None:
+    """Append a length-prefixed UTF-8 string."""
+    encoded = text.encode("utf-8")
+    _write_varint(out, len(encoded))
+    out += encoded
+
+
+def _read_text(data: bytes, pos: int) -> tuple[str, int]:
+    """Read a length-prefixed UTF-8 string."""
+    length, pos = _read_varint(data, pos)
+    return data[pos : pos + length].decode("utf-8"), pos + length
+
+
+class SearchIndexBuilder:
+    """Inverted index of chapter text, filled in while chapters are converted.
+
+    Each term maps to postings of (anchor, position): the anchor is the
+    nearest heading id above the word (or the chapter top), and the position
+    counts words from the start of the chapter.
+    """
+
+    def __init__(self) -> None:
+        self._chapters: list[str] = []
+        self._anchors: list[tuple[int, str]] = []
+        self._postings: dict[str, list[tuple[int, int]]] = {}
+
+    def add_chapter(self, chapter_filename: str, soup: bs4.BeautifulSoup) -> None:
+        """Index the text of one converted chapter."""
+        chapter_idx = len(self._chapters)
+        self._chapters.append(chapter_filename)
+        self._anchors.append((chapter_idx, ""))
+        anchor_idx = len(self._anchors) - 1
+        position = 0
+
+        for element in soup.descendants:
+            if isinstance(element, bs4.Tag):
+                if element.name in _HEADING_TAGS and element.get("id"):
+                    self._anchors.append((chapter_idx, str(element["id"])))
+                    anchor_idx = len(self._anchors) - 1
+                continue
+            if (
+                type(element) is not bs4.NavigableString
+                or element.parent is None
+                or element.parent.name in _UNINDEXED_TAGS
+            ):
+                continue
+            for term in _TERM_RE.findall(element.lower()):
+                self._postings.setdefault(term, []).append((anchor_idx, position))
+                position += 1
+
+    def to_bytes(self) -> bytes:
+        """Encode the index compactly.
+
+        Layout (all integers are varints, strings are length-prefixed):
+        magic, chapters, anchors (chapter index delta + id), then terms in
+        sorted order, front-coded against the previous term, each followed
+        by its posting count and delta-encoded (anchor, position) pairs.
+        """
+        out = bytearray(SEARCH_INDEX_MAGIC)
+
+        _write_varint(out, len(self._chapters))
+        for chapter in self._chapters:
+            _write_text(out, chapter)
+
+        _write_varint(out, len(self._anchors))
+        previous_chapter = 0
+        for chapter_idx, anchor in self._anchors:
+            _write_varint(out, chapter_idx - previous_chapter)
+            _write_text(out, anchor)
+            previous_chapter = chapter_idx
+
+        _write_varint(out, len(self._postings))
+        previous_term = ""
+        for term in sorted(self._postings):
+            shared = 0
+            limit = min(len(previous_term), len(term))
+            while shared < limit and previous_term[shared] == term[shared]:
+                shared += 1
+            _write_varint(out, shared)
+            _write_text(out, term[shared:])
+            previous_term = term
+
+            postings = self._postings[term]
+            _write_varint(out, len(postings))
+            previous_anchor = previous_position = 0
+            for anchor_idx, position in postings:
+                anchor_delta = anchor_idx - previous_anchor
+                _write_varint(out, anchor_delta)
+                _write_varint(
+                    out, position - previous_position if anchor_delta == 0 else position
+                )
+                previous_anchor, previous_position = anchor_idx, position
+
+        return bytes(out)
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    """One occurrence of a term."""
+
+    chapter: str
+    anchor: str
+    position: int
+
+    @property
+    def href(self) -> str:
+        return f"{self.chapter}#{self.anchor}" if self.anchor else self.chapter
+
+
+class SearchIndex:
+    """Reader for an encoded search index.
+
+    Loading decodes the term dictionary only; postings are decoded when a
+    term is looked up, so a query costs a dictionary lookup per term.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        if not data.startswith(SEARCH_INDEX_MAGIC):
+            raise ValidationError("Not a search index (bad magic bytes)")
+        self._data = data
+        pos = len(SEARCH_INDEX_MAGIC)
+
+        count, pos = _read_varint(data, pos)
+        self.chapters: list[str] = []
+        for _ in range(count):
+            chapter, pos = _read_text(data, pos)
+            self.chapters.append(chapter)
+
+        count, pos = _read_varint(data, pos)
+        self._anchors: list[tuple[int, str]] = []
+        chapter_idx = 0
+        for _ in range(count):
+            delta, pos = _read_varint(data, pos)
+            chapter_idx += delta
+            anchor, pos = _read_text(data, pos)
+            self._anchors.append((chapter_idx, anchor))
+
+        count, pos = _read_varint(data, pos)
+        self._terms: dict[str, int] = {}
+        term = ""
+        for _ in range(count):
+            shared, pos = _read_varint(data, pos)
+            suffix, pos = _read_text(data, pos)
+            term = term[:shared] + suffix
+            self._terms[term] = pos
+            # Skip over the postings
+            postings, pos = _read_varint(data, pos)
+            for _ in range(postings * 2):
+                _, pos = _read_varint(data, pos)
+
+    def __contains__(self, term: str) -> bool:
+        return term.lower() in self._terms
+
+    def lookup(self, term: str) -> list[SearchHit]:
+        """Return every occurrence of a single term."""
+        pos = self._terms.get(term.lower())
+        if pos is None:
+            return []
+
+        count, pos = _read_varint(self._data, pos)
+        hits: list[SearchHit] = []
+        anchor_idx = position = 0
+        for _ in range(count):
+            anchor_delta, pos = _read_varint(self._data, pos)
+            value, pos = _read_varint(self._data, pos)
+            anchor_idx += anchor_delta
+            position = position + value if anchor_delta == 0 else value
+            chapter_idx, anchor = self._anchors[anchor_idx]
+            hits.append(SearchHit(self.chapters[chapter_idx], anchor, position))
+        return hits
+
+    def search(self, query: str) -> list[str]:
+        """Return hrefs of the sections containing every term in ``query``."""
+        terms = _TERM_RE.findall(query.lower())
+        if not terms:
+            return []
+
+        matches: dict[str, None] | None = None
+        for term in terms:
+            hrefs = dict.fromkeys(hit.href for hit in self.lookup(term))
+            matches = (
+                hrefs
+                if matches is None
+                else {href: None for href in matches if href in hrefs}
+            )
+        return list(matches or {})
+
+
+# =============================================================================
+# External Link Checking
+# =============================================================================
+
+
+LINK_CACHE_VERSION = 1
+
+# Statuses for which HEAD is retried as GET: servers that reject or
+# mishandle HEAD often answer GET correctly
+HEAD_FALLBACK_STATUSES = frozenset({400, 403, 404, 405, 501})
+
+
+def default_cache_dir() -> Path:
+    """Per-user cache directory for results kept between builds."""
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "claude-howto-epub"
+
+
+@dataclass
+class LinkResult:
+    """Outcome of checking one external URL."""
+
+    url: str
+    status: int | None = None
+    error: str | None = None
+    checked_at: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        # 429 means the server is there but throttling us: not a broken link
+        return self.status is not None and (self.status < 400 or self.status == 429)
+
+    @property
+    def cacheable(self) -> bool:
+        return self.ok and self.status != 429
+
+
+class LinkCache:
+    """Successful link checks persisted as JSON, each valid for ``ttl`` seconds.
+
+    Broken links are never cached, so a fixed link is picked up on the
+    next run and a transient failure does not stick.
+    """
+
+    def __init__(self, path: Path | None, ttl: float) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._entries: dict[str, LinkResult] = {}
+        if path is not None:
+            self._entries = self._read(path)
+
+    @staticmethod
+    def _read(path: Path) -> dict[str, LinkResult]:
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != LINK_CACHE_VERSION:
+            return {}
+        return {
+            url: LinkResult(url, entry.get("status"), None, entry.get("checked_at", 0))
+            for url, entry in data.get("links", {}).items()
+        }
+
+    def get(self, url: str, now: float) -> LinkResult | None:
+        """Return the cached result for ``url`` if it has not expired."""
+        result = self._entries.get(url)
+        if result is None or now - result.checked_at > self.ttl:
+            return None
+        return result
+
+    def put(self, result: LinkResult) -> None:
+        if result.cacheable:
+            self._entries[result.url] = result
+
+    def save(self, now: float) -> None:
+        """Write unexpired entries atomically, merging what others wrote meanwhile."""
+        if self.path is None:
+            return
+        entries = self._read(self.path)
+        for url, result in self._entries.items():
+            if url not in entries or entries[url].checked_at < result.checked_at:
+                entries[url] = result
+        data = {
+            "version": LINK_CACHE_VERSION,
+            "links": {
+                url: {"status": result.status, "checked_at": result.checked_at}
+                for url, result in sorted(entries.items())
+                if now - result.checked_at <= self.ttl
+            },
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(data, indent=1), encoding="utf-8")
+        tmp_path.replace(self.path)
+
+
+class LinkChecker:
+    """Check external links concurrently over one connection pool.
+
+    Each URL is tried with HEAD first and GET when HEAD is refused. Requests
+    are limited globally (``max_concurrent_requests``) and per host
+    (``max_requests_per_host``) so a single site is not hammered.
+    """
+
+    def __init__(
+        self,
+        config: EPUBConfig,
+        logger: logging.Logger,
+        cache: LinkCache | None = None,
+        client: httpx.AsyncClient | None = None,
+    ) -> None:
+        self.config = config
+        self.logger = logger
+        self.cache = cache or LinkCache(None, config.link_cache_ttl)
+        self.client = client
+        self._global: asyncio.Semaphore | None = None
+        self._hosts: dict[str, asyncio.Semaphore] = {}
+
+    async def check_all(self, urls: Sequence[str]) -> dict[str, LinkResult]:
+        """Check every URL; return results keyed by URL."""
+        now = time.time()
+        results: dict[str, LinkResult] = {}
+        pending: list[str] = []
+        for url in dict.fromkeys(urls):
+            cached = self.cache.get(url, now)
+            if cached is not None:
+                results[url] = cached
+            else:
+                pending.append(url)
+
+        self.logger.info(
+            f"Checking {len(pending)} external links ({len(results)} fresh in cache)..."
+        )
+        self._global = asyncio.Semaphore(self.config.max_concurrent_requests)
+        if self.client is not None:
+            checked = await self._check_many(self.client, pending)
+        else:
+            async with create_http_client(self.config) as client:
+                checked = await self._check_many(client, pending)
+
+        for result in checked:
+            results[result.url] = result
+            self.cache.put(result)
+        self.cache.save(time.time())
+        return results
+
+    async def _check_many(
+        self, client: httpx.AsyncClient, urls: list[str]
+    ) -> list[LinkResult]:
+        return list(await asyncio.gather(*(self._check(client, url) for url in urls)))
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = httpx.URL(url).host
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.config.max_requests_per_host)
+            self._hosts[host] = semaphore
+        return semaphore
+
+    async def _check(self, client: httpx.AsyncClient, url: str) -> LinkResult:
+        assert self._global is not None
+        result = LinkResult(url)
+        try:
+            async with self._host_semaphore(url), self._global:
+                try:
+                    response = await client.head(url)
+                    result.status = response.status_code
+                except httpx.HTTPError as e:
+                    result.error = f"{type(e).__name__}: {e}"
+
+                if result.status is None or result.status in HEAD_FALLBACK_STATUSES:
+                    # Only the status matters, so do not download the body
+                    async with client.stream("GET", url) as response:
+                        result.status = response.status_code
+                        result.error = None
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            result.error = f"{type(e).__name__}: {e}"
+        result.checked_at = time.time()
+
+        if not result.ok:
+            self.logger.debug(f"Broken link {url}: {result.status or result.error}")
+        return result
+
+
+def broken_link_report(state: BuildState) -> dict[str, dict[str, Any]]:
+    """Machine-readable list of broken external links and where they appear."""
+    return {
+        url: {
+            "status": result.status,
+            "error": result.error,
+            "sources": sorted(state.external_links.get(url, ())),
+        }
+        for url, result in sorted(state.broken_links.items())
+    }
+
+
+# =============================================================================
+# EPUB Validation
+# =============================================================================
+
+
+EPUB_MIMETYPE = b"application/epub+zip"
+CONTAINER_PATH = "META-INF/container.xml"
+EXTERNAL_SCHEMES = ("http:", "https:", "mailto:", "data:")
+
+_XML_NAMESPACES = {
+    "container": "urn:oasis:names:tc:opendocument:xmlns:container",
+    "opf": "http://www.idpf.org/2007/opf",
+}
+_XML_EXTENSIONS = (".xml", ".opf", ".xhtml", ".html", ".ncx", ".svg")
+_LINK_ATTRIBUTES = ("href", "src", "{http://www.w3.org/1999/xlink}href")
+_XML_MEDIA_TYPES = frozenset(
+    {
+        "application/xhtml+xml",
+        "application/x-dtbncx+xml",
+        "application/oebps-package+xml",
+        "image/svg+xml",
+    }
+)
+_MEDIA_SIGNATURES: dict[str, tuple[bytes, ...]] = {
+    "image/png": (b"\x89PNG\r\n\x1a\n",),
+    "image/jpeg": (b"\xff\xd8\xff",),
+    "image/gif": (b"GIF87a", b"GIF89a"),
+}
+
+
+@dataclass
+class _EntryIndex:
+    """What the validator keeps from one container entry after reading it."""
+
+    head: bytes = b""
+    is_xml: bool = False
+    is_text: bool = False
+    ids: set[str] = field(default_factory=set)
+    links: list[str] = field(default_factory=list)
+    root: ElementTree.Element | None = None
+
+
+def _resolve_href(base: str, href: str) -> tuple[str, str]:
+    """Resolve ``href`` relative to entry ``base`` into (entry name, fragment)."""
+    path, _, fragment = href.partition("#")
+    if not path:
+        return base, fragment
+    parts = base.split("/")[:-1]
+    for part in unquote(path).split("/"):
+        if part == "..":
+            if parts:
+                parts.pop()
+        elif part not in {"", "."}:
+            parts.append(part)
+    return "/".join(parts), fragment
+
+
+def _index_entry(name: str, data: bytes, problems: list[str]) -> _EntryIndex:
+    """Keep the ids, links and type evidence of one entry; drop its bytes."""
+    entry = _EntryIndex(head=data[:16])
+    if not name.endswith(_XML_EXTENSIONS):
+        try:
+            data.decode("utf-8")
+            entry.is_text = True
+        except UnicodeDecodeError:
+            pass
+        return entry
+
+    try:
+        root = ElementTree.fromstring(data)
+    except ElementTree.ParseError as e:
+        problems.append(f"{name}: not well-formed XML ({e})")
+        return entry
+
+    entry.is_xml = entry.is_text = True
+    if name == CONTAINER_PATH or name.endswith(".opf"):
+        entry.root = root
+        return entry
+    for element in root.iter():
+        element_id = element.get("id")
+        if element_id:
+            entry.ids.add(element_id)
+        for attribute in _LINK_ATTRIBUTES:
+            value = element.get(attribute)
+            if value:
+                entry.links.append(value)
+    return entry
+
+
+def _media_type_problem(name: str, media_type: str, entry: _EntryIndex) -> str | None:
+    """Describe a mismatch between a declared media type and the content."""
+    signatures = _MEDIA_SIGNATURES.get(media_type)
+    if signatures is not None and not entry.head.startswith(signatures):
+        return f"{name}: declared {media_type} but content does not match"
+    if media_type in _XML_MEDIA_TYPES and not entry.is_xml:
+        return f"{name}: declared {media_type} but content is not XML"
+    if media_type == "text/css" and not entry.is_text:
+        return f"{name}: declared text/css but content is not UTF-8 text"
+    return None
+
+
+def validate_epub(path: Path) -> list[str]:
+    """Check the structure of an EPUB in one streaming pass over the zip.
+
+    Verifies that ``mimetype`` is the first entry and stored uncompressed,
+    that the manifest, spine and navigation entries resolve, that every
+    internal href and anchor points at an existing file and id, and that
+    declared media types match the content. Each entry is read once; links
+    are resolved afterwards against the ids indexed while reading.
+    Returns the problems found (empty when the EPUB is valid).
+    """
+    problems: list[str] = []
+    entries: dict[str, _EntryIndex] = {}
+
+    try:
+        archive = zipfile.ZipFile(path)
+    except (OSError, zipfile.BadZipFile) as e:
+        return [f"{path}: not a readable zip file ({e})"]
+
+    with archive:
+        infos = archive.infolist()
+        if not infos or infos[0].filename != "mimetype":
+            problems.append("mimetype: must be the first entry")
+        elif infos[0].compress_type != zipfile.ZIP_STORED:
+            problems.append("mimetype: must be stored uncompressed")
+
+        for info in infos:
+            if info.is_dir():
+                continue
+            data = archive.read(info)
+            if info.filename == "mimetype" and data != EPUB_MIMETYPE:
+                problems.append(f"mimetype: must contain {EPUB_MIMETYPE.decode()}")
+            entries[info.filename] = _index_entry(info.filename, data, problems)
+
+    return problems + _check_package(entries)
+
+
+def _check_package(entries: dict[str, _EntryIndex]) -> list[str]:
+    """Resolve the package document, spine and links against the entry index."""
+    container = entries.get(CONTAINER_PATH)
+    if container is None or container.root is None:
+        return [f"{CONTAINER_PATH}: missing or unreadable"]
+    rootfile = container.root.find(
+        "container:rootfiles/container:rootfile", _XML_NAMESPACES
+    )
+    opf_path = rootfile.get("full-path", "") if rootfile is not None else ""
+    package = entries.get(opf_path)
+    if package is None or package.root is None:
+        return [f"{CONTAINER_PATH}: rootfile {opf_path!r} not found"]
+
+    problems: list[str] = []
+    manifest: set[str] = set()
+    has_nav = False
+    for item in package.root.iterfind("opf:manifest/opf:item", _XML_NAMESPACES):
+        item_id, href = item.get("id", ""), item.get("href", "")
+        manifest.add(item_id)
+        target, _ = _resolve_href(opf_path, href)
+        entry = entries.get(target)
+        if entry is None:
+            problems.append(f"{opf_path}: manifest item {item_id!r} ({href}) missing")
+            continue
+        has_nav = has_nav or "nav" in item.get("properties", "").split()
+        problem = _media_type_problem(target, item.get("media-type", ""), entry)
+        if problem is not None:
+            problems.append(problem)
+
+    if not has_nav:
+        problems.append(f"{opf_path}: no manifest item has the 'nav' property")
+
+    problems.extend(_check_spine(package.root, opf_path, manifest))
+    problems.extend(_check_links(entries))
+    return problems
+
+
+def _check_spine(
+    package: ElementTree.Element, opf_path: str, manifest: set[str]
+) -> list[str]:
+    """Check that the spine and its NCX reference manifest items."""
+    spine = package.find("opf:spine", _XML_NAMESPACES)
+    if spine is None:
+        return [f"{opf_path}: missing spine"]
+
+    problems: list[str] = []
+    toc = spine.get("toc")
+    if toc and toc not in manifest:
+        problems.append(f"{opf_path}: spine toc {toc!r} is not in the manifest")
+    for itemref in spine.iterfind("opf:itemref", _XML_NAMESPACES):
+        idref = itemref.get("idref", "")
+        if idref not in manifest:
+            problems.append(f"{opf_path}: spine item {idref!r} not in manifest")
+    return problems
+
+
+def _check_links(entries: dict[str, _EntryIndex]) -> list[str]:
+    """Resolve links from chapters, the nav document and the NCX by index."""
+    problems: list[str] = []
+    for name, entry in entries.items():
+        for href in entry.links:
+            if href.startswith(EXTERNAL_SCHEMES):
+                continue
+            target, fragment = _resolve_href(name, href)
+            target_entry = entries.get(target)
+            if target_entry is None:
+                problems.append(f"{name}: link to missing file {href!r}")
+            elif fragment and fragment not in target_entry.ids:
+                problems.append(f"{name}: link to missing anchor {href!r}")
+
+    return problems
+
+
+# =============================================================================
+# Build Report
+# =============================================================================
+
+
+REPORT_VERSION = 1
+
+
+def build_report(config: EPUBConfig, state: BuildState) -> dict[str, Any]:
+    """Summarize a finished build as JSON-serializable data.
+
+    Covers per-stage time, per-chapter size and conversion cost, per-diagram
+    latency and cache outcome, and the container size by media type.
+    """
+    try:
+        container_bytes = config.output_path.stat().st_size
+    except OSError:
+        container_bytes = None
+
+    return {
+        "version": REPORT_VERSION,
+        "output": str(config.output_path),
+        "total_seconds": round(sum(state.stage_seconds.values()), 4),
+        "stages": {
+            stage: round(seconds, 4) for stage, seconds in state.stage_seconds.items()
+        },
+        "chapters": [asdict(chapter) for chapter in state.chapter_reports],
+        "diagrams": sorted(
+            (asdict(diagram) for diagram in state.diagram_reports.values()),
+            key=lambda diagram: diagram["index"],
+        ),
+        "diagram_failures": diagram_failure_report(state),
+        "container": {
+            "bytes": container_bytes,
+            "by_media_type": {
+                media_type: {
+                    "entries": stats.entries,
+                    "raw_bytes": stats.raw_bytes,
+                    "packed_bytes": stats.packed_bytes,
+                }
+                for media_type, stats in sorted(state.packaging_stats.items())
+            },
+        },
+    }
+
+
+def write_build_report(path: Path, report: dict[str, Any]) -> None:
+    """Write a build report as indented JSON."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    except OSError as e:
+        raise EPUBBuildError(f"Failed to write build report {path}: {e}") from e
+
+
+def last_build_path(config: EPUBConfig) -> Path | None:
+    """Where the report of the last build of this output is kept."""
+    if config.cache_dir is None:
+        return None
+    digest = hashlib.sha256(str(config.output_path).encode("utf-8")).hexdigest()
+    return config.cache_dir / "builds" / f"{digest[:16]}.json"
+
+
+# =============================================================================
+# Build Planning
+# =============================================================================
+
+
+# Fallbacks when there is no previous build to learn from
+DEFAULT_DIAGRAM_SECONDS = 2.0
+DEFAULT_DIAGRAM_BYTES = 30_000
+
+
+def _load_last_build(config: EPUBConfig) -> dict[str, Any] | None:
+    path = last_build_path(config)
+    if path is None:
+        return None
+    try:
+        report = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return report if report.get("version") == REPORT_VERSION else None
+
+
+def _mean(values: list[float], default: float) -> float:
+    return sum(values) / len(values) if values else default
+
+
+def _chapter_changes(
+    config: EPUBConfig,
+    chapter_infos: list[ChapterInfo],
+    files: FileIndex,
+    last: dict[str, Any] | None,
+) -> list[dict[str, str]]:
+    """Classify each chapter as new, changed or unchanged since the last build."""
+    previous = {c["source"]: c for c in last["chapters"]} if last else {}
+    chapters: list[dict[str, str]] = []
+    for info in chapter_infos:
+        source = info.file_path.relative_to(config.root_path).as_posix()
+        digest = hashlib.sha256(files.read_text(info.file_path).encode("utf-8"))
+        before = previous.get(source)
+        if before is None:
+            status = "new"
+        elif before.get("source_sha256") == digest.hexdigest():
+            status = "unchanged"
+        else:
+            status = "changed"
+        chapters.append(
+            {"chapter": info.chapter_filename, "source": source, "status": status}
+        )
+    return chapters
+
+
+def _stage_estimates(
+    config: EPUBConfig, last: dict[str, Any] | None, chapter_count: int
+) -> dict[str, float]:
+    """Seconds per stage from the last build, scaled to this one."""
+    if last is None:
+        return {}
+    skipped = {"links"} if not config.check_links else set()
+    if not config.validate:
+        skipped.add("validate")
+    scale = chapter_count / max(1, len(last["chapters"]))
+    return {
+        stage: seconds * scale if stage == "chapters" else seconds
+        for stage, seconds in last["stages"].items()
+        if stage not in skipped
+    }
+
+
+def plan_build(config: EPUBConfig, logger: logging.Logger) -> dict[str, Any]:
+    """Predict what a build would do, running only its cheap parts.
+
+    Collects chapters, extracts diagrams and looks them up in the disk
+    cache, then compares against the last recorded build of the same output
+    to find changed chapters and to estimate time and network bytes. Nothing
+    is rendered or fetched, and the rendering and packaging libraries are
+    never imported.
+    """
+    validate_inputs(config, logger)
+    files = FileIndex()
+    collector = ChapterCollector(config.root_path, BuildState(), files)
+    chapter_infos = collector.collect_all_chapters(resolve_chapter_order(config))
+    last = _load_last_build(config)
+
+    chapters = _chapter_changes(config, chapter_infos, files, last)
+
+    md_files = [(info.file_path, info.file_title) for info in chapter_infos]
+    diagrams = extract_all_mermaid_blocks(md_files, logger, files)
+    disk = (
+        DiagramDiskCache(config.cache_dir / "diagrams")
+        if config.cache_dir is not None
+        else None
+    )
+    to_fetch = [
+        (index, code)
+        for index, code in diagrams
+        if disk is None or sanitize_mermaid(code).strip() not in disk
+    ]
+
+    # Learn per-diagram service time and size from the last build's fetches.
+    # Time spent queued for a request slot is left out: the batches below
+    # already account for queueing.
+    last_diagrams = last["diagrams"] if last else []
+    service = _mean(
+        [
+            d["seconds"] - d.get("wait_seconds", 0.0)
+            for d in last_diagrams
+            if d["cache"] == "miss"
+        ],
+        DEFAULT_DIAGRAM_SECONDS,
+    )
+    png_bytes = _mean([d["png_bytes"] for d in last_diagrams], DEFAULT_DIAGRAM_BYTES)
+    request_bytes = sum(
+        len(kroki_diagram_url(config.kroki_base_url, sanitize_mermaid(code)))
+        for _, code in to_fetch
+    )
+    batches = -(-len(to_fetch) // config.max_concurrent_requests)
+
+    stages = _stage_estimates(config, last, len(chapter_infos))
+    stages["diagrams"] = batches * service
+
+    return {
+        "chapters": {
+            "total": len(chapters),
+            "changed": sum(c["status"] == "changed" for c in chapters),
+            "new": sum(c["status"] == "new" for c in chapters),
+            "list": chapters,
+        },
+        "diagrams": {
+            "total": len(diagrams),
+            "cached": len(diagrams) - len(to_fetch),
+            "to_fetch": [index for index, _ in to_fetch],
+        },
+        "estimated_network_bytes": round(request_bytes + len(to_fetch) * png_bytes),
+        "estimated_seconds": round(sum(stages.values()), 2) if last else None,
+        "estimated_stage_seconds": {k: round(v, 2) for k, v in stages.items()},
+        "based_on": str(last_build_path(config)) if last else None,
+    }
+
+
+def format_plan(plan: dict[str, Any]) -> str:
+    """Render a build plan for people."""
+    chapters, diagrams = plan["chapters"], plan["diagrams"]
+    lines = [
+        f"Chapters to convert: {chapters['total']} "
+        f"({chapters['changed']} changed, {chapters['new']} new since last build)",
+    ]
+    lines += [
+        f"  {c['status']:<9} {c['chapter']}  {c['source']}"
+        for c in chapters["list"]
+        if c["status"] != "unchanged"
+    ]
+    lines.append(
+        f"Diagrams: {diagrams['total']} "
+        f"({diagrams['cached']} cached, {len(diagrams['to_fetch'])} to fetch)"
+    )
+    lines.append(
+        f"Estimated network: {plan['estimated_network_bytes'] / 1024:,.0f} KiB"
+    )
+    if plan["estimated_seconds"] is None:
+        lines.append(
+            "Estimated time: unknown (no previous build recorded); "
+            f"diagrams alone ~{plan['estimated_stage_seconds']['diagrams']:.0f}s"
+        )
+    else:
+        stages = ", ".join(
+            f"{stage} {seconds:.1f}s"
+            for stage, seconds in plan["estimated_stage_seconds"].items()
+        )
+        lines.append(f"Estimated time: {plan['estimated_seconds']:.1f}s ({stages})")
+    return "\n".join(lines)
 
 
 # =============================================================================
@@ -845,7 +2707,7 @@ def create_stylesheet() -> epub.EpubItem:
     a { color: #e67e22; }
     img { max-width: 100%; height: auto; display: block; margin: 1em auto; }
     .diagram { text-align: center; margin: 1.5em 0; }
-    .svg-placeholder { border: 1px dashed #ccc; padding: 1em; text-align: center; background: #f9f9f9; border-radius: 4px; margin: 1em 0; }
+    .svg-placeholder, .diagram-placeholder { border: 1px dashed #ccc; padding: 1em; text-align: center; background: #f9f9f9; border-radius: 4px; margin: 1em 0; }
     """
     return epub.EpubItem(
         uid="style_nav",
@@ -855,14 +2717,254 @@ def create_stylesheet() -> epub.EpubItem:
     )
 
 
+# =============================================================================
+# EPUB Packaging
+# =============================================================================
+
+
+EPUB_MEDIA_TYPES = {
+    ".xhtml": "application/xhtml+xml",
+    ".html": "application/xhtml+xml",
+    ".css": "text/css",
+    ".ncx": "application/x-dtbncx+xml",
+    ".opf": "application/oebps-package+xml",
+    ".xml": "application/xml",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".svg": "image/svg+xml",
+}
+
+
+def entry_media_type(name: str) -> str:
+    """Media type of a container entry, from its extension."""
+    if name == "mimetype":
+        return "mimetype"
+    return EPUB_MEDIA_TYPES.get(Path(name).suffix.lower(), "application/octet-stream")
+
+
+@dataclass
+class PackagingStats:
+    """Packaging totals for one entry type."""
+
+    entries: int = 0
+    raw_bytes: int = 0
+    packed_bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.raw_bytes - self.packed_bytes
+
+
+class _PolicyZipFile(zipfile.ZipFile):
+    """ZipFile that compresses each entry according to a CompressionPolicy."""
+
+    def __init__(self, file: str, policy: CompressionPolicy) -> None:
+        super().__init__(file, "w", zipfile.ZIP_DEFLATED)
+        self.policy = policy
+        self.stats: dict[str, PackagingStats] = {}
+
+    def writestr(  # type: ignore[override]
+        self,
+        zinfo_or_arcname: str | zipfile.ZipInfo,
+        data: str | bytes,
+        compress_type: int | None = None,
+        compresslevel: int | None = None,
+    ) -> None:
+        name = getattr(zinfo_or_arcname, "filename", zinfo_or_arcname)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        start = time.perf_counter()
+        if compress_type is None:
+            compress_type, compresslevel = self.policy.choose(name, data)
+        super().writestr(zinfo_or_arcname, data, compress_type, compresslevel)
+        elapsed = time.perf_counter() - start
+
+        info = self.filelist[-1]
+        stats = self.stats.setdefault(entry_media_type(name), PackagingStats())
+        stats.entries += 1
+        stats.raw_bytes += info.file_size
+        stats.packed_bytes += info.compress_size
+        stats.seconds += elapsed
+
+
+@functools.cache
+def _policy_writer_class() -> type[epub.EpubWriter]:
+    """Define the policy-aware writer on first use (ebooklib loads lazily)."""
+
+    class PolicyEpubWriter(epub.EpubWriter):
+        """EPUB writer that applies a CompressionPolicy per container entry."""
+
+        def __init__(
+            self, name: str, book: epub.EpubBook, policy: CompressionPolicy
+        ) -> None:
+            super().__init__(name, book, {})
+            self.policy = policy
+            self.stats: dict[str, PackagingStats] = {}
+
+        def write(self) -> None:
+            self.out = _PolicyZipFile(self.file_name, self.policy)
+            try:
+                # The mimetype entry must come first and be stored uncompressed
+                self.out.writestr(
+                    "mimetype",
+                    "application/epub+zip",
+                    compress_type=zipfile.ZIP_STORED,
+                )
+                self._write_container()
+                self._write_opf()
+                self._write_items()
+            finally:
+                self.out.close()
+            self.stats = self.out.stats
+
+    return PolicyEpubWriter
+
+
+def write_epub_with_policy(
+    output_path: Path,
+    book: epub.EpubBook,
+    policy: CompressionPolicy,
+    logger: logging.Logger,
+) -> dict[str, PackagingStats]:
+    """Write the EPUB container and log time and bytes saved per entry type."""
+    writer = _policy_writer_class()(str(output_path), book, policy)
+    writer.process()
+    try:
+        writer.write()
+    except OSError as e:
+        raise EPUBBuildError(f"Failed to write {output_path}: {e}") from e
+
+    for media_type, stats in sorted(writer.stats.items()):
+        logger.debug(
+            f"Packed {stats.entries} {media_type} entries: "
+            f"{stats.raw_bytes:,} -> {stats.packed_bytes:,} bytes "
+            f"(saved {stats.saved_bytes:,}) in {stats.seconds * 1000:.1f} ms"
+        )
+    total_seconds = sum(stats.seconds for stats in writer.stats.values())
+    total_saved = sum(stats.saved_bytes for stats in writer.stats.values())
+    logger.info(
+        f"Packaged {sum(s.entries for s in writer.stats.values())} entries in "
+        f"{total_seconds * 1000:.1f} ms, compression saved {total_saved:,} bytes"
+    )
+    return writer.stats
+
+
+def _validate_output(config: EPUBConfig, logger: logging.Logger) -> None:
+    """Raise ValidationError if the written EPUB is structurally invalid."""
+    problems = validate_epub(config.output_path)
+    for problem in problems:
+        logger.error(f"Invalid EPUB: {problem}")
+    if problems:
+        raise ValidationError(
+            f"{config.output_path} failed validation with "
+            f"{len(problems)} problem(s); first: {problems[0]}"
+        )
+    logger.info("EPUB structure validated")
+
+
+def _write_reports(
+    config: EPUBConfig, state: BuildState, logger: logging.Logger
+) -> None:
+    """Write the requested build report and the record ``--plan`` learns from."""
+    report = build_report(config, state)
+    if config.report_path is not None:
+        write_build_report(config.report_path, report)
+        logger.info(f"Build report written to {config.report_path}")
+
+    record_path = last_build_path(config)
+    if record_path is not None:
+        try:
+            write_build_report(record_path, report)
+        except EPUBBuildError as e:
+            logger.warning(f"Could not record build timings: {e}")
+
+
+def _convert_chapter(
+    chapter_info: ChapterInfo,
+    config: EPUBConfig,
+    book: epub.EpubBook,
+    state: BuildState,
+    logger: logging.Logger,
+    *,
+    shared: SharedResources,
+    search_index: SearchIndexBuilder | None,
+    nav_css: epub.EpubItem,
+) -> epub.EpubHtml:
+    """Convert one chapter to XHTML and add it to ``book``."""
+    try:
+        content = shared.files.read_text(chapter_info.file_path)
+    except UnicodeDecodeError as e:
+        logger.error(f"Failed to read {chapter_info.file_path}: {e}")
+        raise ValidationError(f"Failed to read {chapter_info.file_path}: {e}") from e
+
+    source = chapter_info.file_path.relative_to(config.root_path).as_posix()
+    logger.debug(f"Processing: {source}")
+    encoded = content.encode("utf-8")
+    chapter_report = ChapterReport(
+        chapter=chapter_info.chapter_filename,
+        source=source,
+        source_bytes=len(encoded),
+        source_sha256=hashlib.sha256(encoded).hexdigest(),
+    )
+    converted = time.perf_counter()
+    html_content = md_to_html(
+        content,
+        chapter_info.file_path,
+        config.root_path,
+        book,
+        state,
+        logger,
+        shared.converters,
+        search_index=search_index,
+        chapter_filename=chapter_info.chapter_filename,
+        report=chapter_report,
+    )
+
+    chapter = epub.EpubHtml(
+        title=chapter_info.file_title,
+        file_name=chapter_info.chapter_filename,
+        lang="en",
+    )
+
+    chapter.content = create_chapter_html(
+        chapter_info.display_name,
+        chapter_info.file_title,
+        html_content,
+        is_overview=chapter_info.is_folder_overview or chapter_info.folder_name is None,
+    )
+    chapter_report.seconds = round(time.perf_counter() - converted, 4)
+    chapter_report.xhtml_bytes = len(chapter.content.encode("utf-8"))
+    state.chapter_reports.append(chapter_report)
+    chapter.add_item(nav_css)
+    book.add_item(chapter)
+    return chapter
+
+
 async def build_epub_async(
     config: EPUBConfig,
     logger: logging.Logger,
     state: BuildState | None = None,
+    shared: SharedResources | None = None,
+    profiler: MemoryProfiler | None = None,
 ) -> Path:
     """Build EPUB asynchronously with concurrent diagram fetching."""
     state = state or BuildState()
     state.reset()  # Ensure clean state
+    shared = shared or SharedResources.for_config(config)
+    stage_started = time.perf_counter()
+
+    def stage_done(stage: str) -> None:
+        nonlocal stage_started
+        now = time.perf_counter()
+        state.stage_seconds[stage] = now - stage_started
+        stage_started = now
+        if profiler is not None:
+            profiler.mark(stage)
 
     # Validate inputs
     validate_inputs(config, logger)
@@ -876,8 +2978,15 @@ async def build_epub_async(
 
     # Add cover
     logger.info("Generating cover image...")
-    cover_data = create_cover_image(config, logger)
+    cover_key = _cover_cache_key(config)
+    cover_data = shared.covers.get(cover_key)
+    if cover_data is None:
+        cover_data = await asyncio.to_thread(
+            create_cover_image, config, logger, font_cache=shared.fonts
+        )
+        shared.covers[cover_key] = cover_data
     book.set_cover("cover.png", cover_data)
+    stage_done("cover")
 
     # Add CSS
     nav_css = create_stylesheet()
@@ -885,85 +2994,91 @@ async def build_epub_async(
 
     # Collect all chapters in single pass
     logger.info("Collecting chapters...")
-    collector = ChapterCollector(config.root_path, state)
-    chapter_infos = collector.collect_all_chapters(get_chapter_order())
+    collector = ChapterCollector(config.root_path, state, shared.files)
+    chapter_infos = await asyncio.to_thread(
+        collector.collect_all_chapters, resolve_chapter_order(config)
+    )
+    stage_done("collect")
 
     # Extract and pre-fetch all Mermaid diagrams
     logger.info("Extracting Mermaid diagrams...")
     md_files = [(ch.file_path, ch.file_title) for ch in chapter_infos]
-    all_diagrams = extract_all_mermaid_blocks(md_files, logger)
+    all_diagrams = await asyncio.to_thread(
+        extract_all_mermaid_blocks, md_files, logger, shared.files
+    )
 
     if all_diagrams:
-        renderer = MermaidRenderer(config, state, logger)
+        renderer = MermaidRenderer(config, state, logger, shared)
         await renderer.render_all(all_diagrams)
+    if shared.disk is not None:
+        pruned = await asyncio.to_thread(shared.disk.prune)
+        if pruned:
+            logger.debug(f"Pruned {pruned} diagrams from {shared.disk.directory}")
+    stage_done("diagrams")
 
     # Process chapters
     logger.info("Processing chapters...")
+    search_index = SearchIndexBuilder() if config.search_index else None
     chapters: list[epub.EpubHtml] = []
-    toc: list[epub.EpubHtml | tuple[epub.Section, list[epub.EpubHtml]]] = []
+    toc: list[Any] = []
 
-    current_folder: str | None = None
-    current_folder_chapters: list[epub.EpubHtml] = []
+    # Open TOC sections, outermost first: (section path, children list)
+    open_sections: list[tuple[tuple[str, ...], list[Any]]] = [((), toc)]
 
     for chapter_info in chapter_infos:
-        try:
-            content = chapter_info.file_path.read_text(encoding="utf-8")
-        except UnicodeDecodeError as e:
-            logger.error(f"Failed to read {chapter_info.file_path}: {e}")
-            raise ValidationError(
-                f"Failed to read {chapter_info.file_path}: {e}"
-            ) from e
-
-        logger.debug(
-            f"Processing: {chapter_info.file_path.relative_to(config.root_path)}"
-        )
-        html_content = md_to_html(
-            content, chapter_info.file_path, config.root_path, book, state, logger
+        # Conversion is CPU-bound: run it off the event loop so diagram
+        # fetches of concurrent builds and daemon clients keep being served
+        chapter = await asyncio.to_thread(
+            _convert_chapter,
+            chapter_info,
+            config,
+            book,
+            state,
+            logger,
+            shared=shared,
+            search_index=search_index,
+            nav_css=nav_css,
         )
+        chapters.append(chapter)
 
-        chapter = epub.EpubHtml(
-            title=chapter_info.file_title,
-            file_name=chapter_info.chapter_filename,
-            lang="en",
+        # Build TOC structure: close sections this chapter is not part of,
+        # then open any new (possibly nested) sections it starts
+        section_path = chapter_info.section_path
+        while open_sections[-1][0] != section_path[: len(open_sections[-1][0])]:
+            open_sections.pop()
+        while len(open_sections[-1][0]) < len(section_path):
+            depth = len(open_sections[-1][0])
+            children: list[Any] = []
+            open_sections[-1][1].append((epub.Section(section_path[depth]), children))
+            open_sections.append((section_path[: depth + 1], children))
+        open_sections[-1][1].append(chapter)
+
+    _drop_missing_anchors(chapters, state)
+    stage_done("chapters")
+
+    if config.check_links and state.external_links:
+        cache = LinkCache(config.link_cache_path, config.link_cache_ttl)
+        checker = LinkChecker(config, logger, cache, shared.client)
+        results = await checker.check_all(list(state.external_links))
+        state.broken_links = {
+            url: result for url, result in results.items() if not result.ok
+        }
+        logger.info(
+            f"Checked {len(results)} external links, {len(state.broken_links)} broken"
         )
-
-        chapter.content = create_chapter_html(
-            chapter_info.display_name,
-            chapter_info.file_title,
-            html_content,
-            is_overview=chapter_info.is_folder_overview
-            or chapter_info.folder_name is None,
+        stage_done("links")
+
+    if search_index is not None:
+        index_data = await asyncio.to_thread(search_index.to_bytes)
+        book.add_item(
+            epub.EpubItem(
+                uid="search_index",
+                file_name=SEARCH_INDEX_PATH,
+                media_type="application/octet-stream",
+                content=index_data,
+            )
         )
-        chapter.add_item(nav_css)
-        book.add_item(chapter)
-        chapters.append(chapter)
-
-        # Build TOC structure
-        if chapter_info.folder_name is None:
-            # Single file chapter
-            if current_folder is not None:
-                # Finish previous folder
-                toc.append(
-                    (epub.Section(current_folder), current_folder_chapters.copy())
-                )
-                current_folder_chapters.clear()
-                current_folder = None
-            toc.append(chapter)
-        else:
-            # Part of a folder
-            if current_folder != chapter_info.folder_name:
-                if current_folder is not None:
-                    # Finish previous folder
-                    toc.append(
-                        (epub.Section(current_folder), current_folder_chapters.copy())
-                    )
-                    current_folder_chapters.clear()
-                current_folder = chapter_info.folder_name
-            current_folder_chapters.append(chapter)
-
-    # Handle last folder
-    if current_folder is not None and current_folder_chapters:
-        toc.append((epub.Section(current_folder), current_folder_chapters))
+        logger.info(f"Search index: {len(index_data):,} bytes")
 
     # Set table of contents
     book.toc = toc
@@ -977,7 +3092,16 @@ async def build_epub_async(
 
     # Write EPUB
     logger.info(f"Writing EPUB to {config.output_path}...")
-    epub.write_epub(str(config.output_path), book, {})
+    state.packaging_stats = await asyncio.to_thread(
+        write_epub_with_policy, config.output_path, book, config.compression, logger
+    )
+    stage_done("write")
+
+    if config.validate:
+        await asyncio.to_thread(_validate_output, config, logger)
+        stage_done("validate")
+
+    _write_reports(config, state, logger)
 
     logger.info(f"EPUB created successfully: {config.output_path}")
     return config.output_path
@@ -990,14 +3114,554 @@ def create_epub(root_path: Path, output_path: Path, verbose: bool = False) -> Pa
     return asyncio.run(build_epub_async(config, logger))
 
 
+# =============================================================================
+# Memory Profiling
+# =============================================================================
+
+
+def _max_rss_bytes() -> int | None:
+    """Peak resident set size of this process so far, where available."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class MemoryProfiler:
+    """Per-stage memory profile of a build using tracemalloc.
+
+    ``mark(stage)`` closes a stage: it records the traced peak reached during
+    the stage, the change in traced memory since the previous mark, and the
+    allocation sites that grew the most, then resets the peak for the next
+    stage. Tracing slows the build down, so only enable it when profiling.
+    """
+
+    def __init__(self, top_n: int = 10) -> None:
+        self.top_n = top_n
+        self.stages: list[dict[str, Any]] = []
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._current = 0
+        self._owns_tracing = False
+
+    def start(self) -> None:
+        """Start tracing and take the baseline snapshot."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracing = True
+        tracemalloc.reset_peak()
+        self._current = tracemalloc.get_traced_memory()[0]
+        self._snapshot = self._take_snapshot()
+
+    def stop(self) -> None:
+        """Stop tracing if this profiler started it."""
+        if self._owns_tracing:
+            tracemalloc.stop()
+            self._owns_tracing = False
+
+    def mark(self, stage: str) -> None:
+        """Record the stage that just finished."""
+        if self._snapshot is None:
+            raise RuntimeError("MemoryProfiler.start() must be called first")
+
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = self._take_snapshot()
+        top_stats = snapshot.compare_to(self._snapshot, "lineno")[: self.top_n]
+
+        self.stages.append(
+            {
+                "stage": stage,
+                "peak_bytes": peak,
+                "current_bytes": current,
+                "delta_bytes": current - self._current,
+                "max_rss_bytes": _max_rss_bytes(),
+                "top_allocations": [
+                    {
+                        "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                        "size_bytes": stat.size,
+                        "size_diff_bytes": stat.size_diff,
+                        "count_diff": stat.count_diff,
+                    }
+                    for stat in top_stats
+                ],
+            }
+        )
+
+        self._snapshot = snapshot
+        self._current = current
+        tracemalloc.reset_peak()
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return the profile as a JSON-serializable dict."""
+        peak_stage = max(self.stages, key=lambda s: s["peak_bytes"], default=None)
+        return {
+            "python": sys.version.split()[0],
+            "peak_bytes": peak_stage["peak_bytes"] if peak_stage else 0,
+            "peak_stage": peak_stage["stage"] if peak_stage else None,
+            "stages": self.stages,
+        }
+
+    def write(self, path: Path) -> None:
+        """Write the profile as JSON for comparison between commits."""
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(
+                json.dumps(self.to_dict(), indent=2) + "\n", encoding="utf-8"
+            )
+        except OSError as e:
+            raise EPUBBuildError(f"Failed to write memory profile {path}: {e}") from e
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        """Snapshot traced memory, ignoring tracemalloc's own allocations."""
+        return tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            ]
+        )
+
+
+# =============================================================================
+# Batch Builds
+# =============================================================================
+
+
+def load_batch_config(batch_path: Path, defaults: EPUBConfig) -> list[EPUBConfig]:
+    """Load edition configs from a JSON batch file.
+
+    The file holds a list of editions (or ``{"editions": [...]}``). Each
+    edition may set ``root``, ``output``, ``logo``, ``identifier``, ``title``,
+    ``language``, ``author``, ``manifest``, ``report`` and ``chapters`` (a list
+    of ``[path, name]`` pairs). Relative paths resolve against the batch file's
+    directory, and unset values fall back to ``defaults``.
+    """
+    try:
+        data = json.loads(batch_path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError) as e:
+        raise ValidationError(f"Cannot read batch file {batch_path}: {e}") from e
+
+    editions = data.get("editions") if isinstance(data, dict) else data
+    if not isinstance(editions, list) or not editions:
+        raise ValidationError(f"Batch file lists no editions: {batch_path}")
+
+    base = batch_path.parent
+    configs: list[EPUBConfig] = []
+    for i, edition in enumerate(editions, start=1):
+        if not isinstance(edition, dict) or "output" not in edition:
+            raise ValidationError(f"Edition {i} in {batch_path} needs an 'output'")
+
+        root = (base / edition.get("root", defaults.root_path)).resolve()
+        logo = edition.get("logo")
+        manifest = edition.get("manifest")
+        report = edition.get("report")
+        chapters = edition.get("chapters")
+        configs.append(
+            EPUBConfig(
+                root_path=root,
+                output_path=(base / edition["output"]).resolve(),
+                logo_path=(base / logo).resolve() if logo else None,
+                identifier=edition.get("identifier", defaults.identifier),
+                title=edition.get("title", defaults.title),
+                language=edition.get("language", defaults.language),
+                author=edition.get("author", defaults.author),
+                chapter_order=[tuple(entry) for entry in chapters]
+                if chapters
+                else None,
+                manifest_path=(base / manifest).resolve()
+                if manifest
+                else defaults.manifest_path,
+                report_path=(base / report).resolve() if report else None,
+                cache_dir=defaults.cache_dir,
+                request_timeout=defaults.request_timeout,
+                max_concurrent_requests=defaults.max_concurrent_requests,
+                compression=defaults.compression,
+                search_index=defaults.search_index,
+                validate=defaults.validate,
+                check_links=defaults.check_links,
+                max_requests_per_host=defaults.max_requests_per_host,
+                link_cache_path=defaults.link_cache_path,
+                link_cache_ttl=defaults.link_cache_ttl,
+                degraded=defaults.degraded,
+            )
+        )
+
+    return configs
+
+
+async def build_batch_async(
+    configs: list[EPUBConfig],
+    logger: logging.Logger,
+    shared: SharedResources | None = None,
+    states: Sequence[BuildState] | None = None,
+) -> list[Path]:
+    """Build several editions concurrently over one set of shared resources.
+
+    Diagrams are fetched once per batch through a single HTTP client and
+    request limit, so the cost approaches that of the largest edition.
+    Every edition runs to completion; failures are raised together at the end.
+    ``states``, if given, holds one BuildState per edition for inspection.
+    """
+    shared = shared or SharedResources.for_config(configs[0])
+    shared.semaphore = asyncio.Semaphore(
+        max(config.max_concurrent_requests for config in configs)
+    )
+
+    async with create_http_client(configs[0]) as client:
+        shared.client = client
+        try:
+            results = await asyncio.gather(
+                *(
+                    build_epub_async(
+                        config, logger, states[i] if states else None, shared
+                    )
+                    for i, config in enumerate(configs)
+                ),
+                return_exceptions=True,
+            )
+        finally:
+            shared.client = None
+
+    failures = [
+        f"{config.output_path.name}: {result}"
+        for config, result in zip(configs, results, strict=True)
+        if isinstance(result, BaseException)
+    ]
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(result, Exception):
+            raise result
+    if failures:
+        raise EPUBBuildError(
+            f"{len(failures)} of {len(configs)} editions failed:\n"
+            + "\n".join(failures)
+        )
+
+    return [result for result in results if isinstance(result, Path)]
+
+
+# =============================================================================
+# Build Daemon
+# =============================================================================
+
+
+DAEMON_CONNECT_TIMEOUT = 5.0  # Seconds for the daemon to accept and answer a probe
+DAEMON_READ_TIMEOUT = 600.0  # Longest silence from the daemon during a build
+
+
+def default_socket_path() -> Path:
+    """Per-user Unix socket for the build daemon."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "claude-howto-epub.sock"
+    return default_cache_dir() / "daemon.sock"
+
+
+class _JobLogHandler(logging.Handler):
+    """Forward a job's log records to its client as JSON lines."""
+
+    def __init__(self, send: Callable[[dict[str, Any]], None]) -> None:
+        super().__init__()
+        self.send = send
+        self.setFormatter(
+            logging.Formatter(
+                "%(asctime)s - %(levelname)s - %(message)s", datefmt="%H:%M:%S"
+            )
+        )
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.send({"log": self.format(record)})
+
+
+class _JobArgumentParser(argparse.ArgumentParser):
+    """Argument parser that sends help and usage errors to a daemon client."""
+
+    def __init__(
+        self, *args: Any, send: Callable[[dict[str, Any]], None], **kwargs: Any
+    ):
+        super().__init__(*args, **kwargs)
+        self.send = send
+
+    def _print_message(self, message: str, file: IO[str] | None = None) -> None:
+        if message:
+            stream = "log" if file is sys.stderr else "stdout"
+            self.send({stream: message.rstrip("\n")})
+
+
+class BuildDaemon:
+    """Serve build jobs over a Unix socket, sharing caches between them.
+
+    Each connection carries one job: a JSON line ``{"argv": [...], "cwd":
+    "...", "root": "...", "output": "...", "manifest": "..." | null}`` using
+    the normal command-line options, with the paths already resolved by the
+    client to absolute paths. Jobs run concurrently, each with its own
+    BuildState and file index, while the HTTP client, request limit,
+    diagrams, fonts, covers and markdown converters are shared. The CPU-bound
+    stages of each build run in worker threads, so the event loop keeps
+    serving fetches and clients. The daemon answers with ``{"log": ...}``
+    and ``{"stdout": ...}`` lines and finally ``{"exit": status}``.
+    """
+
+    def __init__(
+        self, socket_path: Path, config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        self.socket_path = socket_path
+        self.config = config
+        self.logger = logger
+        self.shared = SharedResources.for_config(config)
+        self._disks: dict[Path, DiagramDiskCache] = {}
+        if self.shared.disk is not None:
+            self._disks[self.shared.disk.directory] = self.shared.disk
+        self._jobs = 0
+
+    async def serve_forever(self) -> None:
+        """Listen until cancelled, then release the socket and HTTP client."""
+        self._claim_socket()
+        self.shared.client = create_http_client(self.config)
+        self.shared.semaphore = asyncio.Semaphore(self.config.max_concurrent_requests)
+        # Create the socket as 0600 rather than narrowing it after the bind
+        old_umask = os.umask(0o077)
+        try:
+            server = await asyncio.start_unix_server(
+                self._handle, path=self.socket_path
+            )
+        finally:
+            os.umask(old_umask)
+        self.logger.info(f"Build daemon listening on {self.socket_path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.shared.client.aclose()
+            self.socket_path.unlink(missing_ok=True)
+
+    def _claim_socket(self) -> None:
+        """Remove a stale socket file, refusing to replace a live daemon."""
+        if not self.socket_path.exists():
+            self.socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            return
+        if run_client(self.socket_path, None, Path.cwd()) is not None:
+            raise EPUBBuildError(f"A build daemon is already on {self.socket_path}")
+        self.socket_path.unlink()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        def send(message: dict[str, Any]) -> None:
+            if not writer.is_closing():
+                writer.write(json.dumps(message).encode() + b"\n")
+
+        try:
+            request = json.loads(await reader.readline() or b"{}")
+            if "argv" in request:
+                send({"exit": await self._run_job(request, send)})
+            else:
+                send({"exit": 0})  # Liveness probe
+            await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            self.logger.warning(f"Dropped client: {e}")
+        finally:
+            writer.close()
+
+    def _disk_cache(self, cache_dir: Path | None) -> DiagramDiskCache | None:
+        """The diagram cache in a job's --cache-dir (None for --no-cache)."""
+        if cache_dir is None:
+            return None
+        directory = cache_dir / "diagrams"
+        if directory not in self._disks:
+            self._disks[directory] = DiagramDiskCache(directory)
+        return self._disks[directory]
+
+    async def _run_job(
+        self, request: dict[str, Any], send: Callable[[dict[str, Any]], None]
+    ) -> int:
+        self._jobs += 1
+        job_id = self._jobs
+        loop = asyncio.get_running_loop()
+        loop_thread = threading.get_ident()
+
+        def send_threadsafe(message: dict[str, Any]) -> None:
+            # Build stages log from worker threads; the writer is the loop's
+            if threading.get_ident() == loop_thread:
+                send(message)
+            else:
+                loop.call_soon_threadsafe(send, message)
+
+        paths = [request.get(key) for key in ("cwd", "root", "output")]
+        if request.get("manifest") is not None:
+            paths.append(request["manifest"])
+        if not all(
+            isinstance(path, str) and Path(path).is_absolute() for path in paths
+        ):
+            send({"log": "Job rejected: cwd, root and output must be absolute paths"})
+            return 2
+
+        parser = build_parser(functools.partial(_JobArgumentParser, send=send))
+        try:
+            args = parser.parse_args(request["argv"])
+            _check_args(parser, args)
+        except SystemExit as e:
+            return int(e.code or 0)
+        if args.memory_profile or args.serve or args.plan:
+            send({"log": "--memory-profile, --serve and --plan run in-process only"})
+            return 2
+        resolve_arg_paths(args, Path(request["cwd"]))
+        # The client's view of the defaults, not this process's checkout
+        args.root = Path(request["root"])
+        args.output = Path(request["output"])
+        if request.get("manifest") is not None:
+            args.manifest = Path(request["manifest"])
+
+        # Not registered with logging, so finished jobs leave nothing behind
+        logger = logging.Logger(f"epub_builder.job{job_id}")
+        logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+        logger.addHandler(_JobLogHandler(send_threadsafe))
+
+        # Fresh file index: sources may have changed since the last job. The
+        # diagram cache on disk is the job's own --cache-dir, not the daemon's
+        config = config_from_args(args)
+        shared = replace(
+            self.shared, files=FileIndex(), disk=self._disk_cache(config.cache_dir)
+        )
+        started = time.perf_counter()
+        self.logger.info(f"Job {job_id}: {' '.join(request['argv']) or '(defaults)'}")
+        try:
+            status = await run_build_async(
+                args,
+                config,
+                logger,
+                shared,
+                out=lambda line: send_threadsafe({"stdout": line}),
+            )
+        except Exception as e:
+            # An unexpected error fails this job, not the daemon
+            logger.exception(f"Job failed: {e}")
+            status = 1
+        self.logger.info(
+            f"Job {job_id} finished with status {status} "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return status
+
+
+def serve_daemon(socket_path: Path, config: EPUBConfig, logger: logging.Logger) -> int:
+    """Run the build daemon in the foreground until interrupted."""
+    daemon = BuildDaemon(socket_path, config, logger)
+    try:
+        asyncio.run(daemon.serve_forever())
+    except EPUBBuildError as e:
+        logger.error(str(e))
+        return 1
+    except KeyboardInterrupt:
+        logger.info("Build daemon stopped")
+    return 0
+
+
+def run_client(
+    socket_path: Path,
+    argv: Sequence[str] | None,
+    cwd: Path,
+    timeout: float = DAEMON_READ_TIMEOUT,
+) -> int | None:
+    """Send a build to the daemon and relay its output.
+
+    Root, output and manifest are resolved here, against ``cwd`` and this
+    checkout, and sent as absolute paths. Returns the build's exit status,
+    or None when no daemon answers (so the caller can build in-process).
+    ``argv=None`` only checks that the daemon is alive. A build fails when
+    the daemon is silent for ``timeout`` seconds.
+    """
+    cwd = cwd.resolve()
+    request: dict[str, Any] = {"cwd": str(cwd)}
+    if argv is not None:
+        args = build_parser().parse_args(argv)
+        resolve_arg_paths(args, cwd)
+        config = config_from_args(args)
+        request.update(
+            argv=list(argv),
+            root=str(config.root_path),
+            output=str(config.output_path),
+            manifest=str(config.manifest_path) if config.manifest_path else None,
+        )
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(DAEMON_CONNECT_TIMEOUT)
+    try:
+        connection.connect(str(socket_path))
+    except OSError:
+        connection.close()
+        return None
+
+    with connection, connection.makefile("rwb") as stream:
+        try:
+            stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            if argv is not None:
+                connection.settimeout(timeout)
+            for line in stream:
+                message = json.loads(line)
+                if "log" in message:
+                    print(message["log"], file=sys.stderr)
+                elif "stdout" in message:
+                    print(message["stdout"])
+                elif "exit" in message:
+                    return int(message["exit"])
+        except TimeoutError:
+            if argv is None:
+                return None
+            print(f"Build daemon on {socket_path} stopped responding", file=sys.stderr)
+    return 1  # Daemon went away mid-build
+
+
 # =============================================================================
 # CLI
 # =============================================================================
 
 
-def main() -> int:
-    """Main entry point with CLI argument parsing."""
-    parser = argparse.ArgumentParser(
+def _report_diagram_failures(
+    states: dict[str, BuildState], out: Callable[[str], None] = print
+) -> int:
+    """Print failed diagrams as one JSON line; return the exit status."""
+    failures = {
+        output: diagram_failure_report(state)
+        for output, state in states.items()
+        if state.diagram_failures
+    }
+    if not failures:
+        return 0
+    out(json.dumps({"diagram_failures": failures}))
+    return 2
+
+
+def _report_broken_links(
+    states: dict[str, BuildState], out: Callable[[str], None] = print
+) -> int:
+    """Print broken external links as one JSON line; return the exit status."""
+    broken = {
+        output: broken_link_report(state)
+        for output, state in states.items()
+        if state.broken_links
+    }
+    if not broken:
+        return 0
+    out(json.dumps({"broken_links": broken}))
+    return 3
+
+
+def _report_problems(
+    states: dict[str, BuildState], out: Callable[[str], None] = print
+) -> int:
+    """Report diagram failures and broken links; return the worst exit status."""
+    return max(_report_diagram_failures(states, out), _report_broken_links(states, out))
+
+
+def build_parser(
+    parser_class: Callable[..., argparse.ArgumentParser] = argparse.ArgumentParser,
+) -> argparse.ArgumentParser:
+    """Create the command-line parser (shared by the CLI and the daemon)."""
+    parser = parser_class(
         description="Build an EPUB from Claude How-To markdown files."
     )
     parser.add_argument(
@@ -1029,34 +3693,278 @@ def main() -> int:
         default=10,
         help="Maximum concurrent API requests (default: 10)",
     )
+    parser.add_argument(
+        "--manifest",
+        type=Path,
+        default=DEFAULT_MANIFEST if DEFAULT_MANIFEST.exists() else None,
+        help="TOML chapter manifest (default: scripts/chapters.toml)",
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        choices=range(10),
+        default=6,
+        metavar="0-9",
+        help="Deflate level for text entries; images are stored (default: 6)",
+    )
+    parser.add_argument(
+        "--max-compression",
+        action="store_true",
+        help="Release mode: deflate text at level 9 and media where it helps",
+    )
+    parser.add_argument(
+        "--no-search-index",
+        action="store_true",
+        help="Do not embed the precomputed full-text search index",
+    )
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Check the structure of the written EPUB and fail if it is invalid",
+    )
+    parser.add_argument(
+        "--check-links",
+        action="store_true",
+        help="Check external links; list broken ones as JSON and exit with status 3",
+    )
+    parser.add_argument(
+        "--max-per-host",
+        type=int,
+        default=4,
+        help="Maximum concurrent link checks per host (default: 4)",
+    )
+    parser.add_argument(
+        "--link-cache",
+        type=Path,
+        default=None,
+        metavar="PATH",
+        help="Where successful link checks are cached "
+        "(default: links.json in --cache-dir)",
+    )
+    parser.add_argument(
+        "--link-ttl",
+        type=float,
+        default=24.0,
+        metavar="HOURS",
+        help="Hours before a cached link is checked again (default: 24)",
+    )
+    parser.add_argument(
+        "--degraded",
+        action="store_true",
+        help="Finish with placeholders for failed diagrams, list them as JSON "
+        "and exit with status 2 (default: fail on the first diagram error)",
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        default=None,
+        metavar="PATH",
+        help="Write a JSON report of chapter, diagram, stage and container costs",
+    )
+    parser.add_argument(
+        "--memory-profile",
+        type=Path,
+        default=None,
+        metavar="PATH",
+        help="Write peak, delta and top allocation sites per stage to a JSON file",
+    )
+    parser.add_argument(
+        "--batch",
+        type=Path,
+        default=None,
+        help="JSON file listing editions to build concurrently with shared caches",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=None,
+        metavar="PATH",
+        help="Keep rendered diagrams, link checks and last-build timings here "
+        f"between builds, e.g. {default_cache_dir()} (default: no persistent cache)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore --cache-dir: do not read or write any persistent cache",
+    )
+    parser.add_argument(
+        "--plan",
+        nargs="?",
+        const="text",
+        choices=["text", "json"],
+        help="Predict changed chapters, diagrams to fetch, network bytes and "
+        "time from the last build, without building (output: text or json)",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run a build daemon on --socket for clients started with --daemon",
+    )
+    parser.add_argument(
+        "--socket",
+        type=Path,
+        default=default_socket_path(),
+        metavar="PATH",
+        help="Unix socket of the build daemon (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Hand the build to the daemon on --socket; build in this process "
+        "if none answers",
+    )
+    return parser
+
+
+def _check_args(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    """Reject option combinations that do not make sense."""
+    if args.memory_profile and args.batch:
+        parser.error("--memory-profile profiles a single build; drop --batch")
+    if args.report and args.batch:
+        parser.error("--report covers a single build; set 'report' per edition")
+    if args.daemon and args.memory_profile:
+        parser.error("--memory-profile runs in this process; drop --daemon")
+
+
+_PATH_ARGUMENTS = (
+    "root",
+    "output",
+    "manifest",
+    "link_cache",
+    "report",
+    "memory_profile",
+    "batch",
+    "socket",
+    "cache_dir",
+)
+
 
-    args = parser.parse_args()
+def resolve_arg_paths(args: argparse.Namespace, cwd: Path) -> None:
+    """Make every path argument absolute, relative to ``cwd``, in place.
 
-    # Determine root path
-    root = args.root
-    if root is None:
-        # Default to parent of scripts directory (repo root)
-        root = Path(__file__).parent.parent
+    The daemon runs in a different directory from its clients, so paths
+    must be resolved against the client's working directory.
+    """
+    for name in _PATH_ARGUMENTS:
+        value = getattr(args, name)
+        if value is not None:
+            setattr(args, name, (cwd / value).resolve())
 
-    root = root.resolve()
-    output = args.output or (root / "claude-howto-guide.epub")
-    output = output.resolve()
 
-    logger = setup_logging(args.verbose)
-    config = EPUBConfig(
+def config_from_args(args: argparse.Namespace) -> EPUBConfig:
+    """Build the config for parsed (and resolved) arguments."""
+    # Default to parent of scripts directory (repo root)
+    root = args.root or Path(__file__).parent.parent.resolve()
+    output = args.output or root / "claude-howto-guide.epub"
+    cache_dir = None if args.no_cache else args.cache_dir
+
+    return EPUBConfig(
         root_path=root,
         output_path=output,
         request_timeout=args.timeout,
         max_concurrent_requests=args.max_concurrent,
+        manifest_path=args.manifest,
+        compression=CompressionPolicy(
+            text_level=args.compress_level, max_compression=args.max_compression
+        ),
+        search_index=not args.no_search_index,
+        validate=args.validate,
+        check_links=args.check_links,
+        max_requests_per_host=args.max_per_host,
+        link_cache_path=args.link_cache
+        or (cache_dir / "links.json" if cache_dir else None),
+        link_cache_ttl=args.link_ttl * 3600,
+        report_path=args.report,
+        cache_dir=cache_dir,
+        degraded=args.degraded,
     )
 
+
+async def run_build_async(
+    args: argparse.Namespace,
+    config: EPUBConfig,
+    logger: logging.Logger,
+    shared: SharedResources | None = None,
+    out: Callable[[str], None] = print,
+) -> int:
+    """Run the build described by ``args``; return the exit status."""
     try:
-        result = asyncio.run(build_epub_async(config, logger))
-        print(f"Successfully created: {result}")
-        return 0
+        if args.batch is not None:
+            configs = load_batch_config(args.batch, config)
+            states = [BuildState() for _ in configs]
+            for result in await build_batch_async(configs, logger, shared, states):
+                out(f"Successfully created: {result}")
+            return _report_problems(
+                {str(c.output_path): s for c, s in zip(configs, states, strict=True)},
+                out,
+            )
+
+        state = BuildState()
+        profiler = MemoryProfiler() if args.memory_profile else None
+        profile_written = True
+        if profiler is not None:
+            profiler.start()
+        try:
+            result = await build_epub_async(config, logger, state, shared, profiler)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+                try:
+                    profiler.write(args.memory_profile)
+                    logger.info(f"Memory profile written to {args.memory_profile}")
+                except EPUBBuildError as e:
+                    # Keep a build error, if any, as the one that propagates
+                    logger.error(str(e))
+                    profile_written = False
+        out(f"Successfully created: {result}")
+        status = _report_problems({str(result): state}, out)
+        return status if profile_written else 1
     except EPUBBuildError as e:
         logger.error(f"Build failed: {e}")
         return 1
+
+
+def _print_plan(config: EPUBConfig, logger: logging.Logger, output: str) -> int:
+    """Print the build plan as text or JSON; return the exit status."""
+    if config.cache_dir is None:
+        logger.warning(
+            "No --cache-dir: the plan has no cached diagrams or last build to use"
+        )
+    try:
+        plan = plan_build(config, logger)
+    except EPUBBuildError as e:
+        logger.error(f"Plan failed: {e}")
+        return 1
+    print(json.dumps(plan, indent=2) if output == "json" else format_plan(plan))
+    return 0
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """Main entry point with CLI argument parsing."""
+    argv = list(sys.argv[1:] if argv is None else argv)
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    _check_args(parser, args)
+
+    logger = setup_logging(args.verbose)
+    cwd = Path.cwd()
+    resolve_arg_paths(args, cwd)
+    config = config_from_args(args)
+
+    try:
+        if args.plan:
+            return _print_plan(config, logger, args.plan)
+        if args.serve:
+            return serve_daemon(args.socket, config, logger)
+
+        # Hand the build to a running daemon if asked; fall back to building here
+        if args.daemon:
+            status = run_client(args.socket, argv, cwd)
+            if status is not None:
+                return status
+            logger.info(f"No build daemon on {args.socket}; building in this process")
+
+        return asyncio.run(run_build_async(args, config, logger))
     except KeyboardInterrupt:
         logger.warning("Build interrupted by user")
         return 130
@@ -2,24 +2,78 @@
 
 from __future__ import annotations
 
+import argparse
+import asyncio
+import dataclasses
+import json
 import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from unittest.mock import patch
+from typing import Any, ClassVar
+from unittest.mock import AsyncMock, patch
 
 import pytest
+from bs4 import BeautifulSoup
 
 # Fixtures are imported from conftest.py automatically by pytest
 # Import from parent directory (handled by conftest.py sys.path)
 from build_epub import (
+    DEFAULT_MANIFEST,
+    MARKDOWN_EXTENSIONS,
+    BuildDaemon,
     BuildState,
+    ByteLRUCache,
     ChapterCollector,
+    CompressionPolicy,
+    DiagramDiskCache,
     EPUBConfig,
+    FileIndex,
+    LinkCache,
+    LinkChecker,
+    ManifestEntry,
+    MarkdownConverterPool,
+    MemoryProfiler,
+    MermaidRenderer,
+    MermaidRenderError,
+    SearchIndex,
+    SearchIndexBuilder,
+    SharedResources,
     ValidationError,
+    broken_link_report,
+    build_batch_async,
+    build_epub_async,
+    build_parser,
+    build_report,
+    collect_folder_files,
+    config_from_args,
     create_chapter_html,
+    diagram_failure_report,
     extract_all_mermaid_blocks,
+    format_plan,
     get_chapter_order,
+    last_build_path,
+    list_markdown_files,
+    load_batch_config,
+    load_manifest,
+    main,
+    md_to_html,
+    plan_build,
+    run_build_async,
+    run_client,
     sanitize_mermaid,
     setup_logging,
+    validate_epub,
     validate_inputs,
 )
 
@@ -239,6 +293,83 @@ graph TD
         assert len(diagrams) == 1
 
 
+class TestDiagramFailures:
+    """Tests for fail-fast cancellation and degraded output."""
+
+    @staticmethod
+    def _fake_fetch(started: list[int], cancelled: list[int]):
+        """Fetch stub: diagram 1 fails at once, the others hang until cancelled."""
+
+        async def fetch(self, client, mermaid_code: str, index: int) -> bytes:
+            started.append(index)
+            if index == 1:
+                raise MermaidRenderError(f"Kroki API returned 400 for diagram {index}")
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.append(index)
+                raise
+            return b"png"
+
+        return fetch
+
+    @pytest.mark.asyncio
+    async def test_strict_mode_cancels_outstanding_fetches(
+        self, config: EPUBConfig, state: BuildState, logger: logging.Logger
+    ) -> None:
+        """Test that the first failure cancels every other fetch."""
+        started: list[int] = []
+        cancelled: list[int] = []
+        renderer = MermaidRenderer(config, state, logger)
+
+        with patch.object(
+            MermaidRenderer, "_fetch_with_retry", self._fake_fetch(started, cancelled)
+        ):
+            start = time.perf_counter()
+            with pytest.raises(MermaidRenderError, match="diagram 1"):
+                await renderer.render_all(
+                    [(1, "graph A"), (2, "graph B"), (3, "graph C")]
+                )
+            elapsed = time.perf_counter() - start
+
+        assert elapsed < 5
+        assert sorted(cancelled) == [2, 3]
+
+    @pytest.mark.asyncio
+    async def test_degraded_build_uses_placeholders(
+        self, config: EPUBConfig, state: BuildState, logger: logging.Logger
+    ) -> None:
+        """Test that degraded mode finishes and reports the failed diagram."""
+        readme = config.root_path / "README.md"
+        readme.write_text(
+            "# Test\n\n```mermaid\ngraph A\n```\n\n```mermaid\ngraph B\n```\n"
+        )
+        config.chapter_order = [("README.md", "Introduction")]
+        config.degraded = True
+
+        async def fetch(self, client, mermaid_code: str, index: int) -> bytes:
+            if "graph A" in mermaid_code:
+                raise MermaidRenderError("Kroki API returned 400 for diagram 1")
+            return b"\x89PNG\r\n\x1a\n"
+
+        with patch.object(MermaidRenderer, "_fetch_with_retry", fetch):
+            result = await build_epub_async(config, logger, state)
+
+        with zipfile.ZipFile(result) as zf:
+            chapter = zf.read("EPUB/chap_01.xhtml").decode()
+        assert "diagram-placeholder" in chapter
+        assert "Kroki API returned 400" in chapter
+        assert "images/mermaid_1.png" in chapter
+
+        assert diagram_failure_report(state) == [
+            {
+                "index": 1,
+                "error": "Kroki API returned 400 for diagram 1",
+                "files": [str(readme)],
+            }
+        ]
+
+
 # =============================================================================
 # Chapter Collection Tests
 # =============================================================================
@@ -285,6 +416,159 @@ class TestChapterCollector:
         assert "01-test-chapter" in state.path_to_chapter
         assert "01-test-chapter/README.md" in state.path_to_chapter
 
+    def test_folder_order_and_titles(self, tmp_path: Path) -> None:
+        """Test README first, then files, then subfolders with prefixed titles."""
+        folder = tmp_path / "chapter"
+        (folder / "sub-dir" / "deeper").mkdir(parents=True)
+        (folder / ".hidden").mkdir()
+        for rel in [
+            "README.md",
+            "b-file.md",
+            "a_file.md",
+            "sub-dir/README.md",
+            "sub-dir/x.md",
+            "sub-dir/deeper/y.md",
+            ".hidden/skip.md",
+        ]:
+            (folder / rel).write_text("# x")
+
+        files = collect_folder_files(folder)
+
+        assert [(p.relative_to(folder).as_posix(), t) for p, t in files] == [
+            ("README.md", "Overview"),
+            ("a_file.md", "A File"),
+            ("b-file.md", "B File"),
+            ("sub-dir/README.md", "Sub Dir: Overview"),
+            ("sub-dir/x.md", "Sub Dir: X"),
+            ("sub-dir/deeper/y.md", "Sub Dir: Deeper: Y"),
+        ]
+
+    def test_large_folder_names_sort_in_order(
+        self, tmp_path: Path, state: BuildState
+    ) -> None:
+        """Test that folders with more than 100 files keep unique, ordered names."""
+        folder = tmp_path / "big"
+        folder.mkdir()
+        for i in range(150):
+            (folder / f"doc-{i:03d}.md").write_text(f"# Doc {i}")
+
+        collector = ChapterCollector(tmp_path, state)
+        chapters = collector.collect_all_chapters([("big", "Big")])
+        names = [c.chapter_filename for c in chapters]
+
+        assert len(set(names)) == 150
+        assert names == sorted(names)
+        assert names[0] == "chap_01_000.xhtml"
+        assert names[-1] == "chap_01_149.xhtml"
+
+    def test_manifest_entries_with_globs_and_sections(
+        self, tmp_path: Path, state: BuildState
+    ) -> None:
+        """Test glob entries, nested sections and first-claim ownership."""
+        for rel in [
+            "intro.md",
+            "guide/README.md",
+            "guide/setup.md",
+            "guide/advanced/tuning.md",
+            "guide/drafts/wip.md",
+            "extra.md",
+        ]:
+            (tmp_path / rel).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / rel).write_text("# x")
+
+        entries = [
+            ManifestEntry(title="Intro", path="intro.md"),
+            ManifestEntry(
+                title="Guide",
+                include=["guide/*.md"],
+                sections=[
+                    ManifestEntry(title="Advanced", include=["guide/advanced/**"]),
+                ],
+            ),
+            ManifestEntry(
+                title="Everything Else", include=["**/*.md"], exclude=["**/drafts/**"]
+            ),
+        ]
+
+        chapters = ChapterCollector(tmp_path, state).collect_all_chapters(entries)
+        summary = [
+            (c.file_path.relative_to(tmp_path).as_posix(), c.section_path)
+            for c in chapters
+        ]
+
+        assert summary == [
+            ("intro.md", ()),
+            ("guide/README.md", ("Guide",)),
+            ("guide/setup.md", ("Guide",)),
+            ("guide/advanced/tuning.md", ("Guide", "Advanced")),
+            ("extra.md", ("Everything Else",)),
+        ]
+        assert chapters[1].is_folder_overview
+        assert chapters[3].is_folder_overview
+        assert chapters[3].display_name == "Advanced"
+
+    def test_collector_walks_only_referenced_folders(
+        self, tmp_path: Path, state: BuildState
+    ) -> None:
+        """Test that vendor folders are skipped and only named folders walked."""
+        for rel in [
+            "guide/README.md",
+            "docs/api/index.md",
+            "node_modules/pkg/README.md",
+            "build/out.md",
+            "unrelated/notes.md",
+        ]:
+            (tmp_path / rel).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / rel).write_text("# x")
+        files = FileIndex()
+
+        chapters = ChapterCollector(tmp_path, state, files).collect_all_chapters(
+            [
+                ManifestEntry(title="Guide", path="guide"),
+                ManifestEntry(title="API", include=["docs/**/*.md"]),
+            ]
+        )
+
+        assert [c.file_path.relative_to(tmp_path).as_posix() for c in chapters] == [
+            "guide/README.md",
+            "docs/api/index.md",
+        ]
+        assert set(files._listings) == {tmp_path / "guide", tmp_path / "docs"}
+        assert list_markdown_files(tmp_path) == [
+            "docs/api/index.md",
+            "guide/README.md",
+            "unrelated/notes.md",
+        ]
+
+    def test_collect_5000_file_corpus_within_budget(
+        self, tmp_path: Path, state: BuildState
+    ) -> None:
+        """Test that a 5,000-file corpus collects quickly with unique names."""
+        for section in range(50):
+            folder = tmp_path / f"{section:02d}-section" / "nested"
+            folder.mkdir(parents=True)
+            for i in range(50):
+                (folder.parent / f"page-{i:03d}.md").write_text("# x")
+                (folder / f"page-{i:03d}.md").write_text("# x")
+        entries = [
+            ManifestEntry(title="Sections", include=["*-section/*.md"]),
+            ManifestEntry(
+                title="Nested",
+                include=["**/nested/*.md"],
+                sections=[ManifestEntry(title="Unused", include=["none/*.md"])],
+            ),
+        ]
+
+        start = time.perf_counter()
+        chapters = ChapterCollector(tmp_path, state).collect_all_chapters(entries)
+        elapsed = time.perf_counter() - start
+
+        names = [c.chapter_filename for c in chapters]
+        assert len(chapters) == 5000
+        assert len(set(names)) == 5000
+        assert names == sorted(names)
+        assert elapsed < 2.0
+
 
 # =============================================================================
 # HTML Generation Tests
@@ -334,6 +618,205 @@ class TestHTMLGeneration:
         assert "<script>alert" not in html
 
 
+# =============================================================================
+# Content Conversion Tests
+# =============================================================================
+
+
+class TestContentConversion:
+    """Tests for how md_to_html rewrites ids, images and links for the EPUB.
+
+    Each test compares plain python-markdown output (what chapters held
+    before) with md_to_html output, whose references all resolve inside
+    the book.
+    """
+
+    @staticmethod
+    def convert(
+        md: str, root: Path, state: BuildState, logger: logging.Logger, book=None
+    ) -> str:
+        from ebooklib import epub
+
+        return md_to_html(
+            md,
+            root / "README.md",
+            root,
+            book or epub.EpubBook(),
+            state,
+            logger,
+            chapter_filename="chap_01.xhtml",
+        )
+
+    def test_heading_ids_follow_github_slugs(
+        self, tmp_path: Path, state: BuildState, logger: logging.Logger
+    ) -> None:
+        """Test that anchors written against GitHub's rendering resolve."""
+        import markdown
+
+        md = "## 🎓 Learning Path\n\n## Comparison & Integration\n"
+        before = markdown.markdown(md, extensions=MARKDOWN_EXTENSIONS)
+        after = self.convert(md, tmp_path, state, logger)
+
+        assert 'id="learning-path"' in before
+        assert 'id="comparison-integration"' in before
+        assert 'id="-learning-path"' in after
+        assert 'id="comparison--integration"' in after
+
+    def test_local_images_are_packaged(
+        self, tmp_path: Path, state: BuildState, logger: logging.Logger
+    ) -> None:
+        """Test that local images ship with the book or fall back to alt text."""
+        import markdown
+        from ebooklib import epub
+
+        (tmp_path / "docs").mkdir()
+        (tmp_path / "docs" / "shot.png").write_bytes(b"\x89PNG\r\n\x1a\n")
+        md = "![shot](docs/shot.png) ![lost](lost.png)\n"
+        book = epub.EpubBook()
+        before = markdown.markdown(md, extensions=MARKDOWN_EXTENSIONS)
+        after = self.convert(md, tmp_path, state, logger, book)
+
+        assert 'src="docs/shot.png"' in before
+        assert 'src="lost.png"' in before
+        assert 'src="images/docs-shot.png"' in after
+        assert "[lost]" in after
+        assert "lost.png" not in after
+        item = book.get_item_with_href("images/docs-shot.png")
+        assert item.get_content() == b"\x89PNG\r\n\x1a\n"
+
+    def test_links_the_book_cannot_resolve_become_text(
+        self, tmp_path: Path, state: BuildState, logger: logging.Logger
+    ) -> None:
+        """Test that only links to chapters and existing anchors stay links."""
+        import markdown
+
+        state.path_to_chapter["guide/README.md"] = "chap_02.xhtml"
+        md = (
+            "# Top\n\n[top](#top) [gone](#missing) [license](LICENSE) "
+            "[guide](guide/) [outside](../elsewhere.md) [api](guide/README.md#api)\n"
+        )
+        before = markdown.markdown(md, extensions=MARKDOWN_EXTENSIONS)
+        after = self.convert(md, tmp_path, state, logger)
+
+        for href in ("#missing", "LICENSE", "../elsewhere.md"):
+            assert f'href="{href}"' in before
+            assert f'href="{href}"' not in after
+        assert 'href="#top"' in after
+        assert 'href="chap_02.xhtml"' in after
+        assert 'href="chap_02.xhtml#api"' in after
+        assert "gone license" in after
+
+    @pytest.mark.asyncio
+    async def test_anchors_other_chapters_lack_point_at_their_top(
+        self, config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        """Test that cross-chapter anchors are kept only if the target has them."""
+        (config.root_path / "README.md").write_text(
+            "# Intro\n\n[ok](01-test-chapter/section.md#section) "
+            "[stale](01-test-chapter/section.md#renamed)\n"
+        )
+        config.chapter_order = [
+            ("README.md", "Introduction"),
+            ("01-test-chapter", "Chapter"),
+        ]
+
+        await build_epub_async(config, logger)
+
+        with zipfile.ZipFile(config.output_path) as zf:
+            intro = zf.read("EPUB/chap_01.xhtml").decode()
+        assert 'href="chap_02_01.xhtml#section"' in intro
+        assert 'href="chap_02_01.xhtml"' in intro
+        assert "#renamed" not in intro
+
+
+# =============================================================================
+# Search Index Tests
+# =============================================================================
+
+
+class TestSearchIndex:
+    """Tests for the embedded full-text search index."""
+
+    @staticmethod
+    def _index(chapters: dict[str, str]) -> SearchIndex:
+        builder = SearchIndexBuilder()
+        for filename, html in chapters.items():
+            builder.add_chapter(filename, BeautifulSoup(html, "html.parser"))
+        return SearchIndex(builder.to_bytes())
+
+    def test_round_trip_positions_and_anchors(self) -> None:
+        """Test that postings survive encoding with anchors and positions."""
+        index = self._index(
+            {
+                "chap_01.xhtml": "<p>Hooks run hooks</p>"
+                '<h2 id="setup">Setup</h2><p>Install hooks</p>',
+                "chap_02.xhtml": "<p>Skills and hooks</p>",
+            }
+        )
+
+        hits = [(h.chapter, h.anchor, h.position) for h in index.lookup("Hooks")]
+        assert hits == [
+            ("chap_01.xhtml", "", 0),
+            ("chap_01.xhtml", "", 2),
+            ("chap_01.xhtml", "setup", 5),
+            ("chap_02.xhtml", "", 2),
+        ]
+        assert index.chapters == ["chap_01.xhtml", "chap_02.xhtml"]
+
+    def test_search_requires_every_term(self) -> None:
+        """Test that multi-word queries match sections containing all terms."""
+        index = self._index(
+            {
+                "chap_01.xhtml": '<h2 id="a">Slash commands</h2>'
+                '<h2 id="b">Commands only</h2>',
+                "chap_02.xhtml": "<p>slash</p><p>COMMANDS</p>",
+            }
+        )
+
+        assert index.search("slash commands") == [
+            "chap_01.xhtml#a",
+            "chap_02.xhtml",
+        ]
+        assert index.search("missing") == []
+        assert "commands" in index
+
+    def test_skips_scripts_and_styles(self) -> None:
+        """Test that non-visible text is not indexed."""
+        index = self._index({"c.xhtml": "<style>.secret {}</style><p>shown</p>"})
+
+        assert "secret" not in index
+        assert "shown" in index
+
+    def test_rejects_foreign_data(self) -> None:
+        """Test that decoding checks the magic bytes."""
+        with pytest.raises(ValidationError):
+            SearchIndex(b"not an index")
+
+    @pytest.mark.asyncio
+    async def test_build_embeds_index(
+        self, config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        """Test that the built EPUB carries a decodable index."""
+        await build_epub_async(config, logger)
+
+        with zipfile.ZipFile(config.output_path) as zf:
+            index = SearchIndex(zf.read("EPUB/search/index.bin"))
+
+        assert index.search("test project") == ["chap_01.xhtml#test-project"]
+
+    @pytest.mark.asyncio
+    async def test_build_without_index(
+        self, config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        """Test that the index can be disabled."""
+        config.search_index = False
+
+        await build_epub_async(config, logger)
+
+        with zipfile.ZipFile(config.output_path) as zf:
+            assert "EPUB/search/index.bin" not in zf.namelist()
+
+
 # =============================================================================
 # Chapter Order Tests
 # =============================================================================
@@ -353,8 +836,47 @@ class TestChapterOrder:
         chapter_names = [name for name, _ in order]
         assert "01-slash-commands" in chapter_names
         assert "02-memory" in chapter_names
+        assert "10-cli" in chapter_names
         assert "resources.md" in chapter_names
 
+    def test_default_manifest_matches_chapter_order(self) -> None:
+        """Test that the shipped manifest lists the default chapters."""
+        manifest = Path(__file__).parent.parent / "chapters.toml"
+        entries = load_manifest(manifest)
+
+        assert [(e.path, e.title) for e in entries] == get_chapter_order()
+
+    def test_load_manifest_nested_sections(self, tmp_path: Path) -> None:
+        """Test loading globs and nested sections from TOML."""
+        manifest = tmp_path / "chapters.toml"
+        manifest.write_text(
+            """
+[[chapter]]
+title = "Guide"
+include = ["guide/**/*.md"]
+exclude = ["guide/drafts/*"]
+
+[[chapter.section]]
+title = "Advanced"
+path = "guide/advanced"
+"""
+        )
+
+        entries = load_manifest(manifest)
+
+        assert entries[0].include == ["guide/**/*.md"]
+        assert entries[0].exclude == ["guide/drafts/*"]
+        assert entries[0].sections[0].title == "Advanced"
+        assert entries[0].sections[0].path == "guide/advanced"
+
+    def test_load_manifest_rejects_entry_without_source(self, tmp_path: Path) -> None:
+        """Test that an entry with nothing to include is rejected."""
+        manifest = tmp_path / "chapters.toml"
+        manifest.write_text('[[chapter]]\ntitle = "Empty"\n')
+
+        with pytest.raises(ValidationError, match="needs a 'path'"):
+            load_manifest(manifest)
+
 
 # =============================================================================
 # Logging Tests
@@ -405,6 +927,1063 @@ class TestIntegration:
             assert result.suffix == ".epub"
 
 
+# =============================================================================
+# Packaging Tests
+# =============================================================================
+
+
+class TestCompressionPolicy:
+    """Tests for per-entry EPUB compression."""
+
+    def test_media_is_stored_and_text_deflated(self) -> None:
+        """Test the default policy for images and text."""
+        policy = CompressionPolicy(text_level=4)
+
+        assert policy.choose("EPUB/images/a.png", b"x" * 100) == (
+            zipfile.ZIP_STORED,
+            None,
+        )
+        assert policy.choose("EPUB/chap_01.xhtml", b"<p/>") == (
+            zipfile.ZIP_DEFLATED,
+            4,
+        )
+
+    def test_max_compression_only_deflates_media_that_shrinks(self) -> None:
+        """Test that release mode deflates media only when it helps."""
+        policy = CompressionPolicy(max_compression=True)
+        incompressible = bytes(range(256)) * 4
+        incompressible = zlib.compress(incompressible, 9)
+
+        assert policy.choose("a.png", b"\0" * 4096) == (zipfile.ZIP_DEFLATED, 9)
+        assert policy.choose("a.png", incompressible) == (zipfile.ZIP_STORED, None)
+        assert policy.choose("a.css", b"body {}") == (zipfile.ZIP_DEFLATED, 9)
+
+    @pytest.mark.asyncio
+    async def test_build_applies_policy_per_entry(
+        self, config: EPUBConfig, logger: logging.Logger, state: BuildState
+    ) -> None:
+        """Test container layout and the per-type packaging stats."""
+        config.chapter_order = [("README.md", "Introduction")]
+
+        await build_epub_async(config, logger, state)
+
+        with zipfile.ZipFile(config.output_path) as zf:
+            infos = zf.infolist()
+        by_name = {info.filename: info for info in infos}
+
+        assert infos[0].filename == "mimetype"
+        assert infos[0].compress_type == zipfile.ZIP_STORED
+        assert by_name["EPUB/cover.png"].compress_type == zipfile.ZIP_STORED
+        assert by_name["EPUB/chap_01.xhtml"].compress_type == zipfile.ZIP_DEFLATED
+        assert state.packaging_stats["image/png"].saved_bytes == 0
+        assert state.packaging_stats["application/xhtml+xml"].saved_bytes > 0
+
+
+# =============================================================================
+# EPUB Validation Tests
+# =============================================================================
+
+
+class TestEPUBValidation:
+    """Tests for the in-process EPUB structure validator."""
+
+    @staticmethod
+    def _rewrite(
+        path: Path,
+        replace: dict[str, bytes] | None = None,
+        drop: tuple[str, ...] = (),
+        deflate_mimetype: bool = False,
+    ) -> None:
+        """Rewrite an EPUB with some entries replaced or removed."""
+        with zipfile.ZipFile(path) as zf:
+            entries = [(info, zf.read(info)) for info in zf.infolist()]
+        with zipfile.ZipFile(path, "w") as zf:
+            for info, data in entries:
+                if info.filename in drop:
+                    continue
+                compress = info.compress_type
+                if info.filename == "mimetype" and deflate_mimetype:
+                    compress = zipfile.ZIP_DEFLATED
+                content = (replace or {}).get(info.filename, data)
+                zf.writestr(info.filename, content, compress_type=compress)
+
+    @pytest.fixture
+    def built(self, config: EPUBConfig, logger: logging.Logger) -> Path:
+        (config.root_path / "README.md").write_text(
+            "# Test\n\n## Usage\n\n[usage](#usage) and [chapter](01-test-chapter/README.md#chapter-overview)\n"
+        )
+        config.chapter_order = [
+            ("README.md", "Introduction"),
+            ("01-test-chapter", "Chapter"),
+        ]
+        asyncio.run(build_epub_async(config, logger))
+        return config.output_path
+
+    def test_built_epub_is_valid(self, built: Path) -> None:
+        """Test that the builder's own output passes."""
+        assert validate_epub(built) == []
+
+    def test_mimetype_must_be_stored(self, built: Path) -> None:
+        """Test that a compressed mimetype entry is reported."""
+        self._rewrite(built, deflate_mimetype=True)
+
+        assert validate_epub(built) == ["mimetype: must be stored uncompressed"]
+
+    def test_broken_anchor_and_missing_file(self, built: Path) -> None:
+        """Test that internal links are resolved against files and ids."""
+        with zipfile.ZipFile(built) as zf:
+            chapter = zf.read("EPUB/chap_01.xhtml")
+        chapter = chapter.replace(b'href="#usage"', b'href="#nowhere"')
+        chapter = chapter.replace(b"chap_02_00.xhtml#", b"chap_99.xhtml#")
+        self._rewrite(built, replace={"EPUB/chap_01.xhtml": chapter})
+
+        assert validate_epub(built) == [
+            "EPUB/chap_01.xhtml: link to missing anchor '#nowhere'",
+            "EPUB/chap_01.xhtml: link to missing file 'chap_99.xhtml#chapter-overview'",
+        ]
+
+    def test_manifest_entries_must_exist(self, built: Path) -> None:
+        """Test that a manifest item without a file is reported."""
+        self._rewrite(built, drop=("EPUB/chap_02_00.xhtml",))
+
+        problems = validate_epub(built)
+
+        assert (
+            "EPUB/content.opf: manifest item 'chapter_1' (chap_02_00.xhtml) missing"
+            in problems
+        )
+        assert any("link to missing file 'chap_02_00.xhtml" in p for p in problems)
+
+    def test_media_type_must_match_content(self, built: Path) -> None:
+        """Test that a PNG entry that is not a PNG is reported."""
+        self._rewrite(built, replace={"EPUB/cover.png": b"GIF89a..."})
+
+        assert validate_epub(built) == [
+            "EPUB/cover.png: declared image/png but content does not match"
+        ]
+
+    @pytest.mark.asyncio
+    async def test_build_fails_on_invalid_output(
+        self, config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        """Test that --validate turns problems into a build failure."""
+        config.chapter_order = [("README.md", "Introduction")]
+        config.validate = True
+        problem = "EPUB/chap_01.xhtml: link to missing anchor '#missing'"
+
+        with (
+            patch("build_epub.validate_epub", return_value=[problem]),
+            pytest.raises(ValidationError, match="missing anchor '#missing'"),
+        ):
+            await build_epub_async(config, logger)
+
+    @pytest.mark.asyncio
+    async def test_links_outside_the_book(
+        self, config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        """Test that links the book cannot resolve become text, images are packed."""
+        root = config.root_path
+        (root / "LICENSE").write_text("MIT\n")
+        (root / "screenshot.png").write_bytes(b"\x89PNG\r\n\x1a\n")
+        (root / "README.md").write_text(
+            "# 🎓 Learning Path\n\n"
+            "[top](#-learning-path) [gone](#missing) [license](LICENSE) "
+            "[scripts](scripts/) [outside](../elsewhere.md) "
+            "[chapter](01-test-chapter/README.md#nowhere)\n\n"
+            "![shot](screenshot.png) ![lost](lost.png)\n"
+        )
+        config.chapter_order = [
+            ("README.md", "Introduction"),
+            ("01-test-chapter", "Chapter"),
+        ]
+        config.validate = True
+
+        await build_epub_async(config, logger)
+
+        assert validate_epub(config.output_path) == []
+        with zipfile.ZipFile(config.output_path) as zf:
+            chapter = zf.read("EPUB/chap_01.xhtml").decode()
+            assert zf.read("EPUB/images/screenshot.png") == b"\x89PNG\r\n\x1a\n"
+        assert 'href="#-learning-path"' in chapter
+        assert 'href="chap_02_00.xhtml"' in chapter
+        assert "gone license scripts outside" in chapter
+        assert 'src="images/screenshot.png"' in chapter
+        assert "[lost]" in chapter
+
+    @pytest.mark.asyncio
+    async def test_guide_passes_validation(
+        self, tmp_path: Path, logger: logging.Logger
+    ) -> None:
+        """Test that the real guide, built from its manifest, is valid."""
+        config = EPUBConfig(
+            root_path=Path(__file__).resolve().parents[2],
+            output_path=tmp_path / "guide.epub",
+            manifest_path=DEFAULT_MANIFEST,
+            validate=True,
+        )
+
+        with patch(
+            "build_epub.MermaidRenderer._fetch_with_retry",
+            new_callable=AsyncMock,
+            return_value=b"\x89PNG\r\n\x1a\n",
+        ):
+            await build_epub_async(config, logger)
+
+        assert validate_epub(config.output_path) == []
+
+
+# =============================================================================
+# Build Report Tests
+# =============================================================================
+
+
+class TestBuildReport:
+    """Tests for the JSON build report."""
+
+    @pytest.mark.asyncio
+    async def test_report_breakdown(
+        self, config: EPUBConfig, logger: logging.Logger, tmp_path: Path
+    ) -> None:
+        """Test per-chapter, per-diagram, per-stage and container entries."""
+        (config.root_path / "README.md").write_text(
+            "# Test\n\n[web](https://example.com) [self](#test)\n\n"
+            "```mermaid\ngraph TD\n    A --> B\n```\n"
+        )
+        config.chapter_order = [("README.md", "Introduction")]
+        config.report_path = tmp_path / "reports" / "build.json"
+        shared = SharedResources()
+
+        with patch(
+            "build_epub.MermaidRenderer._fetch_with_retry",
+            new_callable=AsyncMock,
+            return_value=b"\x89PNG\r\n\x1a\n",
+        ):
+            await build_epub_async(config, logger, shared=shared)
+            report = json.loads(config.report_path.read_text())
+            state = BuildState()
+            await build_epub_async(config, logger, state, shared=shared)
+
+        [chapter] = report["chapters"]
+        assert chapter["chapter"] == "chap_01.xhtml"
+        assert chapter["source"] == "README.md"
+        assert chapter["source_bytes"] == len(
+            (config.root_path / "README.md").read_bytes()
+        )
+        assert chapter["xhtml_bytes"] > 0
+        assert (chapter["diagrams"], chapter["links"]) == (1, 2)
+
+        [diagram] = report["diagrams"]
+        assert diagram["image"] == "mermaid_1.png"
+        assert diagram["cache"] == "miss"
+        assert diagram["png_bytes"] == 8
+
+        assert list(report["stages"]) == [
+            "cover",
+            "collect",
+            "diagrams",
+            "chapters",
+            "write",
+        ]
+        assert report["container"]["bytes"] == config.output_path.stat().st_size
+        assert report["container"]["by_media_type"]["image/png"]["entries"] == 2
+
+        # A second build over the same shared resources reuses the diagram
+        assert build_report(config, state)["diagrams"][0]["cache"] == "hit"
+
+
+# =============================================================================
+# Memory Profiling Tests
+# =============================================================================
+
+
+class TestMemoryProfiler:
+    """Tests for the per-stage memory profiler."""
+
+    def test_mark_requires_start(self) -> None:
+        """Test that marking a stage before start() fails clearly."""
+        with pytest.raises(RuntimeError, match="start"):
+            MemoryProfiler().mark("cover")
+
+    def test_mark_records_delta_and_sites(self) -> None:
+        """Test that a stage reports its growth and allocation sites."""
+        profiler = MemoryProfiler(top_n=3)
+        profiler.start()
+        try:
+            retained = [bytearray(1024) for _ in range(1000)]
+            profiler.mark("allocate")
+        finally:
+            profiler.stop()
+
+        stage = profiler.stages[0]
+        assert stage["stage"] == "allocate"
+        assert stage["delta_bytes"] >= 1024 * 1000
+        assert stage["peak_bytes"] >= stage["current_bytes"]
+        assert len(stage["top_allocations"]) <= 3
+        assert "test_build_epub.py" in stage["top_allocations"][0]["site"]
+        assert len(retained) == 1000
+
+    @pytest.mark.asyncio
+    async def test_build_writes_stage_profile(
+        self, config: EPUBConfig, logger: logging.Logger, tmp_path: Path
+    ) -> None:
+        """Test that a profiled build reports every stage as JSON."""
+        config.chapter_order = [("README.md", "Introduction")]
+        profiler = MemoryProfiler()
+        profiler.start()
+        try:
+            await build_epub_async(config, logger, profiler=profiler)
+        finally:
+            profiler.stop()
+
+        report_path = tmp_path / "memory.json"
+        profiler.write(report_path)
+        report = json.loads(report_path.read_text())
+
+        assert [s["stage"] for s in report["stages"]] == [
+            "cover",
+            "collect",
+            "diagrams",
+            "chapters",
+            "write",
+        ]
+        assert report["peak_bytes"] == max(s["peak_bytes"] for s in report["stages"])
+        assert report["peak_stage"] in {s["stage"] for s in report["stages"]}
+
+    @pytest.mark.asyncio
+    async def test_profile_goes_to_new_folders_and_write_errors_fail(
+        self, config: EPUBConfig, logger: logging.Logger, tmp_path: Path
+    ) -> None:
+        """Test that the profile's folder is created and a failed write exits 1."""
+        config.chapter_order = [("README.md", "Introduction")]
+        nested = tmp_path / "profiles" / "new" / "memory.json"
+        args = argparse.Namespace(batch=None, memory_profile=nested)
+
+        assert await run_build_async(args, config, logger, out=lambda _: None) == 0
+        assert json.loads(nested.read_text())["stages"]
+
+        blocker = tmp_path / "not-a-folder"
+        blocker.write_text("")
+        args.memory_profile = blocker / "memory.json"
+        assert await run_build_async(args, config, logger, out=lambda _: None) == 1
+        assert config.output_path.exists()
+
+
+# =============================================================================
+# Batch Build Tests
+# =============================================================================
+
+
+class TestSharedResources:
+    """Tests for resources shared between builds."""
+
+    def test_converter_pool_matches_markdown(self) -> None:
+        """Test that pooled conversion matches a fresh converter."""
+        import markdown
+
+        source = "# Title\n\n```python\nx = 1\n```\n\n| a | b |\n|---|---|\n| 1 | 2 |"
+        pool = MarkdownConverterPool()
+        expected = markdown.markdown(
+            source, extensions=["tables", "fenced_code", "codehilite", "toc"]
+        )
+
+        assert pool.convert(source) == expected
+        assert pool.convert("# Other") != expected
+        assert pool.convert(source) == expected
+
+    @pytest.mark.asyncio
+    async def test_fetch_diagram_deduplicates_concurrent_requests(self) -> None:
+        """Test that concurrent requests for one diagram fetch it once."""
+        shared = SharedResources()
+        calls = 0
+
+        async def fetch() -> bytes:
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return b"png"
+
+        results = await asyncio.gather(
+            *(shared.fetch_diagram("graph TD", fetch) for _ in range(5))
+        )
+
+        assert results == [b"png"] * 5
+        assert calls == 1
+        assert shared.diagrams["graph TD"] == b"png"
+
+    def test_byte_cache_evicts_least_recently_used(self) -> None:
+        """Test that the cache stays within its size, dropping old entries."""
+        cache = ByteLRUCache(max_bytes=10)
+        cache["a"] = b"1234"
+        cache["b"] = b"1234"
+        assert cache.get("a") == b"1234"  # "b" is now least recently used
+        cache["c"] = b"1234"
+        cache["huge"] = b"x" * 11
+
+        assert ("a" in cache, "b" in cache, "c" in cache) == (True, False, True)
+        assert "huge" not in cache
+        assert cache.size == 8
+
+    def test_converter_pool_keeps_bounded_idle(self) -> None:
+        """Test that converters beyond max_idle are dropped after use."""
+        pool = MarkdownConverterPool(max_idle=1)
+        overlapping = threading.Barrier(3)
+
+        def convert(self: Any, source: str) -> str:
+            overlapping.wait(timeout=5)  # All three hold a converter at once
+            return ""
+
+        with patch("markdown.Markdown.convert", convert):
+            threads = [
+                threading.Thread(target=pool.convert, args=("# A",)) for _ in range(3)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert len(pool._idle) == 1
+
+
+class TestBatchBuild:
+    """Tests for multi-edition batch builds."""
+
+    def test_load_batch_config(self, tmp_project: Path, config: EPUBConfig) -> None:
+        """Test that editions resolve paths relative to the batch file."""
+        batch_file = tmp_project / "editions.json"
+        batch_file.write_text(
+            json.dumps(
+                {
+                    "editions": [
+                        {"output": "full.epub"},
+                        {
+                            "output": "intro.epub",
+                            "title": "Intro Edition",
+                            "chapters": [["README.md", "Introduction"]],
+                        },
+                    ]
+                }
+            )
+        )
+
+        configs = load_batch_config(batch_file, config)
+
+        assert [c.output_path for c in configs] == [
+            tmp_project / "full.epub",
+            tmp_project / "intro.epub",
+        ]
+        assert configs[0].chapter_order is None
+        assert configs[1].title == "Intro Edition"
+        assert configs[1].chapter_order == [("README.md", "Introduction")]
+
+    def test_load_batch_config_requires_output(
+        self, tmp_project: Path, config: EPUBConfig
+    ) -> None:
+        """Test that an edition without an output is rejected."""
+        batch_file = tmp_project / "editions.json"
+        batch_file.write_text(json.dumps([{"title": "No output"}]))
+
+        with pytest.raises(ValidationError, match="needs an 'output'"):
+            load_batch_config(batch_file, config)
+
+    @pytest.mark.asyncio
+    async def test_batch_shares_diagram_rendering(
+        self, tmp_project: Path, logger: logging.Logger
+    ) -> None:
+        """Test that a diagram used by every edition is rendered once."""
+        (tmp_project / "README.md").write_text(
+            "# Test\n\n```mermaid\ngraph TD\n    A --> B\n```\n"
+        )
+        configs = [
+            EPUBConfig(
+                root_path=tmp_project,
+                output_path=tmp_project / f"edition-{i}.epub",
+                title=f"Edition {i}",
+                chapter_order=[("README.md", "Introduction")],
+            )
+            for i in range(3)
+        ]
+
+        with patch(
+            "build_epub.MermaidRenderer._fetch_with_retry",
+            new_callable=AsyncMock,
+            return_value=b"\x89PNG\r\n\x1a\n",
+        ) as fetch:
+            results = await build_batch_async(configs, logger)
+
+        assert results == [c.output_path for c in configs]
+        assert all(path.exists() for path in results)
+        assert fetch.await_count == 1
+
+
+# =============================================================================
+# Build Planning Tests
+# =============================================================================
+
+
+class TestBuildPlan:
+    """Tests for the persistent diagram cache and the --plan dry run."""
+
+    @pytest.fixture
+    def cached_config(self, config: EPUBConfig, tmp_path: Path) -> EPUBConfig:
+        (config.root_path / "README.md").write_text(
+            "# Test\n\n```mermaid\ngraph TD\n    A --> B\n```\n"
+        )
+        config.chapter_order = [("README.md", "Introduction")]
+        config.cache_dir = tmp_path / "cache"
+        return config
+
+    @staticmethod
+    def _fetch_patch() -> Any:
+        return patch(
+            "build_epub.MermaidRenderer._fetch_with_retry",
+            new_callable=AsyncMock,
+            return_value=b"\x89PNG\r\n\x1a\n",
+        )
+
+    @pytest.mark.asyncio
+    async def test_disk_cache_survives_between_builds(
+        self, cached_config: EPUBConfig, logger: logging.Logger, state: BuildState
+    ) -> None:
+        """Test that a later build (new process, new resources) reuses diagrams."""
+        with self._fetch_patch() as fetch:
+            await build_epub_async(cached_config, logger)
+            await build_epub_async(cached_config, logger, state)
+
+        assert fetch.await_count == 1
+        assert [d.cache for d in state.diagram_reports.values()] == ["hit"]
+
+    def test_disk_cache_prunes_stale_and_least_recent(self, tmp_path: Path) -> None:
+        """Test that pruning drops old diagrams, then the oldest beyond the size."""
+        disk = DiagramDiskCache(tmp_path, max_bytes=8, max_age=3600)
+        for key in ("stale", "old", "recent", "newest"):
+            disk.put(key, b"1234")
+        now = time.time()
+        for key, age in (("stale", 7200), ("old", 60), ("recent", 30), ("newest", 0)):
+            os.utime(disk.path(key), (now - age, now - age))
+
+        assert disk.prune() == 2
+        assert ("stale" in disk, "old" in disk) == (False, False)
+        assert ("recent" in disk, "newest" in disk) == (True, True)
+
+    @pytest.mark.asyncio
+    async def test_plan_leaves_queue_wait_out_of_diagram_time(
+        self, cached_config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        """Test that the estimate uses service time, not time queued for a slot."""
+        with self._fetch_patch():
+            await build_epub_async(cached_config, logger)
+        record_path = last_build_path(cached_config)
+        assert record_path is not None
+        record = json.loads(record_path.read_text())
+        record["diagrams"][0].update(cache="miss", seconds=5.0, wait_seconds=4.0)
+        record_path.write_text(json.dumps(record))
+        shutil.rmtree(cached_config.cache_dir / "diagrams")
+
+        plan = plan_build(cached_config, logger)
+
+        assert plan["estimated_stage_seconds"]["diagrams"] == 1.0
+
+    @pytest.mark.asyncio
+    async def test_plan_compares_with_last_build(
+        self, cached_config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        """Test changed chapters, cache misses and estimates after a build."""
+        assert plan_build(cached_config, logger)["estimated_seconds"] is None
+
+        with self._fetch_patch():
+            await build_epub_async(cached_config, logger)
+        plan = plan_build(cached_config, logger)
+
+        assert plan["chapters"]["changed"] == 0
+        assert plan["diagrams"] == {"total": 1, "cached": 1, "to_fetch": []}
+        assert plan["estimated_network_bytes"] == 0
+        assert plan["estimated_seconds"] is not None
+
+        readme = cached_config.root_path / "README.md"
+        readme.write_text(readme.read_text() + "\n```mermaid\ngraph LR\n  X\n```\n")
+        plan = plan_build(cached_config, logger)
+
+        assert plan["chapters"]["list"][0]["status"] == "changed"
+        assert plan["diagrams"]["to_fetch"] == [2]
+        assert plan["estimated_network_bytes"] > 8
+        assert "1 to fetch" in format_plan(plan)
+
+    def test_persistent_cache_is_opt_in(
+        self,
+        tmp_project: Path,
+        tmp_path: Path,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        """Test that only --cache-dir turns on the caches kept between builds."""
+        home = tmp_path / "cache-home"
+        monkeypatch.setenv("XDG_CACHE_HOME", str(home))
+        cache = tmp_path / "cache"
+
+        def config_for(*argv: str) -> EPUBConfig:
+            return config_from_args(build_parser().parse_args(list(argv)))
+
+        assert config_for().cache_dir is None
+        assert config_for().link_cache_path is None
+        assert config_for("--cache-dir", str(cache)).cache_dir == cache
+        assert config_for("--cache-dir", str(cache)).link_cache_path == (
+            cache / "links.json"
+        )
+        assert config_for("--cache-dir", str(cache), "--no-cache").cache_dir is None
+
+        output = tmp_path / "out.epub"
+        assert main(["--root", str(tmp_project), "-o", str(output)]) == 0
+        assert output.exists()
+        assert not home.exists()
+
+    def test_plan_skips_rendering_stack(
+        self, tmp_project: Path, tmp_path: Path
+    ) -> None:
+        """Test that --plan imports no rendering, network or packaging library."""
+        script = (
+            "import sys\n"
+            "import build_epub\n"
+            "status = build_epub.main(sys.argv[1:])\n"
+            "heavy = ('httpx', 'markdown', 'bs4', 'ebooklib', 'PIL', 'tenacity')\n"
+            "print([name for name in heavy if name in sys.modules], file=sys.stderr)\n"
+            "sys.exit(status)\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script, "--root", str(tmp_project)]
+            + ["--cache-dir", str(tmp_path / "cache"), "--plan", "json"],
+            cwd=Path(__file__).parent.parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        assert result.stderr.strip().endswith("[]")
+        assert json.loads(result.stdout)["chapters"]["total"] >= 1
+
+
+# =============================================================================
+# Build Daemon Tests
+# =============================================================================
+
+
+class TestBuildDaemon:
+    """Tests for the Unix-socket build daemon and its thin client."""
+
+    @pytest.fixture
+    def socket_path(self) -> Iterator[Path]:
+        # Unix socket paths are limited to ~100 bytes, so avoid deep tmp_path
+        with tempfile.TemporaryDirectory() as directory:
+            yield Path(directory) / "daemon.sock"
+
+    @staticmethod
+    async def _start(daemon: BuildDaemon) -> asyncio.Task[None]:
+        task = asyncio.ensure_future(daemon.serve_forever())
+        probe = (run_client, daemon.socket_path, None, Path.cwd())
+        while await asyncio.to_thread(*probe) is None:
+            await asyncio.sleep(0.01)
+        return task
+
+    def test_client_without_daemon(self, socket_path: Path) -> None:
+        """Test that the client reports no daemon so the CLI builds locally."""
+        assert run_client(socket_path, ["--verbose"], Path.cwd()) is None
+
+    def test_cli_uses_daemon_only_when_asked(
+        self, socket_path: Path, tmp_project: Path
+    ) -> None:
+        """Test that only --daemon contacts the socket, falling back locally."""
+        argv = ["--root", str(tmp_project), "--socket", str(socket_path)]
+        with (
+            patch("build_epub.run_client", return_value=7) as client,
+            patch(
+                "build_epub.run_build_async", new_callable=AsyncMock, return_value=0
+            ) as build,
+        ):
+            assert main(argv) == 0
+            client.assert_not_called()
+
+            assert main([*argv, "--daemon"]) == 7
+            assert build.await_count == 1
+
+            client.return_value = None
+            assert main([*argv, "--daemon"]) == 0
+            assert build.await_count == 2
+
+        with pytest.raises(SystemExit):
+            main([*argv, "--daemon", "--memory-profile", "profile.json"])
+
+    @pytest.mark.asyncio
+    async def test_concurrent_jobs_share_caches(
+        self,
+        socket_path: Path,
+        tmp_project: Path,
+        config: EPUBConfig,
+        logger: logging.Logger,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        """Test that concurrent jobs build separately but render diagrams once."""
+        (tmp_project / "README.md").write_text(
+            "# Test\n\n```mermaid\ngraph TD\n    A --> B\n```\n"
+        )
+        (tmp_project / "chapters.toml").write_text(
+            '[[chapter]]\ntitle = "Introduction"\npath = "README.md"\n'
+        )
+        daemon = BuildDaemon(socket_path, config, logger)
+
+        with patch(
+            "build_epub.MermaidRenderer._fetch_with_retry",
+            new_callable=AsyncMock,
+            return_value=b"\x89PNG\r\n\x1a\n",
+        ) as fetch:
+            task = await self._start(daemon)
+            try:
+                statuses = await asyncio.gather(
+                    *(
+                        asyncio.to_thread(
+                            run_client,
+                            socket_path,
+                            ["--root", ".", "--manifest", "chapters.toml"]
+                            + ["--output", f"edition-{i}.epub", "--daemon"],
+                            tmp_project,
+                        )
+                        for i in range(3)
+                    )
+                )
+            finally:
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+
+        assert statuses == [0, 0, 0]
+        assert all((tmp_project / f"edition-{i}.epub").exists() for i in range(3))
+        assert fetch.await_count == 1
+        assert capsys.readouterr().out.count("Successfully created") == 3
+        assert not socket_path.exists()
+
+    @pytest.mark.asyncio
+    async def test_failed_job_keeps_daemon_running(
+        self,
+        socket_path: Path,
+        tmp_path: Path,
+        config: EPUBConfig,
+        logger: logging.Logger,
+    ) -> None:
+        """Test that a failing job returns its status and the daemon serves on."""
+        daemon = BuildDaemon(socket_path, config, logger)
+        task = await self._start(daemon)
+        try:
+            missing = ["--root", str(tmp_path / "missing")]
+            status = await asyncio.to_thread(run_client, socket_path, missing, tmp_path)
+            alive = await asyncio.to_thread(run_client, socket_path, None, tmp_path)
+        finally:
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        assert status == 1
+        assert alive == 0
+
+    @staticmethod
+    def _send(socket_path: Path, request: dict[str, Any]) -> list[dict[str, Any]]:
+        """Send a raw job request and collect every message of the answer."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(str(socket_path))
+            with connection.makefile("rwb") as stream:
+                stream.write(json.dumps(request).encode() + b"\n")
+                stream.flush()
+                return [json.loads(line) for line in stream]
+
+    @pytest.mark.asyncio
+    async def test_jobs_need_absolute_paths_and_parse_errors_reach_client(
+        self,
+        socket_path: Path,
+        tmp_path: Path,
+        config: EPUBConfig,
+        logger: logging.Logger,
+        capsys: pytest.CaptureFixture[str],
+    ) -> None:
+        """Test that the daemon rejects relative jobs and answers usage itself."""
+        paths = {"cwd": str(tmp_path), "root": str(tmp_path), "output": "out.epub"}
+        task = await self._start(BuildDaemon(socket_path, config, logger))
+        try:
+            relative = await asyncio.to_thread(
+                self._send, socket_path, {"argv": [], **paths}
+            )
+            paths["output"] = str(tmp_path / "out.epub")
+            bogus = await asyncio.to_thread(
+                self._send, socket_path, {"argv": ["--bogus"], **paths}
+            )
+            usage = await asyncio.to_thread(
+                self._send, socket_path, {"argv": ["--help"], **paths}
+            )
+        finally:
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        assert relative[-1] == {"exit": 2}
+        assert "absolute paths" in relative[0]["log"]
+        assert bogus[-1] == {"exit": 2}
+        assert any("unrecognized arguments: --bogus" in m.get("log", "") for m in bogus)
+        assert usage[-1] == {"exit": 0}
+        assert usage[0]["stdout"].startswith("usage:")
+        daemon_output = capsys.readouterr()
+        assert "usage:" not in daemon_output.out + daemon_output.err
+
+    def test_client_gives_up_on_silent_daemon(
+        self, socket_path: Path, tmp_project: Path
+    ) -> None:
+        """Test that a daemon that accepts but never answers does not hang."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(str(socket_path))
+            server.listen()
+            status = run_client(
+                socket_path, ["--root", str(tmp_project)], tmp_project, timeout=0.1
+            )
+
+        assert status == 1
+
+    @pytest.mark.asyncio
+    async def test_jobs_use_their_own_cache_dir(
+        self,
+        socket_path: Path,
+        tmp_project: Path,
+        tmp_path: Path,
+        config: EPUBConfig,
+        logger: logging.Logger,
+    ) -> None:
+        """Test that a job's --cache-dir and --no-cache override the daemon's."""
+        (tmp_project / "README.md").write_text(
+            "# Test\n\n```mermaid\ngraph TD\n    A --> B\n```\n"
+        )
+        (tmp_project / "chapters.toml").write_text(
+            '[[chapter]]\ntitle = "Introduction"\npath = "README.md"\n'
+        )
+        daemon_cache = tmp_path / "daemon-cache"
+        job_cache = tmp_path / "job-cache"
+        config = dataclasses.replace(config, cache_dir=daemon_cache)
+        daemon = BuildDaemon(socket_path, config, logger)
+        argv = ["--root", ".", "--manifest", "chapters.toml"]
+
+        with patch(
+            "build_epub.MermaidRenderer._fetch_with_retry",
+            new_callable=AsyncMock,
+            return_value=b"\x89PNG\r\n\x1a\n",
+        ):
+            task = await self._start(daemon)
+            try:
+                statuses = [
+                    await asyncio.to_thread(
+                        run_client, socket_path, [*argv, *options], tmp_project
+                    )
+                    for options in (["--cache-dir", str(job_cache)], ["--no-cache"])
+                ]
+            finally:
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+
+        assert statuses == [0, 0]
+        assert len(list((job_cache / "diagrams").glob("*.png"))) == 1
+        assert not daemon_cache.exists()
+
+    @pytest.mark.asyncio
+    async def test_socket_is_private_from_the_start(
+        self, socket_path: Path, config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        """Test that the socket and a directory created for it are owner-only."""
+        nested = socket_path.parent / "run" / "daemon.sock"
+        task = await self._start(BuildDaemon(nested, config, logger))
+        try:
+            socket_mode = nested.stat().st_mode
+            directory_mode = nested.parent.stat().st_mode
+        finally:
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        assert socket_mode & 0o077 == 0
+        assert directory_mode & 0o777 == 0o700
+
+    @pytest.mark.asyncio
+    async def test_stale_socket_is_replaced(
+        self, socket_path: Path, config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        """Test that a socket file left by a dead daemon does not block startup."""
+        socket_path.write_text("")
+        task = await self._start(BuildDaemon(socket_path, config, logger))
+        try:
+            alive = await asyncio.to_thread(run_client, socket_path, None, Path.cwd())
+        finally:
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        assert alive == 0
+
+
+# =============================================================================
+# External Link Checking Tests
+# =============================================================================
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Local stand-in for external sites.
+
+    ``/ok`` answers anything, ``/no-head`` refuses HEAD, ``/missing`` is a
+    404 and ``/slow`` takes a moment so concurrency can be observed.
+    """
+
+    requests: ClassVar[list[tuple[str, str]]] = []
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def do_HEAD(self) -> None:
+        self._respond("HEAD")
+
+    def do_GET(self) -> None:
+        self._respond("GET")
+
+    def _respond(self, method: str) -> None:
+        cls = type(self)
+        with cls.lock:
+            cls.requests.append((method, self.path))
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            if self.path.startswith("/slow"):
+                time.sleep(0.05)
+            if self.path == "/missing" or (
+                self.path == "/no-head" and method == "HEAD"
+            ):
+                status = 404 if self.path == "/missing" else 405
+            else:
+                status = 200
+            self.send_response(status)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            if method == "GET":
+                self.wfile.write(b"ok")
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def stub_server() -> Iterator[str]:
+    """Serve ``_StubHandler`` on a free local port; yield its base URL."""
+    _StubHandler.requests = []
+    _StubHandler.active = _StubHandler.max_active = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class TestLinkChecker:
+    """Tests for the external link checker."""
+
+    @pytest.mark.asyncio
+    async def test_head_then_get_fallback(
+        self, stub_server: str, config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        """Test that HEAD is tried first and GET only when HEAD is refused."""
+        checker = LinkChecker(config, logger)
+
+        results = await checker.check_all(
+            [f"{stub_server}/ok", f"{stub_server}/no-head", f"{stub_server}/missing"]
+        )
+
+        assert results[f"{stub_server}/ok"].status == 200
+        assert results[f"{stub_server}/no-head"].status == 200
+        assert results[f"{stub_server}/missing"].status == 404
+        assert not results[f"{stub_server}/missing"].ok
+        assert ("GET", "/ok") not in _StubHandler.requests
+        assert ("GET", "/no-head") in _StubHandler.requests
+
+    @pytest.mark.asyncio
+    async def test_per_host_limit(
+        self, stub_server: str, config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        """Test that no more than ``max_requests_per_host`` run at once."""
+        config.max_requests_per_host = 2
+        urls = [f"{stub_server}/slow/{i}" for i in range(8)]
+
+        results = await LinkChecker(config, logger).check_all(urls)
+
+        assert all(result.ok for result in results.values())
+        assert _StubHandler.max_active == 2
+
+    @pytest.mark.asyncio
+    async def test_unreachable_host(
+        self, config: EPUBConfig, logger: logging.Logger
+    ) -> None:
+        """Test that connection errors are reported, not raised."""
+        config.request_timeout = 2.0
+
+        results = await LinkChecker(config, logger).check_all(["http://127.0.0.1:9/"])
+
+        assert results["http://127.0.0.1:9/"].status is None
+        assert results["http://127.0.0.1:9/"].error
+
+    @pytest.mark.asyncio
+    async def test_cache_rechecks_only_expired_entries(
+        self,
+        stub_server: str,
+        config: EPUBConfig,
+        logger: logging.Logger,
+        tmp_path: Path,
+    ) -> None:
+        """Test that fresh successes come from the cache and failures do not."""
+        cache_path = tmp_path / "cache" / "links.json"
+        urls = [f"{stub_server}/ok", f"{stub_server}/missing"]
+
+        await LinkChecker(config, logger, LinkCache(cache_path, 3600)).check_all(urls)
+        _StubHandler.requests.clear()
+        await LinkChecker(config, logger, LinkCache(cache_path, 3600)).check_all(urls)
+
+        assert _StubHandler.requests == [("HEAD", "/missing"), ("GET", "/missing")]
+
+        _StubHandler.requests.clear()
+        expired = LinkCache(cache_path, 3600)
+        assert expired.get(urls[0], time.time() + 7200) is None
+        await LinkChecker(config, logger, LinkCache(cache_path, 0)).check_all(urls)
+
+        assert ("HEAD", "/ok") in _StubHandler.requests
+
+    @pytest.mark.asyncio
+    async def test_build_reports_broken_links(
+        self,
+        stub_server: str,
+        config: EPUBConfig,
+        logger: logging.Logger,
+        state: BuildState,
+    ) -> None:
+        """Test that a build with --check-links records broken links by source."""
+        (config.root_path / "README.md").write_text(
+            f"# Test\n\n[fine]({stub_server}/ok) and "
+            f"[gone]({stub_server}/missing#section)\n"
+        )
+        config.chapter_order = [("README.md", "Introduction")]
+        config.check_links = True
+
+        await build_epub_async(config, logger, state)
+
+        assert broken_link_report(state) == {
+            f"{stub_server}/missing": {
+                "status": 404,
+                "error": None,
+                "sources": ["README.md"],
+            }
+        }
+
+
 # =============================================================================
 # Run tests
 # =============================================================================